@@ -0,0 +1,79 @@
+# DIY Streamdeck action runner code for a Mac
+# L. Hennigs and ChatGPT 4.0
+# last changed: 10-19-26
+# https://github.com/LennartHennigs/DIYStreamDeck
+
+# An action list of a key is sent as a JSON list in a single Run: line:
+#   Run: ["hue.off 'Desk'", "spotify.pause", "then sounds.play 'movie.mp3'"]
+# Commands of different plugins run at the same time, commands of the same plugin
+# one after another. A step starting with "then " waits until all steps before it are done.
+
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import time
+from event_log import log
+
+THEN = 'then '
+ACTION_WORKERS = 4
+
+# (position in the list, command)
+Step = Tuple[int, str]
+
+
+class ActionRunner:
+    """
+    Runs action lists in the background, one list after another.
+    run_command(command) runs a single plugin command and returns an error message or None.
+    """
+    run_command: Callable[[str], Optional[str]]
+
+    def __init__(self, run_command: Callable[[str], Optional[str]], workers: int = ACTION_WORKERS) -> None:
+        self.run_command = run_command
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='actions')
+        # a second list waits for the first, like two presses of a single command key
+        self.batches = ThreadPoolExecutor(max_workers=1, thread_name_prefix='action-lists')
+
+    def run(self, steps: List[str]) -> Future:
+        return self.batches.submit(self.run_batch, steps)
+
+    # The stages of an action list, each with the commands of a plugin in their order
+    def plan(self, steps: List[str]) -> List[List[List[Step]]]:
+        stages = []
+        for index, step in enumerate(steps):
+            step = step.strip()
+            if step.startswith(THEN) or not stages:
+                stages.append({})
+                step = step[len(THEN):].strip() if step.startswith(THEN) else step
+            stages[-1].setdefault(step.split('.')[0], []).append((index, step))
+        return [list(groups.values()) for groups in stages]
+
+    # Run an action list and wait for it, returns the total time and the result of each step
+    def run_batch(self, steps: List[str]) -> Dict[str, Any]:
+        started = time.perf_counter()
+        results = []
+        for stage in self.plan(steps):
+            futures = [self.executor.submit(self._run_group, group) for group in stage]
+            for future in futures:
+                results.extend(future.result())
+        total_ms = (time.perf_counter() - started) * 1000
+        results.sort(key=lambda result: result['step'])
+        log.info('actions', f"Ran {len(results)} commands in {total_ms:.0f} ms: " + ', '.join(
+            f"{result['command']} {'failed' if result['error'] else 'ok'} {result['ms']:.0f} ms" for result in results),
+            total_ms=total_ms, steps=results)
+        return {'total_ms': total_ms, 'steps': results}
+
+    def stop(self) -> None:
+        self.batches.shutdown(wait=False)
+        self.executor.shutdown(wait=False)
+
+    def _run_group(self, group: List[Step]) -> List[Dict[str, Any]]:
+        results = []
+        for index, command in group:
+            started = time.perf_counter()
+            try:
+                error = self.run_command(command)
+            except Exception as e:
+                error = str(e)
+            results.append({'step': index, 'command': command, 'error': error,
+                            'ms': (time.perf_counter() - started) * 1000})
+        return results
@@ -0,0 +1,142 @@
+# DIY Streamdeck app launcher code for a Mac
+# L. Hennigs and ChatGPT 4.0
+# last changed: 10-19-26
+# https://github.com/LennartHennigs/DIYStreamDeck
+
+from abc import ABC, abstractmethod
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Set, Tuple
+import subprocess
+import threading
+import time
+from event_log import log
+
+LAUNCH_WORKERS = 2
+
+
+class LauncherBackend(ABC):
+    """
+    Starts applications, always called on a worker thread of the AppLauncher.
+    """
+    @abstractmethod
+    def launch(self, app_name: str) -> None:
+        """
+        Starts or activates the app, raises an exception if that fails.
+        """
+        pass
+
+    # Start the app without activating it, e.g. to have it ready for the first key press
+    def prewarm(self, app_name: str) -> None:
+        self.launch(app_name)
+
+
+class OpenLauncher(LauncherBackend):
+    """
+    Uses the macOS open command.
+    """
+    def launch(self, app_name: str) -> None:
+        subprocess.run(["open", "-a", app_name], check=True, capture_output=True)
+
+    def prewarm(self, app_name: str) -> None:
+        # -g: don't bring it to the foreground, -j: launch it hidden
+        subprocess.run(["open", "-g", "-j", "-a", app_name], check=True, capture_output=True)
+
+
+class StubLauncher(LauncherBackend):
+    """
+    Records the launches instead of starting apps, to run the launcher without a Mac.
+    """
+    delay: float
+    failing: Set[str]
+    launched: List[str]
+    prewarmed: List[str]
+
+    def __init__(self, delay: float = 0, failing: Optional[Set[str]] = None) -> None:
+        self.delay = delay
+        self.failing = failing or set()
+        self.launched = []
+        self.prewarmed = []
+
+    def launch(self, app_name: str) -> None:
+        self._start(app_name)
+        self.launched.append(app_name)
+
+    def prewarm(self, app_name: str) -> None:
+        self._start(app_name)
+        self.prewarmed.append(app_name)
+
+    def _start(self, app_name: str) -> None:
+        if self.delay:
+            time.sleep(self.delay)
+        if app_name in self.failing:
+            raise RuntimeError(f"Unable to find application named '{app_name}'")
+
+
+class AppLauncher:
+    """
+    Launches apps in the background, so a slow launch doesn't block the serial connection.
+    A launch of an app that is still being launched returns the running launch.
+    Launches and prewarms are tracked separately, a hidden prewarm never stands in for a launch.
+    """
+    backend: LauncherBackend
+    prewarm_apps: List[str]
+    in_flight: Dict[Tuple[str, str], Future]
+    timings: Dict[Tuple[str, str], List[float]]
+
+    def __init__(self, backend: LauncherBackend, prewarm_apps: Optional[List[str]] = None,
+                 workers: int = LAUNCH_WORKERS) -> None:
+        self.backend = backend
+        self.prewarm_apps = prewarm_apps or []
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='launcher')
+        self.lock = threading.Lock()
+        self.in_flight = {}
+        # (action, app) -> [count, total, max, last] in seconds, prewarms are kept apart from launches
+        self.timings = {}
+
+    def launch(self, app_name: str) -> Future:
+        return self._submit(app_name, self.backend.launch, 'Launched')
+
+    # Start the prewarm apps hidden, or a single one of them again
+    def prewarm(self, app_name: Optional[str] = None) -> None:
+        for name in [app_name] if app_name else self.prewarm_apps:
+            self._submit(name, self.backend.prewarm, 'Prewarmed')
+
+    # Keep the prewarm apps running, called when an app has been terminated
+    def app_terminated(self, app_name: str) -> None:
+        if app_name in self.prewarm_apps:
+            self.prewarm(app_name)
+
+    # Count and times in ms per action ('Launched' or 'Prewarmed') and app
+    def stats(self) -> Dict[Tuple[str, str], Dict[str, float]]:
+        with self.lock:
+            return {key: {'count': count, 'avg_ms': total / count * 1000, 'max_ms': maximum * 1000, 'last_ms': last * 1000}
+                    for key, (count, total, maximum, last) in self.timings.items()}
+
+    def stop(self) -> None:
+        self.executor.shutdown(wait=False)
+
+    def _submit(self, app_name: str, start: Callable[[str], None], action: str) -> Future:
+        with self.lock:
+            future = self.in_flight.get((action, app_name))
+            if future is not None:
+                log.debug('launcher', f"{app_name} is already being {action.lower()}")
+                return future
+            future = self.executor.submit(self._run, app_name, start, action)
+            self.in_flight[(action, app_name)] = future
+            return future
+
+    def _run(self, app_name: str, start: Callable[[str], None], action: str) -> None:
+        started = time.perf_counter()
+        try:
+            start(app_name)
+        except Exception as e:
+            log.warning('launcher', f"Failed to launch {app_name}: {e}")
+            return
+        finally:
+            with self.lock:
+                self.in_flight.pop((action, app_name), None)
+        duration = time.perf_counter() - started
+        with self.lock:
+            count, total, maximum, _ = self.timings.get((action, app_name), (0, 0.0, 0.0, 0.0))
+            self.timings[(action, app_name)] = [count + 1, total + duration, max(maximum, duration), duration]
+        log.debug('launcher', f"{action} {app_name} in {duration * 1000:.0f} ms", app=app_name, ms=duration * 1000)
@@ -0,0 +1,131 @@
+# DIY Streamdeck event log code for a Mac
+# L. Hennigs and ChatGPT 4.0
+# last changed: 10-19-26
+# https://github.com/LennartHennigs/DIYStreamDeck
+
+# Events are kept in a ring buffer in memory. A background thread prints them
+# and, if a log file is set, appends them as JSON lines:
+#   {"ts": 1792400000.123, "level": "INFO", "sub": "watchdog", "msg": "Active app: Safari", ...}
+
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+import json
+import queue
+import threading
+import time
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+LEVELS = {'DEBUG': DEBUG, 'INFO': INFO, 'WARNING': WARNING, 'ERROR': ERROR}
+LEVEL_NAMES = {value: name for name, value in LEVELS.items()}
+
+EVENT_LOG_SIZE = 1000
+
+
+class EventLog:
+    """
+    Structured log with levels and subsystem tags. Logging only appends to the
+    ring buffer and a queue, printing and writing happen on the sink thread.
+    """
+    level: int
+    echo_level: int
+    path: Optional[str]
+    events: Deque[Dict[str, Any]]
+
+    def __init__(self, capacity: int = EVENT_LOG_SIZE, level: int = DEBUG, echo_level: int = INFO,
+                 path: Optional[str] = None) -> None:
+        self.level = level
+        self.echo_level = echo_level
+        self.path = path
+        self.events = deque(maxlen=capacity)
+        self.queue = queue.Queue()
+        self.sink = None
+        self.lock = threading.Lock()
+
+    # Change the settings, e.g. from the command line arguments
+    def configure(self, level: Optional[int] = None, echo_level: Optional[int] = None,
+                  path: Optional[str] = None, capacity: Optional[int] = None) -> None:
+        if level is not None:
+            self.level = level
+        if echo_level is not None:
+            self.echo_level = echo_level
+        if path is not None:
+            self.path = path
+        if capacity is not None:
+            self.events = deque(self.events, maxlen=capacity)
+
+    def log(self, level: int, subsystem: str, message: str, **fields: Any) -> None:
+        if level < self.level:
+            return
+        event = {'ts': time.time(), 'level': LEVEL_NAMES.get(level, str(level)), 'sub': subsystem, 'msg': message}
+        if fields:
+            event.update(fields)
+        self.events.append(event)
+        if level >= self.echo_level or self.path:
+            if self.sink is None:
+                self._start_sink()
+            self.queue.put((level, event))
+
+    def debug(self, subsystem: str, message: str, **fields: Any) -> None:
+        self.log(DEBUG, subsystem, message, **fields)
+
+    def info(self, subsystem: str, message: str, **fields: Any) -> None:
+        self.log(INFO, subsystem, message, **fields)
+
+    def warning(self, subsystem: str, message: str, **fields: Any) -> None:
+        self.log(WARNING, subsystem, message, **fields)
+
+    def error(self, subsystem: str, message: str, **fields: Any) -> None:
+        self.log(ERROR, subsystem, message, **fields)
+
+    # The last events, optionally filtered by minimum level and subsystem
+    def recent(self, count: int = 100, level: int = DEBUG, subsystem: Optional[str] = None) -> List[Dict[str, Any]]:
+        events = [event for event in list(self.events)
+                  if LEVELS.get(event['level'], 0) >= level and (subsystem is None or event['sub'] == subsystem)]
+        return events[-count:]
+
+    # Print the last events, e.g. to look into a latency spike without verbose mode
+    def dump(self, count: int = 100, level: int = DEBUG, subsystem: Optional[str] = None) -> None:
+        for event in self.recent(count, level, subsystem):
+            print(self.format(event))
+
+    def format(self, event: Dict[str, Any]) -> str:
+        timestamp = time.strftime('%H:%M:%S', time.localtime(event['ts'])) + f".{int(event['ts'] * 1000) % 1000:03d}"
+        extra = ''.join(f" {key}={value}" for key, value in event.items() if key not in ('ts', 'level', 'sub', 'msg'))
+        return f"{timestamp} {event['level']:7} [{event['sub']}] {event['msg']}{extra}"
+
+    # Wait until all queued events have been printed and written
+    def flush(self) -> None:
+        if self.sink is not None:
+            self.queue.join()
+
+    def _start_sink(self) -> None:
+        with self.lock:
+            if self.sink is None:
+                self.sink = threading.Thread(target=self._write_events, daemon=True)
+                self.sink.start()
+
+    def _write_events(self) -> None:
+        log_file = None
+        while True:
+            level, event = self.queue.get()
+            try:
+                if level >= self.echo_level:
+                    print(event['msg'])
+                if self.path:
+                    if log_file is None:
+                        log_file = open(self.path, 'a')
+                    log_file.write(json.dumps(event, default=str) + '\n')
+                    if self.queue.empty():
+                        log_file.flush()
+            except OSError as e:
+                print(f"Error writing the event log: {e}")
+                self.path = None
+            finally:
+                self.queue.task_done()
+
+
+# shared by all modules of a process
+log = EventLog()
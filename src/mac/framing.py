@@ -0,0 +1,342 @@
+# DIY Streamdeck framed serial protocol for a Mac
+# L. Hennigs and ChatGPT 4.0
+# last changed: 10-19-26
+# https://github.com/LennartHennigs/DIYStreamDeck
+
+# A frame looks like this (the payload is UTF-8, everything else is ASCII):
+#
+#   ~ <type> <seq: 2 hex> <length: 4 hex> <payload> <crc32: 8 hex> \n
+#
+# Types are D (data), S (data that starts a new sequence), A (ack), N (nak)
+# and R (the receiver does not know the sequence yet and asks for a new S frame).
+# Every data frame is acknowledged, gaps in the sequence are answered with a NAK
+# and only the missing frames are sent again. The outgoing encoding is negotiated
+# with a "Proto: framed" line, "Proto: text" switches back. Once framed, plain
+# text lines are dropped like damaged frames, only the "Proto:" lines and the
+# control lines given to the link are still accepted. A payload never contains a
+# line break, so a damaged frame always ends at the next one.
+
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional, Sequence, Tuple
+import binascii
+import random
+import threading
+import time
+
+PROTO_FRAMED = "Proto: framed"
+PROTO_TEXT = "Proto: text"
+
+FRAME_START = 0x7E  # ~
+NEWLINE = 0x0A
+DATA = 'D'
+SYNC = 'S'
+ACK = 'A'
+NAK = 'N'
+RESYNC = 'R'
+HEADER_LENGTH = 8
+CRC_LENGTH = 8
+MAX_PAYLOAD = 1024
+MAX_FRAME_LENGTH = HEADER_LENGTH + MAX_PAYLOAD + CRC_LENGTH + 1
+WINDOW = 16
+RETRANSMIT_TIMEOUT = 0.5
+MAX_RETRIES = 5
+
+
+def encode_frame(frame_type: str, seq: int, payload: bytes = b'') -> bytes:
+    header = f'{frame_type}{seq:02X}{len(payload):04X}'.encode('ascii')
+    crc = binascii.crc32(header + payload)
+    return b'~' + header + payload + f'{crc:08X}\n'.encode('ascii')
+
+
+class FramedLink:
+    """
+    One end of the serial connection. Sends either text lines or frames, accepts
+    frames and, until the link is framed, text lines. Messages sent while the
+    negotiation is running wait for its answer. All methods are thread safe.
+    """
+    write: Callable[[bytes], None]
+    control: Tuple[str, ...]
+    framed: bool
+    requested: bool
+    unacked: Dict[int, List]
+    waiting: Deque[bytes]
+    out_of_order: Dict[int, bytes]
+    expected: Optional[int]
+    stats: Dict[str, int]
+
+    def __init__(self, write: Callable[[bytes], None], framed: bool = False, control: Sequence[str] = ()) -> None:
+        self.write = write
+        self.framed = framed
+        # text lines that are accepted on a framed link, e.g. "Ready" of a restarted keypad
+        self.control = (PROTO_FRAMED, PROTO_TEXT) + tuple(control)
+        self.requested = False
+        self.requested_at = 0.0
+        self.request_retries = 0
+        self.lock = threading.RLock()
+        self.buffer = bytearray()
+        # sender state, a random start makes it unlikely to be mistaken for an old sequence
+        self.next_seq = random.randrange(256)
+        self.synced = False
+        self.unacked = {}
+        self.waiting = deque()
+        # receiver state
+        self.expected = None
+        self.sync_seq = None
+        self.out_of_order = {}
+        self.stats = {'sent': 0, 'received': 0, 'retransmits': 0, 'crc_errors': 0, 'dropped': 0, 'discarded': 0}
+
+    # Ask the other side to switch to frames, we switch once it answers
+    # Both sides start new sequences with the negotiation
+    def request_framed(self) -> None:
+        with self.lock:
+            self._reset_sequences()
+            self.requested = True
+            self.request_retries = 0
+            self.requested_at = time.monotonic()
+            self.write((PROTO_FRAMED + '\n').encode('ascii'))
+
+    # Go back to text lines, e.g. after the device has been reset
+    def reset(self) -> None:
+        with self.lock:
+            self.framed = False
+            self.requested = False
+            self.waiting.clear()
+            self.buffer.clear()
+            self._reset_sequences()
+
+    def _reset_sequences(self) -> None:
+        self.synced = False
+        self.unacked.clear()
+        self._reset_receiver()
+
+    def _reset_receiver(self) -> None:
+        self.expected = None
+        self.sync_seq = None
+        self.out_of_order.clear()
+
+    def send(self, message: str) -> None:
+        with self.lock:
+            if not self.framed and not self.requested:
+                self._send_text(message)
+                return
+            self.waiting.append(message.encode('utf-8'))
+            self._fill_window()
+
+    def _send_text(self, message: str) -> None:
+        self.write((message + '\n').encode('ascii', 'replace'))
+        self.stats['sent'] += 1
+
+    # The other side answered the negotiation or sent a valid frame
+    def _start_framed(self) -> None:
+        self.framed = True
+        self._fill_window()
+
+    # Feed received bytes, returns the received messages in order
+    def receive(self, data: bytes) -> List[str]:
+        messages = []
+        with self.lock:
+            self.buffer.extend(data)
+            while self.buffer:
+                if self.buffer[0] == FRAME_START:
+                    if not self._read_frame(messages):
+                        break
+                else:
+                    newline = self.buffer.find(b'\n')
+                    if newline < 0:
+                        if self.framed and len(self.buffer) > MAX_FRAME_LENGTH:
+                            # not even a frame is that long
+                            self._drop_corrupt(len(self.buffer))
+                        break
+                    line = bytes(self.buffer[:newline]).decode('utf-8', 'replace').strip()
+                    if self.framed and line not in self.control:
+                        # the rest of a frame with a damaged start, never deliver it unchecked
+                        self._drop_corrupt(newline + 1)
+                        continue
+                    del self.buffer[:newline + 1]
+                    if line:
+                        self._received_text(line, messages)
+        return messages
+
+    # Send unacknowledged frames again after a timeout
+    def poll(self) -> None:
+        now = time.monotonic()
+        with self.lock:
+            if self.requested and not self.framed and now - self.requested_at >= RETRANSMIT_TIMEOUT:
+                if self.request_retries < MAX_RETRIES:
+                    # the request or the answer got lost
+                    self.request_retries += 1
+                    self.requested_at = now
+                    self.write((PROTO_FRAMED + '\n').encode('ascii'))
+                else:
+                    # the other side doesn't support frames, send the waiting messages as text
+                    self.requested = False
+                    while self.waiting:
+                        self._send_text(self.waiting.popleft().decode('utf-8'))
+            for seq, entry in list(self.unacked.items()):
+                if now - entry[1] < RETRANSMIT_TIMEOUT:
+                    continue
+                if entry[2] >= MAX_RETRIES:
+                    del self.unacked[seq]
+                    self.stats['dropped'] += 1
+                    # the receiver would wait for the dropped frame, so start a new sequence
+                    self._resync()
+                    continue
+                self._retransmit(seq)
+            self._fill_window()
+
+    # Send the oldest unacknowledged frame again as the start of a new sequence
+    def _resync(self) -> None:
+        if not self.unacked:
+            self.synced = False
+            return
+        oldest = max(self.unacked, key=lambda seq: (self.next_seq - seq) % 256)
+        self.unacked[oldest][0] = encode_frame(SYNC, oldest, self.unacked[oldest][3])
+        self._retransmit(oldest)
+
+    def pending(self) -> int:
+        with self.lock:
+            return len(self.unacked) + len(self.waiting)
+
+    # The window starts at the oldest unacknowledged frame, so the receiver
+    # never has to buffer more than WINDOW frames
+    def _window_span(self) -> int:
+        return max(((self.next_seq - seq) % 256 for seq in self.unacked), default=0)
+
+    def _fill_window(self) -> None:
+        if not self.framed:
+            return
+        while self.waiting and self._window_span() < WINDOW:
+            payload = self.waiting.popleft()
+            seq = self.next_seq
+            self.next_seq = (seq + 1) % 256
+            frame = encode_frame(DATA if self.synced else SYNC, seq, payload)
+            self.synced = True
+            self.unacked[seq] = [frame, time.monotonic(), 0, payload]
+            self.write(frame)
+            self.stats['sent'] += 1
+
+    def _retransmit(self, seq: int) -> None:
+        entry = self.unacked[seq]
+        entry[1] = time.monotonic()
+        entry[2] += 1
+        self.write(entry[0])
+        self.stats['retransmits'] += 1
+
+    # Parse the frame at the start of the buffer, returns False if it is incomplete
+    def _read_frame(self, messages: List[str]) -> bool:
+        newline = self.buffer.find(b'\n', 1)
+        if len(self.buffer) < HEADER_LENGTH:
+            return self._skip_corrupt_frame(newline) if newline >= 0 else False
+        header = bytes(self.buffer[1:HEADER_LENGTH])
+        try:
+            seq = int(header[1:3], 16)
+            length = int(header[3:7], 16)
+        except ValueError:
+            length = MAX_PAYLOAD + 1
+        end = HEADER_LENGTH + length + CRC_LENGTH
+        if length > MAX_PAYLOAD or 0 <= newline < end:
+            return self._skip_corrupt_frame(newline)
+        if len(self.buffer) <= end:
+            return False
+        payload = bytes(self.buffer[HEADER_LENGTH:HEADER_LENGTH + length])
+        crc = bytes(self.buffer[HEADER_LENGTH + length:end])
+        if self.buffer[end] != NEWLINE or crc != f'{binascii.crc32(header + payload):08X}'.encode('ascii'):
+            return self._skip_corrupt_frame(newline)
+        del self.buffer[:end + 1]
+        self._received_frame(chr(header[0]), seq, payload, messages)
+        return True
+
+    # Drop a damaged frame up to its line break, returns False to wait for the rest of it
+    def _skip_corrupt_frame(self, newline: int) -> bool:
+        if newline < 0:
+            if len(self.buffer) <= MAX_FRAME_LENGTH:
+                return False
+            newline = len(self.buffer) - 1
+        self._drop_corrupt(newline + 1)
+        return True
+
+    # Drop the start of the buffer and ask for the expected frame again
+    def _drop_corrupt(self, length: int) -> None:
+        self.stats['crc_errors'] += 1
+        del self.buffer[:length]
+        if self.expected is not None:
+            self.write(encode_frame(NAK, self.expected))
+
+    def _received_frame(self, frame_type: str, seq: int, payload: bytes, messages: List[str]) -> None:
+        if self.requested and not self.framed:
+            # the answer to the negotiation got lost, but the other side sends frames
+            self._start_framed()
+        if frame_type == ACK:
+            self.unacked.pop(seq, None)
+            self._fill_window()
+            return
+        if frame_type == NAK:
+            if seq in self.unacked:
+                self._retransmit(seq)
+            return
+        if frame_type == RESYNC:
+            self._resync()
+            return
+        if frame_type not in (DATA, SYNC):
+            return
+        if frame_type == DATA and self.expected is None:
+            self.write(encode_frame(RESYNC, seq))
+            return
+        self.write(encode_frame(ACK, seq))
+        if frame_type == SYNC:
+            self._received_sync(seq, messages)
+        distance = (seq - self.expected) % 256
+        if distance >= WINDOW:
+            # already delivered
+            return
+        if distance > 0:
+            self.out_of_order[seq] = payload
+            for missing in range(distance):
+                missing_seq = (self.expected + missing) % 256
+                if missing_seq not in self.out_of_order:
+                    self.write(encode_frame(NAK, missing_seq))
+            return
+        self._received_text(payload.decode('utf-8', 'replace'), messages)
+        self.expected = (self.expected + 1) % 256
+        while self.expected in self.out_of_order:
+            self._received_text(self.out_of_order.pop(self.expected).decode('utf-8', 'replace'), messages)
+            self.expected = (self.expected + 1) % 256
+
+    # The sender has started a new sequence
+    def _received_sync(self, seq: int, messages: List[str]) -> None:
+        if self.expected is None:
+            self.expected = seq
+        elif seq == self.sync_seq or 0 < (self.expected - seq) % 256 <= WINDOW:
+            # a retransmission of a frame that has already been delivered
+            return
+        else:
+            # deliver what has been received before the new start, keep the rest
+            distance = (seq - self.expected) % 256
+            for old_seq in sorted(self.out_of_order, key=lambda s: (s - self.expected) % 256):
+                if (old_seq - self.expected) % 256 < distance:
+                    self._received_text(self.out_of_order.pop(old_seq).decode('utf-8', 'replace'), messages)
+            self.expected = seq
+        self.sync_seq = seq
+
+    def _received_text(self, message: str, messages: List[str]) -> None:
+        self.stats['received'] += 1
+        if message == PROTO_FRAMED:
+            if not self.requested:
+                # the other side has (re)started, answer and expect a new sequence
+                # frames that are still unacknowledged are sent again as a new sequence once asked for
+                self._reset_receiver()
+                if not self.unacked:
+                    self.synced = False
+                self.write((PROTO_FRAMED + '\n').encode('ascii'))
+            if not self.framed:
+                self._start_framed()
+            return
+        if message == PROTO_TEXT:
+            # the other side has restarted with text lines, it won't acknowledge any frames
+            self.stats['discarded'] += len(self.unacked) + len(self.waiting)
+            self.framed = False
+            self.requested = False
+            self.waiting.clear()
+            self._reset_sequences()
+            return
+        messages.append(message)
@@ -0,0 +1,185 @@
+# DIY Streamdeck keypad connection code for a Mac
+# L. Hennigs and ChatGPT 4.0
+# last changed: 10-19-26
+# https://github.com/LennartHennigs/DIYStreamDeck
+
+from contextlib import contextmanager
+from typing import Iterator, List, Optional, Sequence, Tuple
+import os
+import time
+import serial
+from framing import FramedLink, PROTO_TEXT
+from link_monitor import LinkMonitor, HEARTBEAT_INTERVAL, HEARTBEAT_MAX_INTERVAL
+from event_log import log
+
+RECONNECT_MIN_DELAY = 0.1
+RECONNECT_MAX_DELAY = 5.0
+
+# sent by the keypad after it has (re)started
+READY = "Ready"
+# the answer of the keypad to a ping
+PONG = "Pong: "
+
+
+class KeypadDevice:
+    """
+    A keypad connected to a serial port, with its own protocol link and rotation.
+    Write and read errors mark the keypad as failed, the watchdog then closes the
+    port and reopens it with an increasing delay once the device is back.
+    """
+    port: str
+    baud_rate: int
+    rotate: Optional[str]
+    protocol: str
+    ser: Optional[serial.Serial]
+    link: FramedLink
+    monitor: LinkMonitor
+    failed: bool
+    batch: Optional[List[bytes]]
+
+    def __init__(self, port: str, baud_rate: int, rotate: Optional[str] = None, protocol: str = 'text',
+                 heartbeat_interval: float = HEARTBEAT_INTERVAL, heartbeat_max_interval: float = HEARTBEAT_MAX_INTERVAL) -> None:
+        self.port = port
+        self.baud_rate = baud_rate
+        self.rotate = rotate
+        self.protocol = protocol
+        self.ser = None
+        self.failed = False
+        self.batch = None
+        self.reconnect_delay = RECONNECT_MIN_DELAY
+        self.next_reconnect = 0.0
+        self.link = FramedLink(self._write, control=(READY,))
+        self.monitor = LinkMonitor(port, heartbeat_interval, heartbeat_max_interval)
+
+    @property
+    def connected(self) -> bool:
+        return self.ser is not None and not self.failed
+
+    # The serial port is registered with the selector of the watchdog
+    def fileno(self) -> int:
+        return self.ser.fileno()
+
+    # Open the serial port, returns False if it is not available
+    def connect(self) -> bool:
+        try:
+            self.ser = serial.Serial(self.port, self.baud_rate, timeout=1)
+        except (serial.SerialException, OSError):
+            self.ser = None
+            return False
+        self.failed = False
+        self.reconnect_delay = RECONNECT_MIN_DELAY
+        self.link.reset()
+        self.monitor.reset(time.monotonic())
+        return True
+
+    # Close the serial port after an error
+    def disconnect(self) -> None:
+        if self.ser is not None:
+            try:
+                self.ser.close()
+            except (serial.SerialException, OSError):
+                pass
+        self.ser = None
+        self.failed = False
+        self.next_reconnect = time.monotonic() + self.reconnect_delay
+
+    # Reopen the port once the device is back, with an increasing delay between the attempts
+    def try_reconnect(self, now: float) -> bool:
+        if now < self.next_reconnect:
+            return False
+        if os.path.exists(self.port) and self.connect():
+            log.info('serial', f"Keypad on {self.port} reconnected", port=self.port)
+            return True
+        self.next_reconnect = now + self.reconnect_delay
+        self.reconnect_delay = min(self.reconnect_delay * 2, RECONNECT_MAX_DELAY)
+        return False
+
+    # Negotiate the protocol and send the settings and the current state (active app, plugin states) in one write
+    def start(self, replay: Sequence[str] = ()) -> None:
+        with self.batched():
+            if self.protocol == 'framed':
+                self.link.request_framed()
+            else:
+                # a keypad that still sends frames to an earlier watchdog switches back
+                self.link.send(PROTO_TEXT)
+            if self.rotate:
+                self.link.send(f'Rotate: {self.rotate}')
+            for line in replay:
+                self.link.send(line)
+
+    # Send a single message as text line or frame
+    def send(self, line: str) -> None:
+        if self.connected:
+            self.monitor.activity(time.monotonic())
+            self.link.send(line)
+
+    # Send a ping if it is due, returns the ping line
+    def heartbeat(self, now: float) -> Optional[str]:
+        if not self.connected or not self.monitor.ping_due(now):
+            return None
+        line = self.monitor.ping(now)
+        self.link.send(line)
+        return line
+
+    # Read the received lines and frames, only called when the port is readable
+    def read_messages(self) -> List[str]:
+        if not self.connected:
+            return []
+        try:
+            # reading at least one byte detects a disconnected device
+            data = self.ser.read(max(self.ser.in_waiting, 1))
+        except (serial.SerialException, OSError) as e:
+            self._failed(e)
+            return []
+        messages = self.link.receive(data)
+        # pongs don't count as traffic, otherwise the heartbeat would never slow down
+        if any(not message.startswith(PONG) for message in messages):
+            self.monitor.activity(time.monotonic())
+        return messages
+
+    # Send unacknowledged frames again
+    def poll(self) -> None:
+        if self.connected:
+            self.link.poll()
+
+    def close(self) -> None:
+        if self.ser is not None:
+            self.ser.close()
+
+    # Collect all writes and send them at once
+    @contextmanager
+    def batched(self) -> Iterator[None]:
+        self.batch = []
+        try:
+            yield
+        finally:
+            batch, self.batch = self.batch, None
+            if batch:
+                self._write(b''.join(batch))
+
+    def _write(self, data: bytes) -> None:
+        if self.batch is not None:
+            self.batch.append(data)
+            return
+        ser = self.ser
+        if ser is None or self.failed:
+            return
+        try:
+            ser.write(data)
+        except (serial.SerialException, OSError) as e:
+            # ignore errors of a port that has been closed in the meantime
+            if ser is self.ser:
+                self._failed(e)
+
+    def _failed(self, error: Exception) -> None:
+        if not self.failed:
+            log.warning('serial', f"Keypad on {self.port} disconnected: {error}", port=self.port)
+        self.failed = True
+
+
+# Split a --port argument like /dev/cu.usbmodem2101:CCW into port and rotation
+def parse_port(value: str, default_rotate: Optional[str] = None) -> Tuple[str, Optional[str]]:
+    port, _, rotate = value.rpartition(':')
+    if port and rotate.upper() in ('CW', 'CCW'):
+        return port, rotate.upper()
+    return value, default_rotate
@@ -0,0 +1,119 @@
+# DIY Streamdeck link monitor code for a Mac
+# L. Hennigs and ChatGPT 4.0
+# last changed: 10-19-26
+# https://github.com/LennartHennigs/DIYStreamDeck
+
+# The heartbeat is a ping the keypad answers with a pong:
+#   watchdog -> keypad: "Ping: <seq> <ms until the next ping>"
+#   keypad -> watchdog: "Pong: <seq> <uptime of the keypad in ms>"
+# The keypad expects the next ping within the announced time, if nothing
+# arrives for three times as long it assumes the watchdog is gone.
+
+from collections import deque
+from typing import Any, Deque, Dict, Optional
+import time
+from event_log import log
+
+HEARTBEAT_INTERVAL = 2.0
+HEARTBEAT_MAX_INTERVAL = 16.0
+# seconds without other traffic until the heartbeat slows down
+HEARTBEAT_IDLE_AFTER = 30.0
+# consecutive missed pongs until the keypad counts as not responding
+MISSED_BEATS_LIMIT = 3
+RTT_SAMPLES = 64
+
+
+class LinkMonitor:
+    """
+    Sends the pings of a keypad and measures the round-trip times of the pongs.
+    The jitter is the smoothed difference of successive round-trip times (like RFC 3550).
+    While the link has no other traffic the interval doubles up to max_interval.
+    """
+    port: str
+    interval: float
+    max_interval: float
+    rtts: Deque[float]
+
+    def __init__(self, port: str, interval: float = HEARTBEAT_INTERVAL, max_interval: float = HEARTBEAT_MAX_INTERVAL) -> None:
+        self.port = port
+        self.interval = interval
+        self.max_interval = max(interval, max_interval)
+        self.seq = 0
+        self.rtts = deque(maxlen=RTT_SAMPLES)
+        self.reset(time.monotonic())
+
+    # Start over, e.g. after a reconnect
+    def reset(self, now: float) -> None:
+        self.current_interval = self.interval
+        self.next_ping = now
+        self.last_activity = now
+        self.pending = None
+        self.pings = 0
+        self.pongs = 0
+        self.missed = 0
+        self.missed_in_row = 0
+        self.jitter = 0.0
+        self.last_rtt = None
+        self.keypad_uptime = None
+        self.rtts.clear()
+
+    def ping_due(self, now: float) -> bool:
+        return now >= self.next_ping
+
+    # The next ping line, a ping without a pong counts as a missed beat
+    def ping(self, now: float) -> str:
+        if self.pending is not None:
+            self.missed += 1
+            self.missed_in_row += 1
+            if self.missed_in_row == MISSED_BEATS_LIMIT:
+                log.warning('link', f"Keypad on {self.port} is not responding", port=self.port)
+        # slow down while there is nothing else going on
+        if now - self.last_activity >= HEARTBEAT_IDLE_AFTER:
+            self.current_interval = min(self.current_interval * 2, self.max_interval)
+        else:
+            self.current_interval = self.interval
+        self.seq = (self.seq + 1) % 65536
+        self.pending = (self.seq, now)
+        self.pings += 1
+        self.next_ping = now + self.current_interval
+        return f"Ping: {self.seq} {int(self.current_interval * 1000)}"
+
+    # Called for each pong, returns the round-trip time in seconds or None for a late pong
+    def pong(self, seq: int, uptime_ms: int, now: float) -> Optional[float]:
+        if self.pending is None or self.pending[0] != seq:
+            return None
+        rtt = now - self.pending[1]
+        self.pending = None
+        self.pongs += 1
+        if self.missed_in_row >= MISSED_BEATS_LIMIT:
+            log.info('link', f"Keypad on {self.port} is responding again", port=self.port)
+        self.missed_in_row = 0
+        if self.last_rtt is not None:
+            self.jitter += (abs(rtt - self.last_rtt) - self.jitter) / 16
+        self.last_rtt = rtt
+        self.keypad_uptime = uptime_ms
+        self.rtts.append(rtt)
+        return rtt
+
+    # Any other message on the link, keeps the heartbeat at its normal interval
+    def activity(self, now: float) -> None:
+        self.last_activity = now
+        if self.current_interval > self.interval:
+            # don't wait for a long idle interval once there is traffic again
+            self.current_interval = self.interval
+            self.next_ping = min(self.next_ping, now + self.interval)
+
+    # RTT min/avg/p95/max and jitter in ms of the last RTT_SAMPLES pongs, pings, pongs and missed beats
+    def stats(self) -> Dict[str, Any]:
+        rtts = sorted(self.rtts)
+        stats = {'pings': self.pings, 'pongs': self.pongs, 'missed': self.missed,
+                 'interval_s': self.current_interval, 'keypad_uptime_ms': self.keypad_uptime}
+        if rtts:
+            stats.update({
+                'rtt_min_ms': round(rtts[0] * 1000, 2),
+                'rtt_avg_ms': round(sum(rtts) / len(rtts) * 1000, 2),
+                'rtt_p95_ms': round(rtts[min(len(rtts) - 1, len(rtts) * 95 // 100)] * 1000, 2),
+                'rtt_max_ms': round(rtts[-1] * 1000, 2),
+                'jitter_ms': round(self.jitter * 1000, 2),
+            })
+        return stats
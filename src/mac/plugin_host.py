@@ -0,0 +1,260 @@
+# DIY Streamdeck plugin host code for a Mac
+# L. Hennigs and ChatGPT 4.0
+# last changed: 10-19-26
+# https://github.com/LennartHennigs/DIYStreamDeck
+
+# Runs a plugin in its own worker process. The watchdog talks to the worker
+# over a pipe with small tuples:
+#   worker -> watchdog: ('ready', {command: [(param, has_default, default)]}) or ('error', message)
+#   watchdog -> worker: ('call', command, args) or ('stop',)
+#   worker -> watchdog: ('ok', None, exiting) or ('error', message, exiting)
+#     exiting: the worker is over its memory limit and quits after this reply
+#   worker -> watchdog: ('state', (binding, state)) at any time, for published states
+
+from inspect import Parameter, Signature, signature
+from typing import Any, Callable, Dict, List, Tuple
+import importlib.util
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from base_plugin import BasePlugin
+from event_log import log, DEBUG, INFO
+
+PLUGIN_TIMEOUT = 5.0
+PLUGIN_START_TIMEOUT = 30.0
+PLUGIN_MEMORY_LIMIT = 512  # MB
+RESTART_MIN_DELAY = 1.0
+RESTART_MAX_DELAY = 30.0
+
+
+def _memory_used() -> int:
+    import resource
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes on Linux
+    return usage if sys.platform == 'darwin' else usage * 1024
+
+
+def _limit_memory(limit: int) -> None:
+    import resource
+    try:
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    except (ValueError, OSError):
+        # not supported on every platform, the worker checks its memory after each call
+        pass
+
+
+def _describe_commands(commands: Dict[str, Callable]) -> Dict[str, List[Tuple[str, bool, Any]]]:
+    return {
+        name: [(p.name, p.default is not Parameter.empty, None if p.default is Parameter.empty else p.default)
+               for p in signature(func).parameters.values()]
+        for name, func in commands.items()
+    }
+
+
+# Entry point of the worker process
+def _worker(conn, plugin_path: str, class_name: str, config_file: str, verbose: bool, memory_limit: int) -> None:
+    _limit_memory(memory_limit)
+    log.configure(echo_level=DEBUG if verbose else INFO)
+    sys.path.append(os.path.dirname(plugin_path))
+    # plugins can publish states from their own threads
+    send_lock = threading.Lock()
+
+    def send(message: Tuple) -> None:
+        with send_lock:
+            conn.send(message)
+
+    try:
+        spec = importlib.util.spec_from_file_location(os.path.splitext(os.path.basename(plugin_path))[0], plugin_path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        plugin = getattr(module, class_name)(config_file, verbose)
+        plugin.set_state_listener(lambda binding, state: send(('state', (binding, state))))
+        commands = plugin.commands()
+    except Exception as e:
+        send(('error', str(e)))
+        return
+    send(('ready', _describe_commands(commands)))
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            return
+        if message[0] != 'call':
+            return
+        _, name, args = message
+        out_of_memory = False
+        try:
+            commands[name](*args)
+            reply = ('ok', None)
+        except MemoryError:
+            # the address space limit has been hit
+            reply = ('error', 'out of memory')
+            out_of_memory = True
+        except Exception as e:
+            reply = ('error', str(e))
+        # the peak memory never drops again, only a fresh worker gets below the limit
+        exiting = out_of_memory or _memory_used() > memory_limit
+        send(reply + (exiting,))
+        if exiting:
+            return
+
+
+class RemoteCommand:
+    """
+    Forwards a command to the worker, with the signature of the original command.
+    """
+    def __init__(self, plugin: 'IsolatedPlugin', name: str, params: List[Tuple[str, bool, Any]]) -> None:
+        self.plugin = plugin
+        self.name = name
+        self.__signature__ = Signature([
+            Parameter(param, Parameter.POSITIONAL_OR_KEYWORD, default=default if has_default else Parameter.empty)
+            for param, has_default, default in params
+        ])
+
+    def __call__(self, *args: Any) -> None:
+        self.plugin.call(self.name, args)
+
+
+class IsolatedPlugin(BasePlugin):
+    """
+    Runs a plugin in a worker process with a deadline per call and a memory limit.
+    Crashed, hanging or oversized workers are restarted in the background.
+    """
+    name: str
+    timeout: float
+    memory_limit: int
+    remote_commands: Dict[str, RemoteCommand]
+
+    def __init__(self, name: str, plugin_path: str, class_name: str, config_file: str, verbose: bool,
+                 timeout: float = PLUGIN_TIMEOUT, memory_limit: int = PLUGIN_MEMORY_LIMIT) -> None:
+        self.name = name
+        self.worker_args = (plugin_path, class_name, config_file, verbose, memory_limit * 1024 * 1024)
+        self.verbose = verbose
+        self.timeout = timeout
+        self.memory_limit = memory_limit
+        self.context = multiprocessing.get_context('spawn')
+        self.lock = threading.Lock()
+        self.process = None
+        self.conn = None
+        self.restarting = False
+        self.stopped = False
+        self.restart_delay = RESTART_MIN_DELAY
+        self.restarts = 0
+        self.remote_commands = {}
+        self._start()
+
+    def commands(self) -> Dict[str, Callable]:
+        return self.remote_commands
+
+    # Run a command in the worker, waits at most timeout seconds, raises a RuntimeError if it fails
+    def call(self, name: str, args: Tuple) -> None:
+        with self.lock:
+            if self.restarting or self.process is None:
+                raise RuntimeError(f"Plugin {self.name} is restarting, skipping {name}")
+            deadline = time.monotonic() + self.timeout
+            try:
+                self.conn.send(('call', name, args))
+                while True:
+                    if not self.conn.poll(max(deadline - time.monotonic(), 0)):
+                        self._restart_in_background()
+                        raise RuntimeError(f"Plugin {self.name} did not finish {name} within {self.timeout}s")
+                    message = self.conn.recv()
+                    status, result = message[:2]
+                    if status != 'state':
+                        break
+                    self.publish_state(*result)
+            except (EOFError, OSError) as e:
+                self._restart_in_background()
+                raise RuntimeError(f"Plugin {self.name} crashed: {e}")
+            self.restart_delay = RESTART_MIN_DELAY
+            if message[2]:
+                log.info('plugins', f"Plugin {self.name} exceeded {self.memory_limit} MB, restarting it")
+                self.process.join(1)
+                self._restart_in_background()
+            if status == 'error':
+                raise RuntimeError(result)
+
+    # Forward the states the worker has published between calls, never blocks
+    def poll_states(self) -> None:
+        if not self.lock.acquire(blocking=False):
+            return
+        try:
+            while self.conn is not None and self.conn.poll(0):
+                status, result = self.conn.recv()
+                if status == 'state':
+                    self.publish_state(*result)
+        except (EOFError, OSError) as e:
+            log.error('plugins', f"Plugin {self.name} crashed: {e}")
+            self._restart_in_background()
+        finally:
+            self.lock.release()
+
+    def unload(self) -> None:
+        super().unload()
+        self.stop()
+
+    def stop(self) -> None:
+        with self.lock:
+            self.stopped = True
+            if self.process is not None:
+                try:
+                    self.conn.send(('stop',))
+                    self.process.join(1)
+                except OSError:
+                    pass
+            self._kill()
+
+    def _start(self) -> None:
+        self.process, self.conn, self.remote_commands = self._spawn()
+
+    # Start a worker and wait until the plugin is initialized
+    def _spawn(self) -> Tuple[Any, Any, Dict[str, RemoteCommand]]:
+        parent_conn, child_conn = self.context.Pipe()
+        process = self.context.Process(target=_worker, args=(child_conn, *self.worker_args), daemon=True)
+        process.start()
+        child_conn.close()
+        if not parent_conn.poll(PLUGIN_START_TIMEOUT):
+            process.kill()
+            raise TimeoutError(f"Plugin {self.name} did not start within {PLUGIN_START_TIMEOUT}s")
+        try:
+            status, result = parent_conn.recv()
+        except EOFError:
+            raise RuntimeError(f"Plugin {self.name} exited during start")
+        if status != 'ready':
+            process.join()
+            raise RuntimeError(result)
+        return process, parent_conn, {command: RemoteCommand(self, command, params) for command, params in result.items()}
+
+    def _kill(self) -> None:
+        if self.process is not None:
+            self.process.kill()
+            self.process.join()
+            self.conn.close()
+        self.process = None
+        self.conn = None
+
+    # Called with the lock held
+    def _restart_in_background(self) -> None:
+        self._kill()
+        self.restarting = True
+        threading.Thread(target=self._restart, daemon=True).start()
+
+    def _restart(self) -> None:
+        while not self.stopped:
+            time.sleep(self.restart_delay)
+            try:
+                worker = self._spawn()
+                with self.lock:
+                    if self.stopped:
+                        worker[0].kill()
+                        return
+                    self.process, self.conn, self.remote_commands = worker
+                    self.restarting = False
+                    self.restarts += 1
+                log.info('plugins', f"Restarted plugin {self.name}")
+                return
+            except Exception as e:
+                log.error('plugins', f"Error restarting plugin {self.name}: {e}")
+                self.restart_delay = min(self.restart_delay * 2, RESTART_MAX_DELAY)
@@ -0,0 +1,174 @@
+# DIY Streamdeck plugin loader code for a Mac
+# L. Hennigs and ChatGPT 4.0
+# last changed: 10-19-26
+# https://github.com/LennartHennigs/DIYStreamDeck
+
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import importlib.util
+import os
+import threading
+import time
+from base_plugin import BasePlugin
+from plugin_host import IsolatedPlugin, PLUGIN_TIMEOUT, PLUGIN_MEMORY_LIMIT
+from event_log import log
+
+PLUGIN_POLL_INTERVAL = 1.0
+
+
+# All plugin modules in the plugin folder
+def plugin_files(full_path: str) -> List[os.DirEntry]:
+    return [f for f in os.scandir(full_path) if f.is_file() and f.name.endswith('.py') and f.name != 'base_plugin.py']
+
+
+# Load a plugin module
+def load_plugin_module(plugin_file: os.DirEntry, full_path: str) -> Tuple[str, Any]:
+    plugin_name = os.path.splitext(plugin_file.name)[0]
+    abs_path = os.path.join(full_path, plugin_file.name)
+    try:
+        spec = importlib.util.spec_from_file_location(plugin_name, abs_path)
+        plugin_module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(plugin_module)
+    except Exception as e:
+        log.error('plugins', f"Error loading plugin module {plugin_name}: {e}")
+        return None, None
+
+    return plugin_name, plugin_module
+
+
+# Create the plugin instance of a loaded module, raises if the plugin can't be initialized
+def create_plugin(plugin_name: str, plugin_module: Any, full_path: str, verbose: bool = False, isolate: bool = False,
+                  timeout: float = PLUGIN_TIMEOUT, memory_limit: int = PLUGIN_MEMORY_LIMIT) -> BasePlugin:
+    class_name = f'{plugin_name.capitalize()}Plugin'
+    plugin_class = getattr(plugin_module, class_name)
+    config_file = os.path.join(full_path, 'config', f'{plugin_name}.json')
+    if isolate and plugin_class.isolate:
+        return IsolatedPlugin(plugin_name, os.path.join(full_path, f'{plugin_name}.py'),
+                              class_name, config_file, verbose, timeout, memory_limit)
+    return plugin_class(config_file, verbose)
+
+
+# Load all plugins, with isolate=True each plugin runs in its own worker process unless it opts out
+def load_plugins(path: str = 'plugins', verbose: bool = False, isolate: bool = False,
+                 timeout: float = PLUGIN_TIMEOUT, memory_limit: int = PLUGIN_MEMORY_LIMIT) -> Dict[str, BasePlugin]:
+    plugins = {}
+    base_path = os.path.dirname(os.path.abspath(__file__))
+    full_path = os.path.join(base_path, path)
+
+    for plugin_file in plugin_files(full_path):
+        plugin_name, plugin_module = load_plugin_module(plugin_file, full_path)
+        if plugin_module is None:
+            continue
+
+        try:
+            plugins[plugin_name] = create_plugin(plugin_name, plugin_module, full_path, verbose, isolate, timeout, memory_limit)
+            print(f"Loaded plugin: {plugin_name}" + (" (isolated)" if isinstance(plugins[plugin_name], IsolatedPlugin) else ""))
+        except Exception as e:
+            log.error('plugins', f"Error initializing plugin {plugin_name}: {e}")
+    print()
+    return plugins
+
+
+class PluginReloader:
+    """
+    Watches the plugin folder and reloads a plugin when its module changes.
+    The new instance is created on the watcher thread while the old one keeps
+    serving commands, then it replaces the old one in the plugin registry.
+    Changes of base_plugin.py need a restart of the watchdog.
+    """
+    plugins: Dict[str, BasePlugin]
+    full_path: str
+    on_loaded: Optional[Callable[[BasePlugin], None]]
+    versions: Dict[str, Tuple[int, int]]
+    changed: Dict[str, Tuple[int, int]]
+
+    def __init__(self, plugins: Dict[str, BasePlugin], path: str = 'plugins', verbose: bool = False,
+                 isolate: bool = False, timeout: float = PLUGIN_TIMEOUT, memory_limit: int = PLUGIN_MEMORY_LIMIT,
+                 on_loaded: Optional[Callable[[BasePlugin], None]] = None,
+                 poll_interval: float = PLUGIN_POLL_INTERVAL) -> None:
+        self.plugins = plugins
+        self.full_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), path)
+        self.options = (verbose, isolate, timeout, memory_limit)
+        self.on_loaded = on_loaded
+        self.poll_interval = poll_interval
+        self.running = False
+        self.watcher = None
+        # the current modules count as loaded
+        self.versions = {f.name: self._version(f) for f in plugin_files(self.full_path)}
+        self.changed = {}
+
+    def start(self) -> None:
+        self.running = True
+        self.watcher = threading.Thread(target=self._watch, daemon=True)
+        self.watcher.start()
+
+    def stop(self) -> None:
+        self.running = False
+        if self.watcher is not None:
+            self.watcher.join()
+
+    # Look for changed, new and removed modules, called by the watcher thread
+    def check(self) -> None:
+        files = {f.name: f for f in plugin_files(self.full_path)}
+        for name, plugin_file in files.items():
+            try:
+                version = self._version(plugin_file)
+            except OSError:
+                continue
+            if version == self.versions.get(name):
+                self.changed.pop(name, None)
+                continue
+            # editors often write a file in several steps, wait until it has settled
+            if self.changed.get(name) != version:
+                self.changed[name] = version
+                continue
+            del self.changed[name]
+            self.versions[name] = version
+            self.reload(plugin_file)
+        for name in [name for name in self.versions if name not in files]:
+            del self.versions[name]
+            self.unload(os.path.splitext(name)[0])
+
+    # Load the module again and replace the plugin, the old plugin stays if this fails
+    def reload(self, plugin_file: os.DirEntry) -> None:
+        start = time.perf_counter()
+        plugin_name, plugin_module = load_plugin_module(plugin_file, self.full_path)
+        if plugin_module is None:
+            return
+        imported = time.perf_counter()
+        try:
+            plugin = create_plugin(plugin_name, plugin_module, self.full_path, *self.options)
+            if self.on_loaded is not None:
+                self.on_loaded(plugin)
+        except Exception as e:
+            log.error('plugins', f"Error initializing plugin {plugin_name}, keeping the old version: {e}")
+            return
+        initialized = time.perf_counter()
+        # a single assignment, a running command keeps the instance it has started with
+        old_plugin = self.plugins.get(plugin_name)
+        self.plugins[plugin_name] = plugin
+        swapped = time.perf_counter()
+        if old_plugin is not None:
+            old_plugin.unload()
+        unloaded = time.perf_counter()
+        log.info('plugins', f"Reloaded plugin: {plugin_name} in {(unloaded - start) * 1000:.1f} ms "
+                 f"(import {(imported - start) * 1000:.1f} ms, init {(initialized - imported) * 1000:.1f} ms, "
+                 f"swap {(swapped - initialized) * 1000:.3f} ms, unload {(unloaded - swapped) * 1000:.1f} ms)",
+                 plugin=plugin_name, import_ms=(imported - start) * 1000, init_ms=(initialized - imported) * 1000)
+
+    def unload(self, plugin_name: str) -> None:
+        plugin = self.plugins.pop(plugin_name, None)
+        if plugin is not None:
+            plugin.unload()
+            log.info('plugins', f"Unloaded plugin: {plugin_name}")
+
+    def _watch(self) -> None:
+        while self.running:
+            time.sleep(self.poll_interval)
+            try:
+                self.check()
+            except OSError as e:
+                log.error('plugins', f"Error watching the plugin folder: {e}")
+
+    def _version(self, plugin_file: os.DirEntry) -> Tuple[int, int]:
+        stat = os.stat(plugin_file.path)
+        return stat.st_mtime_ns, stat.st_size
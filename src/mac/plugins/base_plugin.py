@@ -1,13 +1,217 @@
 # DIY Streamdeck Plugin code
 # L. Hennigs and ChatGPT 4.0
-# last changed: 23-05-18
+# last changed: 10-19-26
 # https://github.com/LennartHennigs/DIYStreamDeck
 
 from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set, Tuple, Union
+import fcntl
+import json
 import os
+import threading
+import time
+from event_log import log
+
+CONFIG_POLL_INTERVAL = 1.0
+CACHE_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache')
+
+# callback(changed_keys, config)
+ConfigCallback = Callable[[Set[str], Dict[str, Any]], None]
+
+
+class ConfigService:
+    """
+    Parses each plugin config file once and keeps it until the file changes.
+    A background thread compares the modification times of the subscribed files
+    and tells the subscribers which top level keys have changed.
+    """
+    poll_interval: float
+    configs: Dict[str, Tuple[Tuple[int, int], Dict[str, Any]]]
+    subscribers: Dict[str, List[ConfigCallback]]
+
+    def __init__(self, poll_interval: float = CONFIG_POLL_INTERVAL) -> None:
+        self.poll_interval = poll_interval
+        self.configs = {}
+        self.subscribers = {}
+        self.lock = threading.Lock()
+        self.watcher = None
+
+    # Returns the parsed config, only reads the file again if it has changed
+    # Raises FileNotFoundError and json.JSONDecodeError
+    def load(self, path: str) -> Dict[str, Any]:
+        path = os.path.abspath(path)
+        version = self._version(path)
+        with self.lock:
+            entry = self.configs.get(path)
+        if entry is not None and entry[0] == version:
+            return entry[1]
+        config = self._read(path)
+        with self.lock:
+            self.configs[path] = (version, config)
+        return config
+
+    # Call callback(changed_keys, config) on the watcher thread whenever the file changes
+    def subscribe(self, path: str, callback: ConfigCallback) -> None:
+        path = os.path.abspath(path)
+        with self.lock:
+            self.subscribers.setdefault(path, []).append(callback)
+            if self.watcher is None:
+                self.watcher = threading.Thread(target=self._watch, daemon=True)
+                self.watcher.start()
+
+    def unsubscribe(self, path: str, callback: ConfigCallback) -> None:
+        path = os.path.abspath(path)
+        with self.lock:
+            callbacks = self.subscribers.get(path, [])
+            if callback in callbacks:
+                callbacks.remove(callback)
+
+    # Check the subscribed files for changes, called by the watcher thread
+    def check(self) -> None:
+        with self.lock:
+            paths = [path for path, callbacks in self.subscribers.items() if callbacks]
+        for path in paths:
+            try:
+                version = self._version(path)
+            except OSError:
+                # the file is being replaced, try again later
+                continue
+            with self.lock:
+                old_version, old_config = self.configs.get(path, (None, {}))
+            if version == old_version:
+                continue
+            try:
+                config = self._read(path)
+            except (OSError, ValueError) as e:
+                # keep the old config until the file is valid again
+                log.error('config', f"Error reloading config file {path}: {e}")
+                with self.lock:
+                    self.configs[path] = (version, old_config)
+                continue
+            changed = {key for key in config.keys() | old_config.keys() if config.get(key) != old_config.get(key)}
+            with self.lock:
+                self.configs[path] = (version, config)
+                callbacks = list(self.subscribers.get(path, []))
+            if not changed:
+                continue
+            for callback in callbacks:
+                try:
+                    callback(changed, config)
+                except Exception as e:
+                    log.error('config', f"Error applying config file {path}: {e}")
+
+    def _watch(self) -> None:
+        while True:
+            time.sleep(self.poll_interval)
+            self.check()
+
+    def _version(self, path: str) -> Tuple[int, int]:
+        stat = os.stat(path)
+        return stat.st_mtime_ns, stat.st_size
+
+    def _read(self, path: str) -> Dict[str, Any]:
+        with open(path, 'r') as f:
+            return json.load(f)
+
+
+# shared by all plugins of a process
+config_service = ConfigService()
+
+
+class DiscoveryCache:
+    """
+    Keeps the discovery results of a plugin (lights, devices, the user profile, ...)
+    on disk, so the plugin can start with them and refresh them in the background.
+    The file is shared with the tools (e.g. hue_show_lamp_ids.py), the plugin workers
+    and the instance before a reload, so it is read again when it has changed and
+    put() merges into the current file under a file lock.
+    """
+    path: str
+    entries: Optional[Dict[str, Dict[str, Any]]]
+    version: Optional[Tuple[int, int]]
+
+    def __init__(self, name: str, directory: str = CACHE_DIRECTORY) -> None:
+        self.path = os.path.join(directory, f'{name}.json')
+        self.lock = threading.Lock()
+        self.entries = None
+        self.version = None
+
+    def get(self, key: str) -> Any:
+        with self.lock:
+            entry = self._load().get(key)
+        return None if entry is None else entry['value']
+
+    # Seconds since the value has been stored
+    def age(self, key: str) -> Optional[float]:
+        with self.lock:
+            entry = self._load().get(key)
+        return None if entry is None else time.time() - entry['time']
+
+    def put(self, key: str, value: Any) -> None:
+        with self.lock, self._file_lock():
+            # merge into the current file, not into what this instance has read before
+            entries = self._read()
+            entries[key] = {'time': time.time(), 'value': value}
+            self.entries = entries
+            try:
+                # replace the file in one step, other processes never read a partial file
+                temp_path = f'{self.path}.{os.getpid()}.tmp'
+                with open(temp_path, 'w') as f:
+                    json.dump(entries, f, indent=2)
+                os.replace(temp_path, self.path)
+                self.version = self._version()
+            except OSError as e:
+                log.warning('cache', f"Error writing {self.path}: {e}")
+
+    # Serializes put() of all processes that share the file
+    @contextmanager
+    def _file_lock(self) -> Iterator[None]:
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            lock_file = open(f'{self.path}.lock', 'a')
+        except OSError as e:
+            log.warning('cache', f"Error locking {self.path}: {e}")
+            yield
+            return
+        with lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    # Called with the lock held, reads the file again if another process has changed it
+    def _load(self) -> Dict[str, Dict[str, Any]]:
+        version = self._version()
+        if self.entries is None or version != self.version:
+            self.entries = self._read()
+            self.version = version
+        return self.entries
+
+    def _read(self) -> Dict[str, Dict[str, Any]]:
+        try:
+            with open(self.path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _version(self) -> Optional[Tuple[int, int]]:
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
 
 class BasePlugin(ABC):
-    
+    # can run in its own worker process (watchdog.py --isolate-plugins)
+    isolate: bool = True
+    config: Dict[str, Any]
+    config_file: Optional[str] = None
+    discovery_cache: Optional[DiscoveryCache] = None
+    # set by the watchdog, receives the published states
+    state_listener: Optional[Callable[[str, Any], None]] = None
+
     @abstractmethod
     def commands(self):
         """
@@ -16,9 +220,93 @@ class BasePlugin(ABC):
         """
         pass
 
+
+    def set_state_listener(self, listener: Optional[Callable[[str, Any], None]]) -> None:
+        self.state_listener = listener
+
+
+    # Publish the state of a key binding, e.g. binding("hue.toggle", "Desk") -> True
+    # Keys with this action show their toggleColor while the state is true
+    # Can be called from any thread
+    def publish_state(self, binding: str, state: Any) -> None:
+        if self.state_listener is not None:
+            self.state_listener(binding, state)
+
+
+    # Format a command like the action of a key in key_def.json
+    def binding(self, command: str, param: Union[int, str, None] = None) -> str:
+        if param is None:
+            return command
+        if isinstance(param, str):
+            return f"{command} '{param}'"
+        return f"{command} {param}"
+
+
+    # Called with the names of the changed top level keys after self.config has been updated
+    # Plugins override this to apply the change in place
+    def config_changed(self, changed: Set[str]) -> None:
+        pass
+
+
+    # Returns discovery data (e.g. the lights of a bridge) from the on-disk cache and refreshes it in the background
+    # Without cached data fetch() runs right away, or only in the background if block is False
+    # updated(value) is called on the background thread if the refreshed data differs
+    def _discover(self, key: str, fetch: Callable[[], Any], updated: Optional[Callable[[Any], None]] = None,
+                  block: bool = True) -> Any:
+        if self.discovery_cache is None:
+            self.discovery_cache = DiscoveryCache(type(self).__name__[:-len('Plugin')].lower())
+        cached = self.discovery_cache.get(key)
+        if cached is None and block:
+            value = fetch()
+            self.discovery_cache.put(key, value)
+            return value
+        threading.Thread(target=self._revalidate, args=(key, fetch, updated, cached), daemon=True).start()
+        return cached
+
+
+    def _revalidate(self, key: str, fetch: Callable[[], Any], updated: Optional[Callable[[Any], None]], cached: Any) -> None:
+        started = time.perf_counter()
+        try:
+            value = fetch()
+        except Exception as e:
+            log.warning('cache', f"Keeping the cached {key}, refreshing failed: {e}")
+            return
+        self.discovery_cache.put(key, value)
+        log.debug('cache', f"Refreshed {key} in {(time.perf_counter() - started) * 1000:.0f} ms")
+        if value != cached and updated is not None:
+            updated(value)
+
+
+    # Called when the plugin is replaced by a reloaded version or the watchdog stops
+    def unload(self) -> None:
+        if self.config_file is not None:
+            config_service.unsubscribe(self.config_file, self._config_reloaded)
+
+
+    # Load the config file via the shared config service and follow its changes
+    def _load_config(self, config_file: str) -> Dict[str, Any]:
+        try:
+            config = config_service.load(config_file)
+        except FileNotFoundError:
+            self._log_and_raise(f"Config file {config_file} not found.")
+        except json.JSONDecodeError:
+            self._log_and_raise(
+                f"Failed to parse config file {config_file}. Please check if it is a valid JSON file."
+            )
+        if self.config_file is None:
+            self.config_file = config_file
+            config_service.subscribe(config_file, self._config_reloaded)
+        return config
+
+
+    def _config_reloaded(self, changed: Set[str], config: Dict[str, Any]) -> None:
+        self.config = config
+        log.info('config', f"Reloaded {os.path.basename(self.config_file)}, changed: {', '.join(sorted(changed))}")
+        self.config_changed(changed)
+
     
     def _log_and_raise(self, msg: str) -> None:
-        print(msg)
+        log.error('plugins', msg)
         raise Exception(msg)
     
 
@@ -1,8 +1,7 @@
-import json
-import os
-from typing import Dict, Callable, Union, List, Optional
-from phue import Bridge, Light
+from typing import Dict, Callable, Union, List, Optional, Set
+from phue import Bridge
 from base_plugin import BasePlugin
+from event_log import log
 
 class HuePlugin(BasePlugin):
     verbose: bool
@@ -13,6 +12,8 @@ class HuePlugin(BasePlugin):
         self.verbose = verbose
         self.config = self._load_config(config_file)
         self.bridge = self._connect_to_bridge()
+        # starts with the cached lights of the bridge, if there are any
+        self.lights = self._discover_lights()
 
     def commands(self) -> Dict[str, Callable]:
         return {
@@ -21,59 +22,80 @@ class HuePlugin(BasePlugin):
             'hue.toggle': self.toggle,
         }
 
-    def _load_config(self, config_file: str) -> Dict[str, Union[str, int]]:
+    # Only reconnect if the bridge has changed
+    def config_changed(self, changed: Set[str]) -> None:
+        if 'bridge_ip' not in changed:
+            return
         try:
-            with open(config_file, 'r') as f:
-                return json.load(f)
-        except FileNotFoundError:
-            self._log_and_raise(f"Config file {config_file} not found.")
-        except json.JSONDecodeError:
-            self._log_and_raise(
-                f"Failed to parse config file {config_file}. Please check if it is a valid JSON file."
-            )
+            self.bridge = self._connect_to_bridge()
+            self.lights = self._discover_lights()
+            log.info('hue', f"Reconnected to the Hue bridge at {self.config['bridge_ip']}")
+        except (ValueError, ConnectionError) as e:
+            log.error('hue', f"Keeping the old Hue bridge: {e}")
 
+    # Only reads the username from the phue config, the bridge is contacted by _fetch_lights()
     def _connect_to_bridge(self) -> Bridge:
         bridge_ip = self.config.get('bridge_ip')
         if not bridge_ip:
             raise ValueError("Bridge IP not found in the config.")
-        
+        try:
+            return Bridge(bridge_ip)
+        except Exception as e:
+            raise ConnectionError("Failed to connect to the bridge.") from e
+
+    def _discover_lights(self) -> List[Dict[str, Union[int, str]]]:
+        bridge = self.bridge
+        return self._discover(f"lights@{bridge.ip}", lambda: self._fetch_lights(bridge), self._lights_updated)
+
+    # The lights of the bridge, in the order of hue_show_lamp_ids.py
+    def _fetch_lights(self, bridge: Bridge) -> List[Dict[str, Union[int, str]]]:
         # ping the bridge_ip to check if it is reachable
-        if not self._ping(bridge_ip):
+        if not self._ping(bridge.ip):
             raise ConnectionError("Bridge IP not reachable.")
-
-        bridge = Bridge(bridge_ip)
         try:
-            bridge.connect()
+            lights = bridge.get_light()
         except Exception as e:
             raise ConnectionError("Failed to connect to the bridge.") from e
-        return bridge
+        catalog = []
+        for index, light_id in enumerate(sorted(lights, key=int)):
+            light = {'id': int(light_id), 'name': lights[light_id]['name']}
+            catalog.append(light)
+            # the light may have been switched elsewhere, let its toggle keys catch up
+            self._publish_light(index, light, bool(lights[light_id].get('state', {}).get('on')))
+        return catalog
 
+    def _lights_updated(self, lights: List[Dict[str, Union[int, str]]]) -> None:
+        self.lights = lights
+        log.info('hue', f"Updated the list of lights: {', '.join(light['name'] for light in lights)}")
 
-    def _find_light(self, lamp_identifier: Union[int, str]) -> Optional[Light]:
-            lights = self._get_lights(lamp_identifier)
-            if lights:
-                return lights[0]
-        
-    def _get_lights(self, lamp_identifier: Union[int, str]) -> List[Light]:
-        return [
-            light for light in self.bridge.lights
-            if self._is_matching_light(light, lamp_identifier)
-        ]
+    # Looks up the light in the cached list, by index or name
+    def _find_light(self, lamp_identifier: Union[int, str]) -> Optional[Dict[str, Union[int, str]]]:
+        lights = self.lights
+        if isinstance(lamp_identifier, int):
+            if 0 <= lamp_identifier < len(lights):
+                return lights[lamp_identifier]
+        else:
+            for light in lights:
+                if light['name'].lower() == lamp_identifier.lower():
+                    return light
+        # the light may be new, check the bridge again in the background
+        self._discover_lights()
+        return None
 
-    def _is_matching_light(self, light: Light, lamp_identifier: Union[int, str]) -> bool:
-        return (
-            (isinstance(lamp_identifier, int) and lamp_identifier < len(self.bridge.lights))
-            or (isinstance(lamp_identifier, str) and light.name.lower() == lamp_identifier.lower())
-        )
+    # Let the toggle keys of a light show its state, they can name it by index or by name
+    def _publish_light(self, index: int, light: Dict[str, Union[int, str]], state: bool) -> None:
+        self.publish_state(self.binding('hue.toggle', index), state)
+        self.publish_state(self.binding('hue.toggle', light['name']), state)
 
     def _change_light_state(self, lamp_identifier: Union[int, str], state: bool) -> None:
         light = self._find_light(lamp_identifier)
         if light is None:
-            print(f"Could not find a light with the name or index: {lamp_identifier}")
+            log.warning('hue', f"Could not find a light with the name or index: {lamp_identifier}")
             return
-        light.on = state
-        if self.verbose:
-            print(f"Turned {'on' if state else 'off'} '{light.name}'")
+        self.bridge.set_light(light['id'], 'on', state)
+        if light in self.lights:
+            self._publish_light(self.lights.index(light), light, state)
+        log.debug('hue', f"Turned {'on' if state else 'off'} '{light['name']}'")
 
     def turn_on(self, lamp_identifier: Union[int, str]) -> None:
         self._change_light_state(lamp_identifier, True)
@@ -84,6 +106,6 @@ class HuePlugin(BasePlugin):
     def toggle(self, lamp_identifier: Union[int, str]) -> None:
         light = self._find_light(lamp_identifier)
         if light is None:
-            print(f"Could not find a light with the name or index: '{lamp_identifier}'")
+            log.warning('hue', f"Could not find a light with the name or index: '{lamp_identifier}'")
             return
-        self._change_light_state(lamp_identifier, not light.on)
+        self._change_light_state(lamp_identifier, not self.bridge.get_light(light['id'], 'on'))
@@ -1,12 +1,14 @@
 import os
-import json
-from typing import Dict, Callable, Union
+from typing import Dict, Callable, Set, Union
 from playsound import playsound
 from concurrent.futures import ThreadPoolExecutor
 from base_plugin import BasePlugin
+from event_log import log
 
 
 class SoundsPlugin(BasePlugin):
+    # playback already runs on its own threads and stop() needs the futures of this process
+    isolate = False
     verbose: bool
     config: Dict[str, Union[str, int]]
     executor: ThreadPoolExecutor
@@ -24,22 +26,18 @@ class SoundsPlugin(BasePlugin):
             'sounds.stop': self.stop,
         }
 
-    def _load_config(self, config_file: str) -> Dict[str, Union[str, int]]:
-        try:
-            with open(config_file, 'r') as f:
-                return json.load(f)
-        except FileNotFoundError:
-            self._log_and_raise(f"Config file {config_file} not found.")
-        except json.JSONDecodeError:
-            self._log_and_raise(
-                f"Failed to parse config file {config_file}. Please check if it is a valid JSON file."
-            )
+    def config_changed(self, changed: Set[str]) -> None:
+        if 'sound_path' in changed:
+            self.sound_path = self.config.get('sound_path', '')
 
     def _log_and_raise(self, message: str) -> None:
-        if self.verbose:
-            print(message)
+        log.debug('sounds', message)
         raise Exception(message)
 
+    def unload(self) -> None:
+        super().unload()
+        self.executor.shutdown(wait=False)
+
     def play(self, filename: str) -> None:
         try:
             
@@ -47,8 +45,7 @@ class SoundsPlugin(BasePlugin):
             if not os.path.exists(full_path):
                 self._log_and_raise(f"File {filename} not found.")
             self.executor.submit(playsound, full_path)
-            if self.verbose:
-                print(f"Playing '{filename}'")
+            log.debug('sounds', f"Playing '{filename}'")
         except Exception as e:
             self._log_and_raise(f"Failed to play '{filename}': {e}")
 
@@ -57,7 +54,6 @@ class SoundsPlugin(BasePlugin):
             # Cancel all futures
             for future in self.executor.futures:
                 future.cancel()
-            if self.verbose:
-                print(f"Stopped all playback")
+            log.debug('sounds', "Stopped all playback")
         except Exception as e:
             self._log_and_raise(f"Failed to stop playback: {e}")
@@ -1,14 +1,17 @@
 # DIY Streamdeck Plugin code
 # L. Hennigs and ChatGPT 4.0
-# last changed: 23-05-18
+# last changed: 10-19-26
 # https://github.com/LennartHennigs/DIYStreamDeck
 
 
-import json
-from typing import Optional
-from spotipy import Spotify
+from typing import Any, Dict, List, Optional, Set
+import threading
+from spotipy import Spotify, SpotifyException
 from spotipy.oauth2 import SpotifyOAuth
 from base_plugin import BasePlugin
+from event_log import log
+
+DEVICE_REFRESH_INTERVAL = 60.0
 
 
 class SpotifyPlugin(BasePlugin):
@@ -17,6 +20,18 @@ class SpotifyPlugin(BasePlugin):
         self.verbose = verbose
         self.config = self._load_config(config_file)
         self.sp = self._authenticate()
+        # the cached profile and devices, both are refreshed in the background
+        self.user = self._discover(f"user@{self.config['client_id']}", self._fetch_user)
+        # the device that has played last, the fallback for a transfer
+        # read before the devices, their background refresh can update it
+        self.last_device = self.discovery_cache.get(self._last_device_key())
+        if self._can_choose():
+            self.devices = self._discover(self._devices_key(), self._fetch_devices, self._devices_updated, block=False) or []
+        else:
+            # the device list can't change the choice, don't ask for it
+            self.devices = self.discovery_cache.get(self._devices_key()) or []
+        self.stop_refresh = threading.Event()
+        threading.Thread(target=self._refresh_devices, daemon=True).start()
 
     def commands(self):
         return {
@@ -29,12 +44,21 @@ class SpotifyPlugin(BasePlugin):
             'spotify.playpause': self.play_pause,
         }
 
-    def _load_config(self, config_file: str) -> dict:
+    # Only authenticate again if the credentials have changed
+    def config_changed(self, changed: Set[str]) -> None:
+        if not changed & {'client_id', 'client_secret', 'redirect_uri'}:
+            return
         try:
-            with open(config_file, 'r') as f:
-                return json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError) as e:
-            self._log_and_raise(str(e))
+            self.sp = self._authenticate()
+            self.user = self._discover(f"user@{self.config['client_id']}", self._fetch_user)
+            self._log("Authenticated with the new Spotify credentials")
+        except Exception as e:
+            log.error('spotify', f"Keeping the old Spotify session: {e}")
+
+
+    def unload(self) -> None:
+        super().unload()
+        self.stop_refresh.set()
 
 
     def _authenticate(self) -> Spotify:
@@ -44,12 +68,106 @@ class SpotifyPlugin(BasePlugin):
             client_secret=self.config['client_secret'],
             redirect_uri=self.config['redirect_uri'],
             scope=scope)
-        spotify = Spotify(auth_manager=auth_manager)
+        # the credentials are checked by _fetch_user()
+        return Spotify(auth_manager=auth_manager)
+
 
-        user = spotify.current_user()
+    def _fetch_user(self) -> Dict[str, Any]:
+        user = self.sp.current_user()
         if not user:
-            raise Exception("Failed to authenticate with Spotify.")        
-        return spotify
+            raise Exception("Failed to authenticate with Spotify.")
+        return {'id': user['id'], 'display_name': user.get('display_name')}
+
+
+    def _fetch_devices(self) -> List[Dict[str, Any]]:
+        return [{'id': device['id'], 'name': device['name'], 'type': device['type'], 'is_active': device['is_active']}
+                for device in self.sp.devices()['devices'] if device['id'] and not device.get('is_restricted')]
+
+
+    def _devices_updated(self, devices: List[Dict[str, Any]]) -> None:
+        self.devices = devices
+        for device in devices:
+            if device.get('is_active'):
+                self._remember_device(device)
+        self._log(f"Spotify devices: {', '.join(device['name'] for device in devices)}")
+
+
+    def _devices_key(self) -> str:
+        return f"devices@{self.config['client_id']}"
+
+
+    def _last_device_key(self) -> str:
+        return f"last_device@{self.config['client_id']}"
+
+
+    # Keep the device list fresh, so starting the playback doesn't have to ask for it first
+    def _refresh_devices(self) -> None:
+        while not self.stop_refresh.wait(self.config.get('device_refresh', DEVICE_REFRESH_INTERVAL)):
+            if self._can_choose():
+                self._revalidate(self._devices_key(), self._fetch_devices, self._devices_updated, self.devices)
+
+
+    # Fetch the device list right away, e.g. when a cached device is gone
+    def _update_devices(self) -> None:
+        devices = self._fetch_devices()
+        self.discovery_cache.put(self._devices_key(), devices)
+        self._devices_updated(devices)
+
+
+    def _remember_device(self, device: Dict[str, Any]) -> None:
+        if device.get('id') and device['id'] != self.last_device:
+            self.last_device = device['id']
+            self.discovery_cache.put(self._last_device_key(), device['id'])
+
+
+    # The device to start the playback on when no device is active: the first available
+    # of preferred_devices (names or ids), otherwise depending on device_fallback
+    # the last used device ("last", the default), the first computer ("computer"),
+    # the first device ("first") or none ("none")
+    def _choose_device(self) -> Optional[Dict[str, Any]]:
+        for preferred in self.config.get('preferred_devices', []):
+            for device in self.devices:
+                if preferred == device['id'] or preferred.lower() == device['name'].lower():
+                    return device
+        fallback = self.config.get('device_fallback', 'last')
+        if fallback == 'none' or not self.devices:
+            return None
+        if fallback == 'last':
+            for device in self.devices:
+                if device['id'] == self.last_device:
+                    return device
+        if fallback == 'computer':
+            return next((device for device in self.devices if device['type'] == 'Computer'), None)
+        return self.devices[0]
+
+
+    # False if no device list can change the choice: no preferred devices and device_fallback none
+    def _can_choose(self) -> bool:
+        return bool(self.config.get('preferred_devices')) or self.config.get('device_fallback', 'last') != 'none'
+
+
+    # Start the playback on the chosen device, the transfer and the start are a single API call
+    def _transfer_and_play(self) -> bool:
+        for attempt in range(2):
+            device = self._choose_device()
+            if device is not None:
+                try:
+                    self.sp.start_playback(device_id=device['id'])
+                    self._remember_device(device)
+                    self._log(f"Playing on {device['name']}")
+                    return True
+                except SpotifyException as e:
+                    # 404: the device is gone
+                    if e.http_status != 404:
+                        self._log(f"Failed to play on {device['name']}: {e.msg}")
+                        return False
+            if attempt == 0 and (device is not None or self._can_choose()):
+                # the cached device list is outdated, try again with the current one
+                self._update_devices()
+            else:
+                break
+        self._log("No active device")
+        return False
 
 
     def execute_command(self, command: str) -> None:
@@ -70,56 +188,73 @@ class SpotifyPlugin(BasePlugin):
 
 
     def has_active_device(self):
-        current_playback = self.sp.current_playback()
-        if current_playback is None:
+        if self._playback() is None:
             self._log("No active device")
             return False
-        else:
-#            for device in self.sp.devices()['devices']:
-#                if device['is_active']:
-#                    print(device['name'])   
-            return True 
+        return True
+
+
+    # The current playback, None if no device is active
+    # also updates the play/pause key, Spotify may have been started or paused elsewhere
+    def _playback(self) -> Optional[Dict[str, Any]]:
+        playback = self.sp.current_playback()
+        if playback is not None and playback.get('device'):
+            self._remember_device(playback['device'])
+        self._publish_playing(playback is not None and bool(playback.get('is_playing')))
+        return playback
 
 
     def play_pause(self) -> None: 
-        if self.has_active_device():
-            try:
-                if self.sp.current_playback()['is_playing']:
-                    self._log("Pause")
-                    self.pause(False)
-                else:
-                    self.play(False)
-            except Exception as e:
-                self._log("Error")
-                pass;
-#        devices = self.sp.devices()
-#        self.sp.transfer_playback(devices['devices'][0]['id'])
+        try:
+            playback = self._playback()
+            if playback is not None and playback['is_playing']:
+                self._log("Pause")
+                self.sp.pause_playback()
+                self._publish_playing(False)
+            else:
+                self._play(playback)
+        except Exception as e:
+            self._log(f"Error: {e}")
     
 
     def play(self, check_active_device=True) -> None:
-        if self.has_active_device():
-            current_playback = self.sp.current_playback()
-            if current_playback is None or not current_playback['is_playing']:
-                self.sp.start_playback()
-                self._log(self.get_current_song_info())
-            else:
-                self._log("No song is currently playing.")
+        self._play(self._playback())
+
+
+    # Start or resume the playback, on the preferred device if no device is active
+    def _play(self, playback: Optional[Dict[str, Any]]) -> None:
+        if playback is None:
+            if self._transfer_and_play():
+                self._publish_playing(True)
+                self._log_song()
+        elif not playback['is_playing']:
+            self.sp.start_playback()
+            self._publish_playing(True)
+            self._log_song()
+        else:
+            self._log("Spotify is already playing.")
 
 
     def pause(self, check_active_device=True) -> None:
         if self.has_active_device():
             try:
                 self.sp.pause_playback()
+                self._publish_playing(False)
             except Exception as e:
                 self._log("Error")
                 pass
 
 
+    # let the play/pause key show whether Spotify is playing
+    def _publish_playing(self, playing: bool) -> None:
+        self.publish_state('spotify.playpause', playing)
+
+
     def next(self) -> None:
         if self.has_active_device():
             try:
                 self.sp.next_track()
-                self._log(self.get_current_song_info())
+                self._log_song()
             except Exception as e:
                 self._log("Error")
                 pass
@@ -129,7 +264,7 @@ class SpotifyPlugin(BasePlugin):
         if self.has_active_device():
             try:
                 self.sp.previous_track()
-                self._log(self.get_current_song_info())
+                self._log_song()
             except Exception as e:
                 self._log("Error")
                 pass
@@ -164,6 +299,11 @@ class SpotifyPlugin(BasePlugin):
             return None
 
 
-    def _log(self, message: str) -> None:
+    # Only ask for the song if it is printed
+    def _log_song(self) -> None:
         if self.verbose:
-            print(message)
+            self._log(self.get_current_song_info())
+
+
+    def _log(self, message: str) -> None:
+        log.debug('spotify', message)
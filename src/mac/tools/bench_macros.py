@@ -0,0 +1,90 @@
+# Benchmarks the macro compiler of the keypad code on the desktop harness
+# - number of HID reports per macro, compiled vs. one report per key_sequence item
+# - compile time per macro
+# - reached report rate for different hid_report_rate settings
+#
+# python3 bench_macros.py --rates 0 125 250 500 1000 --send-us 100
+
+import argparse
+import os
+import sys
+import time
+from typing import Any, Dict, List
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(SCRIPT_DIR))
+
+from keypad_harness import load_keypad, FakeHidDevice
+
+TEXT = "The quick brown fox jumps over the lazy dog. Pack my box with five dozen liquor jugs! 0123456789 (a+b)*c=d; "
+
+MACROS = {
+    'shortcut': "GUI+SHIFT+FOUR",
+    'sequence': ["GUI+SPACE", 0.1, "T", "E", "R", "M", "ENTER"],
+    'text': [{'text': TEXT * 2}],
+}
+
+
+# The reports of the previous key handling: one per pressed item, delay and the release at the end
+def legacy_reports(key_sequence: Any) -> int:
+    if isinstance(key_sequence, str):
+        return len(key_sequence.split('+')) + 1
+    count = 1
+    for item in key_sequence:
+        # text had to be typed as single keys, with a release after each of them
+        count += 2 * len(item['text']) if isinstance(item, dict) else 1
+    return count
+
+
+def compile_macros(controller: Any, repeat: int) -> Dict[str, Dict[str, Any]]:
+    results = {}
+    for name, key_sequence in MACROS.items():
+        started = time.perf_counter()
+        for _ in range(repeat):
+            items = controller.get_config_items({'key_sequence': key_sequence})
+        compile_us = (time.perf_counter() - started) / repeat * 1e6
+        macro = items['macro']
+        results[name] = {'macro': macro, 'legacy': legacy_reports(key_sequence),
+                         'reports': sum(1 for item in macro if isinstance(item, bytes)), 'compile_us': compile_us}
+    return results
+
+
+# Play a macro at a report rate and measure the reached rate
+def play(module: Any, macro: List[Any], rate: int, send_us: float) -> Dict[str, float]:
+    device = FakeHidDevice(send_us)
+    player = module.MacroPlayer(device, rate)
+    started = time.perf_counter()
+    player.play(macro)
+    duration = time.perf_counter() - started
+    report = player.report()
+    return {'reports': report['reports'], 'duration_ms': duration * 1000, 'rate': report['rate'],
+            'avg_send_us': report['avg_send_us']}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Benchmark the macro compiler and the HID report rate')
+    parser.add_argument('--rates', type=int, nargs='+', default=[0, 125, 250, 500, 1000],
+                        help='hid_report_rate settings to measure, 0 = unlimited (default: 0 125 250 500 1000)')
+    parser.add_argument('--send-us', type=float, default=0,
+                        help='Simulated time the host takes per report in µs (default: 0)')
+    parser.add_argument('--repeat', type=int, default=100, help='Compilations per macro (default: 100)')
+    args = parser.parse_args()
+
+    module = load_keypad()
+    controller = module.KeyController()
+    compiled = compile_macros(controller, args.repeat)
+    print("Compiled macros")
+    for name, result in compiled.items():
+        print(f"  {name:9} reports: {result['legacy']:4} -> {result['reports']:4}  compile: {result['compile_us']:.0f} µs")
+    print()
+    for name, result in compiled.items():
+        print(f"Playing {name} ({result['reports']} reports, {args.send_us:g} µs per report)")
+        for rate in args.rates:
+            values = play(module, result['macro'], rate, args.send_us)
+            print(f"  rate {rate or 'max':>5}  {values['duration_ms']:8.1f} ms  {values['rate']:6} reports/s  "
+                  f"send avg {values['avg_send_us']} µs")
+        print()
+
+
+if __name__ == "__main__":
+    main()
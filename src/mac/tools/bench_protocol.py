@@ -0,0 +1,213 @@
+# Compares the text line protocol with the framed protocol
+# - throughput and latency over a local socket pair
+# - delivery over a simulated lossy connection in both directions, between two
+#   Mac links and between a Mac link and the link of the keypad code (code.py)
+#
+# python3 bench_protocol.py --messages 2000 --loss 0.01 --corrupt 0.01
+
+import argparse
+import os
+import random
+import socket
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, List
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(SCRIPT_DIR))
+
+import framing
+from framing import FramedLink
+from keypad_harness import load_keypad
+
+APP_NAMES = ["Safari (github.com/LennartHennigs)", "Google Chrome", "zoom.us", "Café Müller", "Spotify"]
+
+
+def make_messages(count: int) -> List[str]:
+    return [f"App: {APP_NAMES[i % len(APP_NAMES)]} #{i}" for i in range(count)]
+
+
+def percentile(values: List[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+# Sends all messages from a host link to a device link over a socket pair
+def run_socket_benchmark(framed: bool, messages: List[str]) -> Dict[str, float]:
+    host_sock, device_sock = socket.socketpair()
+    host = FramedLink(host_sock.sendall, framed)
+    device = FramedLink(device_sock.sendall, framed)
+    sent_at = {}
+    latencies = []
+    received = [0]
+    done = threading.Event()
+    running = True
+
+    def pump(sock: socket.socket, link: FramedLink, is_device: bool) -> None:
+        sock.settimeout(0.05)
+        while running:
+            try:
+                data = sock.recv(65536)
+            except socket.timeout:
+                link.poll()
+                continue
+            except OSError:
+                return
+            now = time.perf_counter()
+            for message in link.receive(data):
+                if is_device:
+                    received[0] += 1
+                    # text lines lose non-ASCII characters and can't be matched
+                    if message in sent_at:
+                        latencies.append(now - sent_at[message])
+                    if received[0] == len(messages):
+                        done.set()
+            link.poll()
+
+    threads = [threading.Thread(target=pump, args=(device_sock, device, True), daemon=True),
+               threading.Thread(target=pump, args=(host_sock, host, False), daemon=True)]
+    for thread in threads:
+        thread.start()
+    start = time.perf_counter()
+    for message in messages:
+        sent_at[message] = time.perf_counter()
+        host.send(message)
+    done.wait(30)
+    elapsed = time.perf_counter() - start
+    running = False
+    for thread in threads:
+        thread.join()
+    host_sock.close()
+    device_sock.close()
+    return {
+        'intact': len(latencies),
+        'throughput': received[0] / elapsed,
+        'avg_latency_us': sum(latencies) / max(len(latencies), 1) * 1e6,
+        'p95_latency_us': percentile(latencies, 0.95) * 1e6 if latencies else 0,
+        'max_latency_us': max(latencies, default=0) * 1e6,
+    }
+
+
+# Compare the received with the sent messages, anything that was not sent is garbage
+def delivery(messages: List[str], received: List[str]) -> Dict[str, Any]:
+    sent = set(messages)
+    intact = [message for message in received if message in sent]
+    return {
+        'intact': len(intact),
+        'garbage': len(received) - len(intact),
+        'duplicates': len(intact) - len(set(intact)),
+        'in_order': intact == messages,
+    }
+
+
+# The link of the keypad code, with the same interface as a Mac link
+def pico_link(write: Callable[[bytes], None]) -> Any:
+    module = load_keypad()
+    # retransmit right away, the simulation has no real time
+    module.FramedLink.RETRANSMIT_TIMEOUT = 0
+    return module.FramedLink(write)
+
+
+# Sends all messages in both directions over a connection that loses and corrupts data
+# mode: text, framed (both links start framed), negotiated or pico (the watchdog negotiates with code.py)
+def run_lossy_simulation(mode: str, messages: List[str], loss: float, corrupt: float, seed: int) -> Dict[str, float]:
+    rng = random.Random(seed)
+    to_device = []
+    to_host = []
+    wire_bytes = [0]
+
+    def channel(queue: List[bytes]):
+        def write(data: bytes) -> None:
+            wire_bytes[0] += len(data)
+            if rng.random() < loss:
+                return
+            if rng.random() < corrupt:
+                data = bytearray(data)
+                data[rng.randrange(len(data))] ^= 0x20
+            queue.append(bytes(data))
+        return write
+
+    host = FramedLink(channel(to_device), mode == 'framed')
+    device = pico_link(channel(to_host)) if mode == 'pico' else FramedLink(channel(to_host), mode == 'framed')
+    host_received = []
+    device_received = []
+    timeout = framing.RETRANSMIT_TIMEOUT
+    # retransmit right away, the simulation has no real time
+    framing.RETRANSMIT_TIMEOUT = 0
+
+    # exchange the data until both links have nothing left to send
+    def pump(until: Callable[[], bool] = lambda: False) -> None:
+        for _ in range(100000):
+            if until():
+                return
+            if not to_device and not to_host:
+                host.poll()
+                device.poll()
+                if not to_device and not to_host:
+                    return
+            while to_device:
+                device_received.extend(device.receive(to_device.pop(0)))
+            while to_host:
+                host_received.extend(host.receive(to_host.pop(0)))
+
+    try:
+        if mode in ('negotiated', 'pico'):
+            # the messages of the watchdog wait for the answer, the keypad sends frames once it has answered
+            host.request_framed()
+            for message in messages:
+                host.send(message)
+            pump(lambda: device.framed)
+            for message in messages:
+                device.send(message)
+        else:
+            for message in messages:
+                host.send(message)
+                device.send(message)
+        pump()
+    finally:
+        framing.RETRANSMIT_TIMEOUT = timeout
+    to_keypad = delivery(messages, device_received)
+    to_watchdog = delivery(messages, host_received)
+    results = {key: to_keypad[key] + to_watchdog[key] for key in ('intact', 'garbage', 'duplicates')}
+    results['in_order'] = float(to_keypad['in_order'] and to_watchdog['in_order'])
+    results['dropped'] = host.stats['dropped'] + device.stats['dropped']
+    results['bytes_per_message'] = wire_bytes[0] / len(messages) / 2
+    results['retransmits'] = host.stats['retransmits'] + device.stats['retransmits']
+    return results
+
+
+def print_results(title: str, results: Dict[str, Dict[str, float]]) -> None:
+    print(title)
+    for protocol, values in results.items():
+        print(f"  {protocol:11}" + "  ".join(f"{key}: {value:.1f}" for key, value in values.items()))
+    print()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Benchmark the text and the framed serial protocol')
+    parser.add_argument('--messages', type=int, default=2000, help='Number of messages (default: 2000)')
+    parser.add_argument('--loss', type=float, default=0.01, help='Share of lost writes (default: 0.01)')
+    parser.add_argument('--corrupt', type=float, default=0.01, help='Share of corrupted writes (default: 0.01)')
+    parser.add_argument('--seed', type=int, default=1, help='Seed for the lossy simulation (default: 1)')
+    args = parser.parse_args()
+
+    messages = make_messages(args.messages)
+    print_results(f"Socket pair, {args.messages} messages", {
+        'text': run_socket_benchmark(False, messages),
+        'framed': run_socket_benchmark(True, messages),
+    })
+    lossy = {mode: run_lossy_simulation(mode, messages, args.loss, args.corrupt, args.seed)
+             for mode in ('text', 'framed', 'negotiated', 'pico')}
+    print_results(f"Lossy connection, {args.loss:.0%} lost, {args.corrupt:.0%} corrupted, "
+                  f"{args.messages} messages in each direction", lossy)
+    # frames may only lose messages they report as dropped, and never deliver anything else
+    failures = [mode for mode, values in lossy.items() if mode != 'text' and (
+        values['garbage'] or values['duplicates'] or values['intact'] + values['dropped'] < 2 * args.messages)]
+    if failures:
+        print(f"FAIL: {', '.join(failures)} delivered garbage or lost messages without reporting them")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
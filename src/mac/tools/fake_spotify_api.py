@@ -0,0 +1,217 @@
+# Runs the Spotify plugin against a local fake of the Spotify Web API
+# - no account, credentials or network needed
+# - checks the device transfer of play/playpause and counts the API calls per key press
+# - the background refreshes of the plugin are off, each scenario starts with a known device cache
+#
+# python3 fake_spotify_api.py
+
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+PLUGIN_DIR = os.path.abspath(os.path.join(SCRIPT_DIR, '..', 'plugins'))
+sys.path.append(os.path.dirname(PLUGIN_DIR))
+sys.path.append(PLUGIN_DIR)
+
+from spotipy import Spotify
+from base_plugin import DiscoveryCache
+from spotify import SpotifyPlugin
+
+TRACK = {'name': 'Song 2', 'artists': [{'name': 'Blur'}]}
+
+
+class FakeSpotifyApi(ThreadingHTTPServer):
+    """
+    The player endpoints of the Web API the plugin uses, with a list of devices.
+    """
+    devices: List[Dict[str, Any]]
+    # (method, path, status)
+    calls: List[Tuple[str, str, int]]
+
+    def __init__(self, devices: List[Dict[str, Any]]) -> None:
+        super().__init__(('127.0.0.1', 0), FakeSpotifyHandler)
+        self.devices = devices
+        self.active = None
+        self.playing = False
+        self.calls = []
+        self.lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/v1/"
+
+    def device(self, device_id: Optional[str]) -> Optional[Dict[str, Any]]:
+        return next((device for device in self.devices if device['id'] == device_id), None)
+
+    def playback(self) -> Optional[Dict[str, Any]]:
+        device = self.device(self.active)
+        if device is None:
+            return None
+        return {'device': dict(device, is_active=True, volume_percent=50), 'is_playing': self.playing, 'item': TRACK}
+
+
+class FakeSpotifyHandler(BaseHTTPRequestHandler):
+    server: FakeSpotifyApi
+
+    def do_GET(self) -> None:
+        self.handle_call('GET')
+
+    def do_PUT(self) -> None:
+        self.handle_call('PUT')
+
+    def do_POST(self) -> None:
+        self.handle_call('POST')
+
+    def handle_call(self, method: str) -> None:
+        url = urlparse(self.path)
+        path = url.path[len('/v1/'):].rstrip('/')
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        api = self.server
+        with api.lock:
+            status, body = self.respond(method, path, query)
+            api.calls.append((method, path + ('?' + url.query if url.query else ''), status))
+            self.reply(status, body)
+
+    # The status and body of an API call, called with the lock held
+    def respond(self, method: str, path: str, query: Dict[str, str]) -> Tuple[int, Optional[Dict[str, Any]]]:
+        api = self.server
+        if method == 'GET' and path == 'me':
+            return 200, {'id': 'tester', 'display_name': 'Tester'}
+        if method == 'GET' and path == 'me/player':
+            playback = api.playback()
+            return (200, playback) if playback else (204, None)
+        if method == 'GET' and path == 'me/player/devices':
+            return 200, {'devices': [dict(device, is_active=device['id'] == api.active) for device in api.devices]}
+        if method == 'GET' and path == 'me/player/currently-playing':
+            return 200, {'is_playing': api.playing, 'item': TRACK}
+        if method == 'PUT' and path == 'me/player/play':
+            # with a device_id the playback is transferred to that device
+            device_id = query.get('device_id', api.active)
+            if api.device(device_id) is None:
+                return 404, {'error': {'status': 404, 'message': 'Device not found'}}
+            api.active = device_id
+            api.playing = True
+            return 204, None
+        if api.active is None:
+            return 404, {'error': {'status': 404, 'message': 'No active device found'}}
+        if method == 'PUT' and path == 'me/player/pause':
+            api.playing = False
+            return 204, None
+        if path in ('me/player/next', 'me/player/previous', 'me/player/volume'):
+            return 204, None
+        return 404, {'error': {'status': 404, 'message': 'Service not found'}}
+
+    def reply(self, status: int, body: Optional[Dict[str, Any]] = None) -> None:
+        data = json.dumps(body).encode() if body is not None else b''
+        self.send_response(status)
+        if data:
+            self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+
+# The discovery cache of the plugin, in its own folder next to the config
+def plugin_cache(folder: str) -> DiscoveryCache:
+    return DiscoveryCache('spotify', os.path.join(folder, 'cache'))
+
+
+# Start a scenario with a known device list and last device
+def seed_cache(folder: str, devices: List[Dict[str, Any]], last_device: Optional[str] = None) -> None:
+    cache = plugin_cache(folder)
+    cache.put('user@fake', {'id': 'tester', 'display_name': 'Tester'})
+    cache.put('devices@fake', devices)
+    cache.put('last_device@fake', last_device)
+
+
+# Create the plugin with a fake token, its config and cache in a temporary folder
+# the background refreshes are off, the cached devices are only updated by the plugin commands
+def create_plugin(api: FakeSpotifyApi, folder: str, config: Dict[str, Any]) -> SpotifyPlugin:
+    config_file = os.path.join(folder, 'spotify.json')
+    with open(config_file, 'w') as f:
+        json.dump(dict({'client_id': 'fake', 'client_secret': 'fake', 'redirect_uri': 'http://localhost',
+                        'device_refresh': 3600}, **config), f)
+
+    class FakeSpotifyPlugin(SpotifyPlugin):
+        discovery_cache = plugin_cache(folder)
+
+        def _authenticate(self) -> Spotify:
+            sp = Spotify(auth='fake-token', retries=0)
+            sp.prefix = api.url
+            return sp
+
+        def _revalidate(self, key: str, fetch: Callable[[], Any], updated: Optional[Callable[[Any], None]],
+                        cached: Any) -> None:
+            pass
+
+    return FakeSpotifyPlugin(config_file, False)
+
+
+def main() -> None:
+    devices = [
+        {'id': 'speaker', 'name': 'Kitchen', 'type': 'Speaker'},
+        {'id': 'mac', 'name': 'MacBook Pro', 'type': 'Computer'},
+    ]
+    api = FakeSpotifyApi([dict(device) for device in devices])
+    threading.Thread(target=api.serve_forever, daemon=True).start()
+    failures = []
+
+    def check(title: str, action: Callable[[], None], expected: Callable[[], bool]) -> None:
+        api.calls.clear()
+        started = time.perf_counter()
+        action()
+        duration = (time.perf_counter() - started) * 1000
+        ok = expected()
+        if not ok:
+            failures.append(title)
+        calls = ', '.join(f"{method} {path} {status}" for method, path, status in api.calls)
+        print(f"{'ok  ' if ok else 'FAIL'} {title}: {len(api.calls)} calls in {duration:.1f} ms ({calls})")
+
+    with tempfile.TemporaryDirectory() as folder:
+        seed_cache(folder, devices)
+        plugin = create_plugin(api, folder, {'preferred_devices': ['MacBook Pro']})
+        check("playpause without an active device plays on the preferred device", plugin.play_pause,
+              lambda: api.active == 'mac' and api.playing)
+        check("playpause pauses", plugin.play_pause, lambda: not api.playing)
+        check("playpause resumes", plugin.play_pause, lambda: api.active == 'mac' and api.playing)
+        plugin.unload()
+
+        # the preferred device is gone, but still in the cache
+        api.active = None
+        api.playing = False
+        api.devices.pop()
+        seed_cache(folder, devices)
+        plugin = create_plugin(api, folder, {'preferred_devices': ['MacBook Pro']})
+        # the rejected transfer fetches the devices and retries on one that still exists
+        retried = [('PUT', 'me/player/play?device_id=mac', 404),
+                   ('GET', 'me/player/devices', 200),
+                   ('PUT', 'me/player/play?device_id=speaker', 204)]
+        check("play with an outdated device list plays on the remaining device", plugin.play,
+              lambda: api.active == 'speaker' and api.playing and api.calls[1:] == retried)
+        plugin.unload()
+
+        api.active = None
+        api.playing = False
+        seed_cache(folder, api.devices)
+        plugin = create_plugin(api, folder, {'device_fallback': 'none'})
+        # only the playback state is asked for, no device list
+        check("play without a preferred device and fallback none does nothing", plugin.play,
+              lambda: api.active is None and len(api.calls) == 1)
+        plugin.unload()
+
+    api.shutdown()
+    if failures:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,46 @@
 import os
+import sys
 import json
 from phue import Bridge
 
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
-CONFIG_PATH = os.path.abspath(os.path.join(SCRIPT_DIR, 'plugins', 'config', 'hue.json'))
+PLUGIN_DIR = os.path.abspath(os.path.join(SCRIPT_DIR, '..', 'plugins'))
+CONFIG_PATH = os.path.join(PLUGIN_DIR, 'config', 'hue.json')
+sys.path.append(os.path.dirname(PLUGIN_DIR))
+sys.path.append(PLUGIN_DIR)
+
+from base_plugin import DiscoveryCache
+
 config = {}
 
+
+def print_lights(lights):
+    for lamp_id, light in enumerate(lights):
+        print(f"{lamp_id}: {light['name']}")
+
+
 try:
     with open(CONFIG_PATH, 'r') as f:
         config = json.load(f)
-        # connect to bridge
-        bridge = Bridge(config['bridge_ip'])
-        bridge.connect()
-        # Get the light objects
-        lights = bridge.get_light_objects()
+    # the same cache as the Hue plugin
+    cache = DiscoveryCache('hue')
+    key = f"lights@{config['bridge_ip']}"
+    cached = cache.get(key)
+    if cached is not None:
+        print(f"Cached ({cache.age(key):.0f}s old):")
+        print_lights(cached)
+    # connect to bridge
+    bridge = Bridge(config['bridge_ip'])
+    bridge.connect()
+    # Get the lights and update the cache
+    lights = bridge.get_light()
+    lights = [{'id': int(light_id), 'name': lights[light_id]['name']} for light_id in sorted(lights, key=int)]
+    cache.put(key, lights)
+    if lights != cached:
+        if cached is not None:
+            print("\nBridge:")
         # Print the lamp names and indices
-        for lamp_id, light in enumerate(lights):
-            print(f"{lamp_id}: {light.name}")
+        print_lights(lights)
 
 except (FileNotFoundError, json.JSONDecodeError) as e:
     print(f"config file not found")
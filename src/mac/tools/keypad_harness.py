@@ -0,0 +1,138 @@
+# Runs the keypad code (src/pi_pico/code.py) on a desktop, with fake
+# CircuitPython modules instead of the keypad, the USB keyboard and the serial console
+#
+# from keypad_harness import load_keypad
+# keypad = load_keypad()
+# controller = keypad.KeyController()
+# controller.process_serial_str("App: Safari")
+
+import gc
+import importlib.util
+import os
+import sys
+import time
+import types
+from typing import List, Optional, Tuple
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+PICO_DIR = os.path.abspath(os.path.join(SCRIPT_DIR, '..', '..', 'pi_pico'))
+
+
+class FakeKey:
+    def __init__(self, number: int) -> None:
+        self.number = number
+        self.led = None
+
+    def set_led(self, *color: int) -> None:
+        self.led = color
+
+    def led_off(self) -> None:
+        self.led = None
+
+
+class FakeRgbKeypad:
+    """
+    The 16 keys of the keypad, press() and release() call the handlers like a key scan.
+    """
+    def __init__(self) -> None:
+        self.keys = [FakeKey(number) for number in range(16)]
+        self.press_handlers = {}
+        self.release_handlers = {}
+
+    def on_press(self, key: FakeKey, handler) -> None:
+        self.press_handlers[key.number] = handler
+
+    def on_release(self, key: FakeKey, handler) -> None:
+        self.release_handlers[key.number] = handler
+
+    def update(self) -> None:
+        pass
+
+    def press(self, number: int) -> None:
+        self.press_handlers[number]()
+
+    def release(self, number: int) -> None:
+        self.release_handlers[number]()
+
+
+class FakeConsole:
+    """
+    The serial console, feed() queues data for the keypad, written collects what it has sent.
+    """
+    def __init__(self) -> None:
+        self.received = b''
+        self.written = []
+
+    @property
+    def in_waiting(self) -> int:
+        return len(self.received)
+
+    def feed(self, data: bytes) -> None:
+        self.received += data
+
+    def read(self, count: int) -> bytes:
+        data, self.received = self.received[:count], self.received[count:]
+        return data
+
+    def write(self, data: bytes) -> int:
+        self.written.append(bytes(data))
+        return len(data)
+
+
+class FakeHidDevice:
+    """
+    The USB keyboard device, records each report with its time in ns.
+    send_us simulates how long the host takes to pick up a report.
+    """
+    reports: List[Tuple[int, bytes]]
+
+    def __init__(self, send_us: float = 0) -> None:
+        self.send_us = send_us
+        self.reports = []
+
+    def send_report(self, report: bytes) -> None:
+        if self.send_us:
+            done = time.perf_counter_ns() + int(self.send_us * 1000)
+            while time.perf_counter_ns() < done:
+                pass
+        self.reports.append((time.perf_counter_ns(), bytes(report)))
+
+
+class FakeKeyboard:
+    """
+    Records each keyboard call with its time in ns.
+    """
+    reports: List[Tuple[int, Tuple[int, ...]]]
+
+    def __init__(self, devices) -> None:
+        self.reports = []
+
+    def press(self, *keycodes: int) -> None:
+        self.reports.append((time.perf_counter_ns(), keycodes))
+
+    def release_all(self) -> None:
+        self.reports.append((time.perf_counter_ns(), ()))
+
+
+# Register the fake hardware modules, CPython has no gc.mem_free() either
+def install_fake_modules() -> None:
+    modules = {name: types.ModuleType(name) for name in ('rgbkeypad', 'usb_hid', 'usb_cdc', 'adafruit_hid', 'adafruit_hid.keyboard')}
+    modules['rgbkeypad'].RgbKeypad = FakeRgbKeypad
+    modules['usb_hid'].devices = [FakeHidDevice()]
+    modules['usb_cdc'].console = FakeConsole()
+    modules['adafruit_hid'].find_device = lambda devices, usage_page, usage: devices[0]
+    modules['adafruit_hid.keyboard'].Keyboard = FakeKeyboard
+    modules['adafruit_hid'].keyboard = modules['adafruit_hid.keyboard']
+    sys.modules.update(modules)
+    if not hasattr(gc, 'mem_free'):
+        gc.mem_free = lambda: 1 << 20
+
+
+# Load code.py as a module, with key_def.json of the Pico folder or the given config
+def load_keypad(config: Optional[str] = None) -> types.ModuleType:
+    install_fake_modules()
+    spec = importlib.util.spec_from_file_location('keypad_code', os.path.join(PICO_DIR, 'code.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    module.KeyController.JSON_FILE = os.path.abspath(config or os.path.join(PICO_DIR, 'key_def.json'))
+    return module
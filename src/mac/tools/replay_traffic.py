@@ -0,0 +1,73 @@
+# Replays the traffic recorded by the watchdog (--record) and compares the runs
+# - keypad:  feeds the lines sent to the keypads into the keypad code on this machine
+# - compare: prints the differences between two reports
+# (watchdog.py --replay replays a recording into the watchdog itself)
+#
+# python3 replay_traffic.py keypad cmd-tab.jsonl --speed 0 --report new.json --baseline old.json
+# python3 replay_traffic.py compare old.json new.json
+
+import argparse
+import json
+import os
+import sys
+import time
+from typing import Any, Dict, Optional
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(SCRIPT_DIR))
+
+from traffic_recorder import TrafficReplayer, load_recording, print_report, SENT
+from keypad_harness import load_keypad
+
+
+def load_report(path: Optional[str]) -> Optional[Dict[str, Any]]:
+    if not path:
+        return None
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+# Replays the lines the watchdog has sent, measures how long the keypad code takes for each of them
+def replay_keypad(recording: str, speed: float, config: Optional[str]) -> Dict[str, Any]:
+    controller = load_keypad(config).KeyController()
+    # the deferred part of the setup is not part of the measurement
+    controller.finish_setup()
+    controller.profiler.enabled = True
+
+    def handle(kind: str, line: str) -> None:
+        controller.received_at = time.monotonic_ns()
+        controller.process_serial_str(line)
+        controller.link.poll()
+
+    report = TrafficReplayer(load_recording(recording), handle, speed, kinds=(SENT,)).run()
+    report['keypads'] = {'harness': controller.profiler.report()}
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Replay a recording of the watchdog and compare the runs')
+    commands = parser.add_subparsers(dest='command', required=True)
+    keypad = commands.add_parser('keypad', help='Replay the lines sent to the keypads into the keypad code')
+    keypad.add_argument('recording', help='Recording of watchdog.py --record')
+    keypad.add_argument('--speed', type=float, default=1.0,
+                        help='Speed of the replay, 0 replays as fast as possible (default: 1.0)')
+    keypad.add_argument('--config', help='Key definitions (default: the key_def.json of the Pico)')
+    keypad.add_argument('--report', help='Write the report as JSON to this file')
+    keypad.add_argument('--baseline', help='Report of an earlier run to compare with')
+    compare = commands.add_parser('compare', help='Compare two reports')
+    compare.add_argument('baseline', help='Report of the earlier run')
+    compare.add_argument('report', help='Report of the new run')
+    args = parser.parse_args()
+
+    if args.command == 'compare':
+        print_report(load_report(args.report), load_report(args.baseline))
+        return
+    report = replay_keypad(args.recording, args.speed, args.config)
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
+    print_report(report, load_report(args.baseline))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+# DIY Streamdeck traffic recorder code for a Mac
+# L. Hennigs and ChatGPT 4.0
+# last changed: 10-19-26
+# https://github.com/LennartHennigs/DIYStreamDeck
+
+# A recording is a JSON lines file, a header and one short array per event:
+#   {"recording": 1, "started": 1792400000.123}
+#   [0.0, "A", "Safari"]                   app activated
+#   [0.4, ">", "App: Safari (github.com)"] line sent to the keypads
+#   [812.5, "<", "Run: spotify.playpause"] line received from a keypad
+#   [2301.2, "T", "zoom.us"]               app terminated
+# The first value is the time in ms since the start of the recording.
+
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import json
+import threading
+import time
+from event_log import log
+
+RECORDING_VERSION = 1
+
+ACTIVATED = 'A'
+TERMINATED = 'T'
+RECEIVED = '<'
+SENT = '>'
+KINDS = (ACTIVATED, TERMINATED, RECEIVED, SENT)
+
+Event = Tuple[float, str, str]
+
+
+class TrafficRecorder:
+    """
+    Appends the events to a recording, can be called from any thread.
+    """
+    path: str
+    started: float
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.lock = threading.Lock()
+        self.file = open(path, 'w')
+        self.started = time.monotonic()
+        self.count = 0
+        self.file.write(json.dumps({'recording': RECORDING_VERSION, 'started': time.time()}) + '\n')
+
+    def record(self, kind: str, text: str) -> None:
+        elapsed = round((time.monotonic() - self.started) * 1000, 1)
+        with self.lock:
+            if self.file is None:
+                return
+            self.file.write(json.dumps([elapsed, kind, text], ensure_ascii=False, separators=(',', ':')) + '\n')
+            self.count += 1
+
+    def close(self) -> None:
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+        log.info('recorder', f"Recorded {self.count} events to {self.path}", path=self.path, events=self.count)
+
+
+# Read a recording, returns the events as (ms, kind, text)
+def load_recording(path: str) -> List[Event]:
+    events = []
+    with open(path, 'r') as f:
+        header = json.loads(f.readline())
+        if header.get('recording') != RECORDING_VERSION:
+            raise ValueError(f"{path} is not a recording")
+        for line in f:
+            if line.strip():
+                elapsed, kind, text = json.loads(line)
+                events.append((elapsed, kind, text))
+    return events
+
+
+# The kind of a line for the report, e.g. "App" for "App: Safari" or "." for a heartbeat
+def line_kind(line: str) -> str:
+    return line.split(':', 1)[0] if ':' in line else line
+
+
+def percentile(values: List[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else 0.0
+
+
+# n, avg, p95 and max of a list of durations in ms
+def summarize(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {'n': 0}
+    return {'n': len(values), 'avg_ms': round(sum(values) / len(values), 3),
+            'p95_ms': round(percentile(values, 0.95), 3), 'max_ms': round(max(values), 3)}
+
+
+class TrafficReplayer:
+    """
+    Plays the events of a recording back in their original rhythm, speed 2 plays
+    them twice as fast and speed 0 as fast as possible. handle(kind, text) is called
+    on the replay thread for each event of the replayed kinds, the report contains
+    how late the events have been dispatched and how long handling them took.
+    """
+    events: List[Event]
+    speed: float
+    kinds: Tuple[str, ...]
+    handle: Callable[[str, str], None]
+    on_done: Optional[Callable[[Dict[str, Any]], None]]
+
+    def __init__(self, events: List[Event], handle: Callable[[str, str], None], speed: float = 1.0,
+                 kinds: Tuple[str, ...] = (ACTIVATED, TERMINATED, RECEIVED),
+                 on_done: Optional[Callable[[Dict[str, Any]], None]] = None) -> None:
+        self.events = [event for event in events if event[1] in kinds]
+        self.handle = handle
+        self.speed = speed
+        self.kinds = kinds
+        self.on_done = on_done
+        self.running = False
+        self.thread = None
+        self.lags = []
+        self.durations = {}
+        self.elapsed = 0.0
+
+    def start(self) -> None:
+        self.running = True
+        self.thread = threading.Thread(target=self._replay, daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+
+    # Replay all events on the calling thread and return the report
+    def run(self) -> Dict[str, Any]:
+        self.running = True
+        started = time.perf_counter()
+        first = self.events[0][0] if self.events else 0.0
+        for elapsed, kind, text in self.events:
+            if not self.running:
+                break
+            due = started + (elapsed - first) / 1000 / self.speed if self.speed else time.perf_counter()
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            dispatched = time.perf_counter()
+            self.lags.append((dispatched - due) * 1000)
+            try:
+                self.handle(kind, text)
+            except Exception as e:
+                log.error('recorder', f"Error replaying {kind} {text}: {e}")
+            self.durations.setdefault(self.label(kind, text), []).append((time.perf_counter() - dispatched) * 1000)
+        self.elapsed = time.perf_counter() - started
+        return self.report()
+
+    # The events are grouped by the kind of line, activations and terminations by themselves
+    def label(self, kind: str, text: str) -> str:
+        if kind == ACTIVATED:
+            return 'activated'
+        if kind == TERMINATED:
+            return 'terminated'
+        return line_kind(text)
+
+    def report(self) -> Dict[str, Any]:
+        count = sum(len(values) for values in self.durations.values())
+        return {
+            'events': count,
+            'speed': self.speed,
+            'duration_s': round(self.elapsed, 3),
+            'events_per_s': round(count / self.elapsed, 1) if self.elapsed else 0.0,
+            'lag': summarize(self.lags),
+            'handling': {label: summarize(values) for label, values in sorted(self.durations.items())},
+        }
+
+    def _replay(self) -> None:
+        report = self.run()
+        if self.on_done is not None:
+            self.on_done(report)
+
+
+# Print a report, or the differences of a report to a baseline
+def print_report(report: Dict[str, Any], baseline: Optional[Dict[str, Any]] = None) -> None:
+    def value(current: float, previous: Optional[float]) -> str:
+        if previous is None:
+            return f"{current:.3f}"
+        change = f" ({(current - previous) / previous:+.0%})" if previous else ""
+        return f"{previous:.3f} -> {current:.3f}{change}"
+
+    def stats(name: str, current: Dict[str, float], previous: Optional[Dict[str, float]]) -> None:
+        if not current.get('n'):
+            print(f"  {name:12} n=0")
+            return
+        previous = previous if previous and previous.get('n') else {}
+        print(f"  {name:12} n={current['n']}  " + "  ".join(
+            f"{key[:-3]}: {value(current[key], previous.get(key))} ms" for key in ('avg_ms', 'p95_ms', 'max_ms')))
+
+    baseline = baseline or {}
+    print(f"{report['events']} events in {report['duration_s']:.1f}s at speed {report['speed']:g}, "
+          f"{value(report['events_per_s'], baseline.get('events_per_s'))} events/s")
+    print("Dispatch lag:")
+    stats('all', report['lag'], baseline.get('lag'))
+    print("Handling time:")
+    for name, current in report['handling'].items():
+        stats(name, current, baseline.get('handling', {}).get(name))
+    for name, profile in report.get('keypads', {}).items():
+        print(f"Keypad {name}:")
+        previous_profile = baseline.get('keypads', {}).get(name, {})
+        for stage, values in profile.items():
+            previous = previous_profile.get(stage, {})
+            print(f"  {stage:12} n={values.get('n', 0)}  " + "  ".join(
+                f"{key}: {value(values[key] / 1000, previous[key] / 1000 if key in previous else None)} ms"
+                for key in ('avg', 'p95', 'max') if key in values))
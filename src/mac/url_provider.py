@@ -0,0 +1,275 @@
+# DIY Streamdeck URL provider code for a Mac
+# L. Hennigs and ChatGPT 4.0
+# last changed: 10-19-26
+# https://github.com/LennartHennigs/DIYStreamDeck
+
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+import queue
+import select
+import shutil
+import subprocess
+import threading
+import time
+from event_log import log
+
+try:
+    from Quartz import (CGWindowListCopyWindowInfo, kCGNullWindowID,
+                        kCGWindowListExcludeDesktopElements, kCGWindowListOptionOnScreenOnly)
+except ImportError:
+    CGWindowListCopyWindowInfo = None
+
+URL_CACHE_TTL = 3.0
+# seconds to wait for a browser to answer
+URL_TIMEOUT = 5.0
+
+# callback(app_name, window_id, url)
+UrlCallback = Callable[[str, Optional[int], str], None]
+
+
+class UrlProvider(ABC):
+    """
+    Looks up the URL of the active browser tab on a long-lived worker thread.
+    Results are cached for a short time per app and window.
+    """
+    BROWSERS = ("Safari", "Google Chrome")
+    ttl: float
+    cache: Dict[Tuple[str, Optional[int]], Tuple[float, str]]
+    pending: Dict[Tuple[str, Optional[int]], List[UrlCallback]]
+
+    def __init__(self, ttl: float = URL_CACHE_TTL) -> None:
+        self.ttl = ttl
+        self.cache = {}
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.requests = queue.Queue()
+        self.worker = threading.Thread(target=self._work, daemon=True)
+        self.worker.start()
+
+    @abstractmethod
+    def fetch_url(self, app_name: str) -> str:
+        """
+        Returns the full URL of the active tab of the app or an empty string.
+        Always called on the worker thread.
+        """
+        pass
+
+    def supports(self, app_name: str) -> bool:
+        return app_name in self.BROWSERS
+
+    def window_id(self, pid: Optional[int]) -> Optional[int]:
+        return None
+
+    # Returns the cached URL or None if it is unknown or expired
+    def cached_url(self, app_name: str, window_id: Optional[int]) -> Optional[str]:
+        with self.lock:
+            entry = self.cache.get((app_name, window_id))
+        if entry is None or time.monotonic() - entry[0] > self.ttl:
+            return None
+        return entry[1]
+
+    # Looks up the URL in the background, identical requests are only run once
+    def request_url(self, app_name: str, window_id: Optional[int], callback: UrlCallback) -> None:
+        key = (app_name, window_id)
+        with self.lock:
+            if key in self.pending:
+                if callback not in self.pending[key]:
+                    self.pending[key].append(callback)
+                return
+            self.pending[key] = [callback]
+        self.requests.put(key)
+
+    # Drops all cached URLs of an app, e.g. when it has been terminated
+    def forget(self, app_name: str) -> None:
+        with self.lock:
+            for key in [key for key in self.cache if key[0] == app_name]:
+                del self.cache[key]
+
+    def stop(self) -> None:
+        self.requests.put(None)
+        self.worker.join()
+
+    def _work(self) -> None:
+        while True:
+            key = self.requests.get()
+            if key is None:
+                return
+            app_name, window_id = key
+            try:
+                url = self.fetch_url(app_name)
+            except Exception as e:
+                log.warning('url', f"Error getting URL from {app_name}: {e}")
+                url = ""
+            with self.lock:
+                self.cache[key] = (time.monotonic(), url)
+                callbacks = self.pending.pop(key, [])
+            for callback in callbacks:
+                callback(app_name, window_id, url)
+
+
+class AppleScriptUrlProvider(UrlProvider):
+    """
+    Keeps one osascript process running instead of starting one for each activation.
+    NSAppleScript may only be used on the main thread, the osascript process keeps the
+    scripting off the run loop of the watchdog. The process reads a browser name per line
+    and answers with "OK <url>" or "ERR <message>". It is started again if it has quit
+    or a browser doesn't answer within URL_TIMEOUT seconds.
+    """
+    SCRIPT = '''
+        ObjC.import('Foundation');
+        const input = $.NSFileHandle.fileHandleWithStandardInput;
+        const output = $.NSFileHandle.fileHandleWithStandardOutput;
+        function url(name) {
+            const app = Application(name);
+            if (app.windows.length === 0) {
+                return "";
+            }
+            const tab = name === "Safari" ? app.windows[0].currentTab : app.windows[0].activeTab;
+            return tab.url() || "";
+        }
+        function answer(text) {
+            output.writeData($(text.replace(/\\n/g, " ") + "\\n").dataUsingEncoding($.NSUTF8StringEncoding));
+        }
+        let buffer = "";
+        while (true) {
+            const data = input.availableData;
+            if (data.length === 0) {
+                break;
+            }
+            buffer += $.NSString.alloc.initWithDataEncoding(data, $.NSUTF8StringEncoding).js;
+            let end;
+            while ((end = buffer.indexOf("\\n")) >= 0) {
+                const name = buffer.slice(0, end);
+                buffer = buffer.slice(end + 1);
+                try {
+                    answer("OK " + url(name));
+                } catch (e) {
+                    answer("ERR " + e);
+                }
+            }
+        }
+    '''
+    process: Optional[subprocess.Popen]
+
+    def __init__(self, ttl: float = URL_CACHE_TTL) -> None:
+        if shutil.which('osascript') is None or CGWindowListCopyWindowInfo is None:
+            raise RuntimeError("AppleScript is not available on this platform.")
+        self.process = None
+        super().__init__(ttl)
+
+    def fetch_url(self, app_name: str) -> str:
+        if self.process is None or self.process.poll() is not None:
+            self.process = subprocess.Popen(['osascript', '-l', 'JavaScript', '-e', self.SCRIPT],
+                                            stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                            stderr=subprocess.DEVNULL, text=True, bufsize=1)
+        try:
+            self.process.stdin.write(app_name + '\n')
+            self.process.stdin.flush()
+            ready, _, _ = select.select([self.process.stdout], [], [], URL_TIMEOUT)
+            answer = self.process.stdout.readline().rstrip('\n') if ready else None
+        except OSError as e:
+            answer = None
+            log.debug('url', f"osascript failed: {e}")
+        if not answer:
+            # the next request starts a new process
+            self._close()
+            raise RuntimeError("No answer from osascript")
+        status, _, text = answer.partition(' ')
+        if status != 'OK':
+            raise RuntimeError(text)
+        return text
+
+    def stop(self) -> None:
+        super().stop()
+        self._close()
+
+    def _close(self) -> None:
+        process, self.process = self.process, None
+        if process is not None and process.poll() is None:
+            process.kill()
+            process.wait()
+
+    # Returns the number of the front window of the process
+    def window_id(self, pid: Optional[int]) -> Optional[int]:
+        if pid is None:
+            return None
+        windows = CGWindowListCopyWindowInfo(
+            kCGWindowListOptionOnScreenOnly | kCGWindowListExcludeDesktopElements, kCGNullWindowID)
+        # the list is ordered front to back
+        for window in windows or []:
+            if window.get('kCGWindowOwnerPID') == pid and window.get('kCGWindowLayer') == 0:
+                return window.get('kCGWindowNumber')
+        return None
+
+
+class FakeUrlProvider(UrlProvider):
+    """
+    Returns predefined URLs after an optional delay, to run the watchdog logic without a Mac.
+    """
+    urls: Dict[str, str]
+    delay: float
+
+    def __init__(self, urls: Dict[str, str], delay: float = 0, ttl: float = URL_CACHE_TTL) -> None:
+        self.urls = urls
+        self.delay = delay
+        super().__init__(ttl)
+
+    def supports(self, app_name: str) -> bool:
+        return app_name in self.urls
+
+    def fetch_url(self, app_name: str) -> str:
+        if self.delay:
+            time.sleep(self.delay)
+        return self.urls.get(app_name, "")
+
+
+class ActiveAppReporter:
+    """
+    Reports the active app as the text of an App: line. The app name is sent right away,
+    for a browser the name with the URL of the active tab follows once the provider knows it.
+    Needs no Cocoa, so it runs with a FakeUrlProvider as well.
+    """
+    provider: UrlProvider
+    send: Callable[[str], None]
+    active: Optional[Tuple[str, Optional[int]]]
+
+    def __init__(self, provider: UrlProvider, send: Callable[[str], None]) -> None:
+        self.provider = provider
+        self.send = send
+        self.active = None
+
+    # Called when the active application changes
+    def activated(self, app_name: str, pid: Optional[int] = None) -> None:
+        url = ""
+        if self.provider.supports(app_name):
+            window_id = self.provider.window_id(pid)
+            self.active = (app_name, window_id)
+            cached_url = self.provider.cached_url(app_name, window_id)
+            if cached_url is None:
+                self.provider.request_url(app_name, window_id, self.url_received)
+            else:
+                url = self.format_url(app_name, cached_url)
+        else:
+            self.active = (app_name, None)
+        self.send(app_name + url)
+
+    # Called on the URL provider thread when the URL of a browser is known
+    def url_received(self, app_name: str, window_id: Optional[int], full_url: str) -> None:
+        url = self.format_url(app_name, full_url)
+        # ignore the URL if the user has switched to another app or window in the meantime
+        if url and self.active == (app_name, window_id):
+            self.send(app_name + url)
+
+    # Format the URL of the active tab for the App: message, the host without port and user info
+    def format_url(self, app_name: str, full_url: str) -> str:
+        if full_url:
+            parsed_url = urlparse(full_url)
+            base_url = parsed_url.hostname or ""
+
+            # If base_url is 'newtab' for Google Chrome or empty for Safari, don't add it in brackets
+            if not (app_name == "Google Chrome" and base_url == "newtab") and base_url != "":
+                # the path is sent as well, so the keypad can match path prefixes
+                return " (" + base_url + parsed_url.path.rstrip('/') + ")"
+
+        return ""
@@ -1,64 +1,112 @@
 # DIY Streamdeck watchdog code for a Mac
 # L. Hennigs and ChatGPT 4.0
-# last changed: 01-31-24
+# last changed: 10-19-26
 # https://github.com/LennartHennigs/DIYStreamDeck
 
 import sys
 import Cocoa
-import serial
 import objc
 import termios
 import tty
 import argparse
 import re
-import subprocess
+import json
+import selectors
 from inspect import signature
-from typing import Optional, Dict, Any, List, Tuple
+from typing import Callable, Optional, Dict, Any, List
 from contextlib import contextmanager
-from urllib.parse import urlparse
-import importlib.util
 import os
-from plugins.base_plugin import BasePlugin
-import threading
-import time
-from AppKit import NSWorkspaceDidTerminateApplicationNotification
-
-VERSION = "1.2.1"
-HEARTBEAT_INTERVAL = 2
 
+# the plugins and the modules that load them import base_plugin from the plugin folder
 plugins_directory = os.path.dirname(os.path.abspath(__file__)) + '/plugins'
 sys.path.append(plugins_directory)
 
-def create_serial_connection(port: str, baud_rate: int) -> Optional[serial.Serial]:
-    try:
-        return serial.Serial(port, baud_rate, timeout=1)
-    except serial.SerialException:
-        return None
+from base_plugin import BasePlugin
+from url_provider import UrlProvider, AppleScriptUrlProvider, ActiveAppReporter, URL_CACHE_TTL
+from keypad_device import KeypadDevice, parse_port, READY
+from link_monitor import HEARTBEAT_INTERVAL, HEARTBEAT_MAX_INTERVAL
+from plugin_host import IsolatedPlugin, PLUGIN_TIMEOUT, PLUGIN_MEMORY_LIMIT
+from plugin_loader import load_plugins, PluginReloader
+from event_log import log, LEVELS, DEBUG, INFO, EVENT_LOG_SIZE
+from app_launcher import AppLauncher, OpenLauncher
+from action_runner import ActionRunner
+from traffic_recorder import TrafficRecorder, TrafficReplayer, load_recording, print_report, ACTIVATED, TERMINATED, RECEIVED, SENT
+import signal
+import threading
+import time
+import queue
+from AppKit import NSWorkspaceDidTerminateApplicationNotification
 
+VERSION = "1.2.1"
+STATE_INTERVAL = 0.1
+PROFILE_REPLY_TIMEOUT = 2.0
 
+# Alternates between the Cocoa run loop (app notifications) and the serial ports of all keypads
 def run_loop(observer: 'WatchDog') -> None:
     run_loop = Cocoa.NSRunLoop.currentRunLoop()
-    while True:
+    while observer.running:
         run_loop.runMode_beforeDate_(
-            Cocoa.NSDefaultRunLoopMode, Cocoa.NSDate.dateWithTimeIntervalSinceNow_(0.1))
-        observer.check_serial()
+            Cocoa.NSDefaultRunLoopMode, Cocoa.NSDate.dateWithTimeIntervalSinceNow_(0.05))
+        observer.check_serial(0.05)
 
 class WatchDog(Cocoa.NSObject):
-    ser: serial.Serial
+    devices: List[KeypadDevice]
+    selector: selectors.BaseSelector
     args: argparse.Namespace
     plugins: Dict[str, BasePlugin]
+    url_provider: UrlProvider
+    app_reporter: ActiveAppReporter
+    launcher: AppLauncher
+    action_runner: ActionRunner
+    recorder: Optional[TrafficRecorder] = None
+    keypad_profiles: Dict[str, Any]
+    app_line: Optional[str] = None
+    states: Dict[str, Any]
+    pending_states: Dict[str, Any]
+    last_state_flush: float = 0.0
+    last_profile_query: float = 0.0
+    # set by the SIGUSR1 handler, the dump runs in check_serial
+    dump_requested: bool = False
     launch_pattern = r"^Launch: (.+)$"
     run_pattern = r"^Run: (.+)$"
+    profile_pattern = r"^Profile: (\{.*\})$"
+    gc_pattern = r"^Gc: (\{.*\})$"
+    hid_pattern = r"^Hid: (\{.*\})$"
+    boot_pattern = r"^Boot: (\[.*\])$"
+    pong_pattern = r"^Pong: (\d+) (\d+)$"
+    link_pattern = r"^Link: (\{.*\})$"
     running: bool = True
 
-    # Initializer
-    def initWithSerial_args_plugins_(self, ser: serial.Serial, args: argparse.Namespace, plugins: Dict[str, Any]) -> Optional['WatchDog']:
+    # Initializer, the URL provider is passed in so it can be replaced, e.g. by a FakeUrlProvider
+    def initWithDevices_args_plugins_urlProvider_(self, devices: List[KeypadDevice], args: argparse.Namespace,
+                                                  plugins: Dict[str, Any], url_provider: UrlProvider) -> Optional['WatchDog']:
         self = objc.super(WatchDog, self).init()
         if self is None:
             return None
-        self.ser = ser
+        self.devices = devices
         self.args = args
         self.plugins = plugins
+        self.selector = selectors.DefaultSelector()
+        for device in devices:
+            if device.connected:
+                self.selector.register(device, selectors.EVENT_READ, device)
+        self.url_provider = url_provider
+        self.app_reporter = ActiveAppReporter(url_provider, self.send_app_line)
+        self.launcher = AppLauncher(OpenLauncher(), args.prewarm)
+        self.action_runner = ActionRunner(self.run_command)
+        if args.record:
+            self.recorder = TrafficRecorder(args.record)
+        # the last latencies reported by each keypad, for the replay report
+        self.keypad_profiles = {}
+        self.profile_condition = threading.Condition()
+        # functions queued by other threads (e.g. the replay) for the run loop, with their done events
+        self.run_loop_calls = queue.Queue()
+        # plugin states, all known ones are replayed after a reconnect
+        self.states = {}
+        self.pending_states = {}
+        self.state_lock = threading.Lock()
+        for plugin in plugins.values():
+            plugin.set_state_listener(self.plugin_state_changed)
         # Add observer for application termination
         Cocoa.NSWorkspace.sharedWorkspace().notificationCenter().addObserver_selector_name_object_(
             self,
@@ -75,24 +123,28 @@ class WatchDog(Cocoa.NSObject):
         app_name = app.localizedName()
         if not app_name:
             app_name = app.bundleIdentifier() or app.bundleExecutable()
-#        if self.args.verbose:
-#            print(f"{app_name} has been terminated")
+        if self.recorder:
+            self.recorder.record(TERMINATED, app_name)
+        self.app_terminated(app_name)
+
+
+    # Forget the terminated app and let the keypad know
+    @objc.python_method
+    def app_terminated(self, app_name: str) -> None:
+        log.debug('watchdog', f"{app_name} has been terminated")
+        self.url_provider.forget(app_name)
+        self.launcher.app_terminated(app_name)
         # send the app name to the keypad
-        try:
-            self.ser.write(("Terminated: " + app_name + '\n').encode('ascii', 'replace'))
-        except (serial.SerialException, UnicodeEncodeError) as e:
-            print(f"Error sending app name to microcontroller: {e}")
+        self.send_line("Terminated: " + app_name)
 
 
-    # Called every HEARTBEAT_INTERVAL seconds
-    @objc.typedSelector(b'v@:')  # Encoded the signature string as bytes
-    def send_heartbeat(self) -> None:
-        while self.running:
-            try:
-                self.ser.write('.\n'.encode('ascii', 'replace'))
-            except (serial.SerialException, UnicodeEncodeError) as e:
-                print(f"Error sending heartbeat to microcontroller: {e}")
-            time.sleep(HEARTBEAT_INTERVAL)
+    # Send the pings that are due, the pongs are timed while waiting for the keypads
+    @objc.python_method
+    def send_heartbeat(self, now: float) -> None:
+        for device in self.devices:
+            line = device.heartbeat(now)
+            if line and self.recorder:
+                self.recorder.record(SENT, line)
 
 
     # Called when the active application changes
@@ -102,110 +154,123 @@ class WatchDog(Cocoa.NSObject):
         app_name = app.localizedName()
         if not app_name:
             app_name = app.bundleIdentifier() or app.bundleExecutable()
-        self.send_app_name_to_microcontroller(app_name)
-
-
-    # Get the URL of the active tab in Google Chrome or Safari
-    @objc.typedSelector(b'v@:@')  # Encoded the signature string as bytes
-    def get_url(self, app_name) -> str:
-        command_dict = {
-            "Google Chrome": '''
-                if (count of windows) > 0 then
-                    get URL of active tab of first window
-                else
-                    return ""
-                end if
-            ''',
-            "Safari": '''
-                if (count of windows) > 0 then
-                    get URL of current tab of front window
-                else
-                    return ""
-                end if
-            '''
-        }
-        script = f'''
-            tell application "{app_name}"
-                {command_dict[app_name]}
-            end tell
-        '''
-        osa = subprocess.Popen(
-            ['osascript', '-'], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
-        output, error = osa.communicate(script.encode())
-        full_url = output.decode().strip()
-
-        if full_url:
-            parsed_url = urlparse(full_url)
-            base_url = parsed_url.netloc
-
-            # If base_url is 'newtab' for Google Chrome or empty for Safari, don't add it in brackets
-            if not (app_name == "Google Chrome" and base_url == "newtab") and base_url != "":
-                return " (" + base_url + ")"
-        
-        return ""
-
+        if self.recorder:
+            self.recorder.record(ACTIVATED, app_name)
+        self.send_app_name_to_microcontroller(app_name, app.processIdentifier())
 
 
     # Send the name of the active application to the keypad via serial
-    @objc.typedSelector(b'v@:@')
-    def send_app_name_to_microcontroller(self, app_name: str) -> str:
-        if app_name in ["Safari", "Google Chrome"]:
-            app_name = app_name + self.get_url(app_name)
-
-        if self.args.verbose:
-            print(f'Active app: {app_name}')
-        try:
-            self.ser.write(("App: " + app_name + '\n').encode('ascii', 'replace'))
-        except (serial.SerialException, UnicodeEncodeError) as e:
-            print(f"Error sending app name to microcontroller: {e}")
-
-
-    # Read data from the serial connection from the keypad
-    def read_serial_data(self) -> Optional[str]:
-        if self.ser.in_waiting == 0:
+    # The app name is sent right away, the URL of a browser follows once it is known
+    @objc.python_method
+    def send_app_name_to_microcontroller(self, app_name: str, pid: Optional[int] = None) -> None:
+        self.app_reporter.activated(app_name, pid)
+
+
+    @objc.python_method
+    def send_app_line(self, app_name: str) -> None:
+        log.debug('watchdog', f'Active app: {app_name}')
+        # remembered to restore the keypad after a reconnect
+        self.app_line = "App: " + app_name
+        self.send_line(self.app_line)
+
+
+    # Send a single message to all keypads, can be called from any thread
+    @objc.python_method
+    def send_line(self, line: str) -> None:
+        if self.recorder:
+            self.recorder.record(SENT, line)
+        for device in self.devices:
+            device.send(line)
+
+
+    # Called by the plugins (from any thread) when the state of a key binding changes
+    @objc.python_method
+    def plugin_state_changed(self, binding: str, state: Any) -> None:
+        with self.state_lock:
+            self.states[binding] = state
+            # only the last state of a binding per interval is sent
+            self.pending_states[binding] = state
+
+
+    # Send the states that have changed since the last call in a single message
+    @objc.python_method
+    def flush_states(self, now: float) -> None:
+        if now - self.last_state_flush < self.args.state_interval:
             return
-        try:
-            return self.ser.readline().decode().strip()
-        except serial.SerialException as e:
-            print(f"Error reading from microcontroller: {e}")
-            return
-
-
-    # Launch an application
+        self.last_state_flush = now
+        # the plugin reloader can change the registry at any time
+        for plugin in list(self.plugins.values()):
+            if isinstance(plugin, IsolatedPlugin):
+                plugin.poll_states()
+        with self.state_lock:
+            states, self.pending_states = self.pending_states, {}
+        if states:
+            self.send_line(self.state_line(states))
+
+
+    @objc.python_method
+    def state_line(self, states: Dict[str, Any]) -> str:
+        return "State: " + json.dumps(states, separators=(',', ':'))
+
+
+    # Lines that restore a keypad after a (re)start
+    @objc.python_method
+    def replay_lines(self) -> List[str]:
+        lines = [self.app_line] if self.app_line else []
+        if self.args.profile_keypad:
+            lines.append("Profile: on")
+            lines.append("Boot: query")
+        with self.state_lock:
+            if self.states:
+                lines.append(self.state_line(self.states))
+        return lines
+
+
+    # Launch an application in the background
     @objc.typedSelector(b'v@:@')
     def launch_app(self, match: re.Match) -> None:
         launch_app_name = match.group(1)
-        if self.args.verbose:
-            print(f"Launching: {launch_app_name}")
-        try:
-            subprocess.run(["open", "-a", launch_app_name], check=True)
-        except subprocess.CalledProcessError as e:
-            pass
+        log.debug('watchdog', f"Launching: {launch_app_name}")
+        self.launcher.launch(launch_app_name)
         return
 
 
-    # Run a plugin command
+    # Run a plugin command, or a list of them (a JSON list) in the background
     @objc.typedSelector(b'v@:@')
     def run_plugin_command(self, match: re.Match) -> None:
-        parts = match.group(1).split(' ', 1)
+        text = match.group(1)
+        if text.startswith('['):
+            try:
+                steps = json.loads(text)
+            except ValueError:
+                log.warning('watchdog', f"Invalid action list: {text}")
+                return
+            self.action_runner.run([str(step) for step in steps])
+            return
+        self.run_command(text)
+
+
+    # Run a single plugin command, returns an error message or None
+    @objc.python_method
+    def run_command(self, text: str) -> Optional[str]:
+        parts = text.split(' ', 1)
         command = parts[0].strip()
         param = parts[1].strip() if len(parts) > 1 else None
         plugin = self.plugins.get(command.split('.')[0])
 
         # Check if the plugin exists
         if not plugin:
-            if self.args.verbose:
-                print(f"Plugin {command.split('.')[0]} not found")
-            return
+            log.debug('watchdog', f"Plugin {command.split('.')[0]} not found")
+            return f"Plugin {command.split('.')[0]} not found"
         # Check if the plugin command exists
         if command not in plugin.commands():
-            print(f"Command {command} not found")
-            return
+            log.warning('watchdog', f"Command {command} not found")
+            return f"Command {command} not found"
         # Check if the command requires a parameter
         command_func = plugin.commands()[command]
         if len(signature(command_func).parameters) > 0 and param is None:
-            print(f"Parameter missing for command: {command}")
-            return
+            log.warning('watchdog', f"Parameter missing for command: {command}")
+            return f"Parameter missing for command: {command}"
         # Parse parameter
         if param is not None:
             if param.startswith("'") and param.endswith("'"):  # String parameter
@@ -214,20 +279,58 @@ class WatchDog(Cocoa.NSObject):
                 try:
                     param = int(param)
                 except ValueError:
-                    print(f"Invalid parameter: {param}")
-                    return
-        if self.args.verbose:
-            print(f"Executing: {command}")  # Echo when a command is detected
-        command_func(param) if param is not None else command_func()
-
-
-    # Check if there's any data in the serial buffer
-    def check_serial(self) -> None:
-        # Check if there's any data in the buffer
-        command = self.read_serial_data()
-        if not command:
-            return
+                    log.warning('watchdog', f"Invalid parameter: {param}")
+                    return f"Invalid parameter: {param}"
+        log.debug('watchdog', f"Executing: {command}")  # Echo when a command is detected
+        try:
+            command_func(param) if param is not None else command_func()
+        except Exception as e:
+            log.error('watchdog', f"Error running {command}: {e}")
+            return str(e)
+        return None
+
 
+    # Wait up to timeout seconds for data from any of the keypads
+    @objc.python_method
+    def check_serial(self, timeout: float = 0) -> None:
+        self.run_queued_calls()
+        self.send_heartbeat(time.monotonic())
+        for key, _ in self.selector.select(timeout):
+            device = key.data
+            for command in device.read_messages():
+                if self.recorder:
+                    self.recorder.record(RECEIVED, command)
+                if command == READY:
+                    # the keypad has restarted without a USB disconnect
+                    device.start(self.replay_lines())
+                else:
+                    self.process_command(command, device)
+        now = time.monotonic()
+        for device in self.devices:
+            if device.failed:
+                self.selector.unregister(device)
+                device.disconnect()
+            elif device.ser is None:
+                if device.try_reconnect(now):
+                    self.selector.register(device, selectors.EVENT_READ, device)
+                    device.start(self.replay_lines())
+            else:
+                # Send unacknowledged frames again
+                device.poll()
+        self.flush_states(now)
+        if self.args.profile_keypad and now - self.last_profile_query >= self.args.profile_keypad:
+            self.last_profile_query = now
+            self.send_line("Profile: query")
+            self.send_line("Gc: query")
+            self.send_line("Hid: query")
+        if self.dump_requested:
+            self.dump_requested = False
+            dump_events(self)
+
+
+    # Process a single message from the keypad
+    @objc.python_method
+    def process_command(self, command: str, device: Optional[KeypadDevice] = None) -> None:
         match = re.match(self.launch_pattern, command)
         if match:
             self.launch_app(match)
@@ -238,92 +341,335 @@ class WatchDog(Cocoa.NSObject):
             self.run_plugin_command(match)
             return
 
+        match = re.match(self.profile_pattern, command)
+        if match:
+            self.log_keypad_profile(match, device)
+            return
+
+        match = re.match(self.gc_pattern, command)
+        if match:
+            self.log_keypad_gc(match, device)
+            return
+
+        match = re.match(self.hid_pattern, command)
+        if match:
+            self.log_keypad_hid(match, device)
+            return
+
+        match = re.match(self.boot_pattern, command)
+        if match:
+            self.log_keypad_boot(match, device)
+            return
 
-# Load all plugins
-def load_plugins(path: str = 'plugins', verbose: bool = False) -> Dict[str, BasePlugin]:
-    plugins = {}
-    base_path = os.path.dirname(os.path.abspath(__file__))
-    full_path = os.path.join(base_path, path)
+        match = re.match(self.pong_pattern, command)
+        if match:
+            if device:
+                device.monitor.pong(int(match.group(1)), int(match.group(2)), time.monotonic())
+            return
+
+        match = re.match(self.link_pattern, command)
+        if match:
+            self.log_keypad_link(match, device)
+            return
 
-    plugin_files = [f for f in os.scandir(full_path) if f.is_file() and f.name.endswith('.py') and f.name != 'base_plugin.py']
-    for plugin_file in plugin_files:
-        plugin_name, plugin_module = load_plugin_module(plugin_file, full_path)
-        if plugin_module is None:
-            continue
 
+    # Log the latencies measured by a keypad (--profile-keypad)
+    @objc.python_method
+    def log_keypad_profile(self, match: re.Match, device: Optional[KeypadDevice]) -> None:
         try:
-            plugin_class = getattr(plugin_module, f'{plugin_name.capitalize()}Plugin')
-            plugins[plugin_name] = plugin_class(os.path.join(full_path, 'config', f'{plugin_name}.json'), verbose)
-            print(f"Loaded plugin: {plugin_name}")
-        except Exception as e:
-            print(f"Error initializing plugin {plugin_name}: {e}")
-    print()
-    return plugins
+            profile = json.loads(match.group(1))
+        except ValueError:
+            return
+        port = device.port if device else None
+        with self.profile_condition:
+            self.keypad_profiles[port] = profile
+            self.profile_condition.notify_all()
+        stages = ', '.join(
+            f"{stage} n={values['n']} min/avg/p95/max={values['min']}/{values['avg']}/{values['p95']}/{values['max']} µs"
+            if values.get('n') else f"{stage} n=0"
+            for stage, values in profile.items())
+        log.info('keypad', f"Latency on {port}: {stages}", port=port, profile=profile)
+
+
+    # Log the garbage collection pauses of a keypad (--profile-keypad)
+    @objc.python_method
+    def log_keypad_gc(self, match: re.Match, device: Optional[KeypadDevice]) -> None:
+        try:
+            stats = json.loads(match.group(1))
+        except ValueError:
+            return
+        port = device.port if device else None
+        log.info('keypad', f"GC on {port}: {stats.get('collections')} collections, "
+                           f"avg {stats.get('avg_us')} µs, max {stats.get('max_us')} µs, {stats.get('mem_free')} bytes free",
+                 port=port, gc=stats)
 
 
-# Load a plugin module
-def load_plugin_module(plugin_file: str, full_path: str) -> Tuple[str, Any]:
-    plugin_name = os.path.splitext(plugin_file.name)[0]
-    abs_path = os.path.join(full_path, plugin_file.name)
-    try:
-        spec = importlib.util.spec_from_file_location(plugin_name, abs_path)
-        plugin_module = importlib.util.module_from_spec(spec)
-        spec.loader.exec_module(plugin_module)
-    except Exception as e:
-        print(f"Error loading plugin module {plugin_name}: {e}")
-        return None, None
+    # Log the HID report rate of the key sequences of a keypad (--profile-keypad)
+    @objc.python_method
+    def log_keypad_hid(self, match: re.Match, device: Optional[KeypadDevice]) -> None:
+        try:
+            stats = json.loads(match.group(1))
+        except ValueError:
+            return
+        port = device.port if device else None
+        log.info('keypad', f"HID on {port}: {stats.get('reports')} reports in {stats.get('macros')} key sequences, "
+                           f"{stats.get('rate')}/{stats.get('target_rate') or 'max'} reports/s, "
+                           f"send avg {stats.get('avg_send_us')} µs, max {stats.get('max_send_us')} µs",
+                 port=port, hid=stats)
+
+
+    # Log how long the keypad took to start (--profile-keypad)
+    @objc.python_method
+    def log_keypad_boot(self, match: re.Match, device: Optional[KeypadDevice]) -> None:
+        try:
+            stages = json.loads(match.group(1))
+        except ValueError:
+            return
+        port = device.port if device else None
+        log.info('keypad', f"Boot of {port}: " + ', '.join(f"{stage} {us / 1000:.1f} ms" for stage, us in stages),
+                 port=port, boot=stages)
+
+
+    # Log the view of the keypad on the link (kill -USR1)
+    @objc.python_method
+    def log_keypad_link(self, match: re.Match, device: Optional[KeypadDevice]) -> None:
+        try:
+            stats = json.loads(match.group(1))
+        except ValueError:
+            return
+        port = device.port if device else None
+        log.info('link', f"Keypad on {port}: {stats.get('pings')} pings, last {stats.get('last_ping_ms')} ms ago, "
+                         f"host lost {stats.get('host_lost')} times" + (", offline" if not stats.get('online', True) else ""),
+                 port=port, link=stats)
 
-    return plugin_name, plugin_module
+
+    # Run func on the run loop thread, returns an event that is set once it has run
+    @objc.python_method
+    def call_on_run_loop(self, func: Callable[[], None]) -> threading.Event:
+        done = threading.Event()
+        self.run_loop_calls.put((func, done))
+        return done
+
+
+    # Run the functions queued by other threads, called by check_serial
+    @objc.python_method
+    def run_queued_calls(self) -> None:
+        while True:
+            try:
+                func, done = self.run_loop_calls.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                func()
+            except Exception as e:
+                log.error('watchdog', f"Error running a queued call: {e}")
+            finally:
+                done.set()
+
+
+    # Wait on another thread until the run loop has run the queued call or the watchdog stops
+    @objc.python_method
+    def wait_for_run_loop(self, done: threading.Event) -> None:
+        while self.running and not done.wait(0.1):
+            pass
+
+
+    # Feed an event of a recording (--replay) into the watchdog, called on the replay thread
+    # the event is handled on the run loop like a live one, the replay waits until it has been handled
+    @objc.python_method
+    def replay_event(self, kind: str, text: str) -> None:
+        self.wait_for_run_loop(self.call_on_run_loop(lambda: self.handle_replayed_event(kind, text)))
+
+
+    # Handle an event of a recording, on the run loop
+    @objc.python_method
+    def handle_replayed_event(self, kind: str, text: str) -> None:
+        if kind == ACTIVATED:
+            # the process of the recording is gone, so the URL is looked up without its window
+            self.send_app_name_to_microcontroller(text)
+        elif kind == TERMINATED:
+            self.app_terminated(text)
+        elif kind == RECEIVED:
+            self.process_command(text)
+
+
+    # Ask the keypads for their latencies and wait up to timeout seconds for all connected ones to answer
+    @objc.python_method
+    def query_profiles(self, timeout: float) -> Dict[Optional[str], Any]:
+        ports = {device.port for device in self.devices if device.connected}
+        with self.profile_condition:
+            self.keypad_profiles.clear()
+        self.call_on_run_loop(lambda: self.send_line("Profile: query"))
+        with self.profile_condition:
+            if not self.profile_condition.wait_for(lambda: ports <= self.keypad_profiles.keys(), timeout):
+                log.warning('recorder', "Not all keypads have reported their latencies",
+                            missing=sorted(ports - self.keypad_profiles.keys()))
+            return dict(self.keypad_profiles)
+
+
+    # Called on the replay thread when the recording has been replayed, stops the watchdog
+    @objc.python_method
+    def replay_finished(self, report: Dict[str, Any]) -> None:
+        if self.args.profile_keypad:
+            # include the latencies of the keypads during the replay
+            report['keypads'] = self.query_profiles(PROFILE_REPLY_TIMEOUT)
+        log.info('recorder', f"Replayed {report['events']} events in {report['duration_s']:.1f}s, "
+                             f"{report['events_per_s']} events/s", report=report)
+        if self.args.replay_report:
+            try:
+                with open(self.args.replay_report, 'w') as f:
+                    json.dump(report, f, indent=2)
+            except OSError as e:
+                log.error('recorder', f"Error writing the replay report: {e}")
+        print_report(report)
+        self.running = False
+
+
+# Print the recent events, the launch times and the link stats (kill -USR1), called from check_serial
+def dump_events(watchdog: WatchDog) -> None:
+    for device in watchdog.devices:
+        stats = device.monitor.stats()
+        log.info('link', f"Link to {device.port}: {stats['pings']} pings, {stats['missed']} missed, "
+                         f"RTT avg {stats.get('rtt_avg_ms', '-')} ms, p95 {stats.get('rtt_p95_ms', '-')} ms, "
+                         f"jitter {stats.get('jitter_ms', '-')} ms, interval {stats['interval_s']:g}s",
+                 port=device.port, link=stats)
+    # the keypads answer with their own stats
+    watchdog.send_line("Link: query")
+    for (action, app_name), timing in watchdog.launcher.stats().items():
+        log.info('launcher', f"{app_name}: {action.lower()} {timing['count']} times, avg {timing['avg_ms']:.0f} ms, "
+                             f"max {timing['max_ms']:.0f} ms, last {timing['last_ms']:.0f} ms", app=app_name, action=action)
+    log.dump(watchdog.args.log_size)
 
 
 # Main function
 def main() -> None:
     parser = argparse.ArgumentParser(
         description='Monitor active app and send data to microcontroller')
-    parser.add_argument('--port', required=True,
-                        help='Serial port for the microcontroller')
+    parser.add_argument('--port', required=True, action='append',
+                        help='Serial port for a keypad, can be given for each keypad, '
+                             'add :CW or :CCW to rotate only this keypad')
     parser.add_argument('--speed', type=int, default=9600,
                         help='Baud rate for the serial connection (default: 9600)')
     parser.add_argument('--verbose', action='store_true', default=False,
                         help='Print the name of the current active window (default: False)')
     parser.add_argument('--rotate', choices=['CW', 'CCW'],
-                        help='Rotation direction for the keypad (default: CW)')
+                        help='Rotation direction for all keypads (default: CW)')
+    parser.add_argument('--protocol', choices=['text', 'framed'], default='text',
+                        help='Serial protocol, framed adds checksums and acknowledgements (default: text)')
+    parser.add_argument('--heartbeat-interval', type=float, default=HEARTBEAT_INTERVAL,
+                        help=f'Seconds between two pings to the keypads (default: {HEARTBEAT_INTERVAL})')
+    parser.add_argument('--heartbeat-max-interval', type=float, default=HEARTBEAT_MAX_INTERVAL,
+                        help=f'Longest interval between two pings while nothing else is sent (default: {HEARTBEAT_MAX_INTERVAL})')
+    parser.add_argument('--isolate-plugins', action='store_true', default=False,
+                        help='Run each plugin in its own process (default: False)')
+    parser.add_argument('--plugin-timeout', type=float, default=PLUGIN_TIMEOUT,
+                        help=f'Seconds an isolated plugin command may take (default: {PLUGIN_TIMEOUT})')
+    parser.add_argument('--plugin-memory', type=int, default=PLUGIN_MEMORY_LIMIT,
+                        help=f'Memory limit of an isolated plugin in MB (default: {PLUGIN_MEMORY_LIMIT})')
+    parser.add_argument('--reload-plugins', action='store_true', default=False,
+                        help='Reload a plugin when its module changes (default: False)')
+    parser.add_argument('--prewarm', action='append', default=[], metavar='APP',
+                        help='Start this app hidden and keep it running, can be given for each app (default: none)')
+    parser.add_argument('--profile-keypad', type=float, default=0, metavar='SECONDS',
+                        help='Measure the latencies on the keypads and log them every SECONDS (default: off)')
+    parser.add_argument('--log-level', choices=list(LEVELS), default='DEBUG',
+                        help='Lowest level of the events kept in the event log (default: DEBUG)')
+    parser.add_argument('--log-file',
+                        help='Append the events as JSON lines to this file (default: none)')
+    parser.add_argument('--log-size', type=int, default=EVENT_LOG_SIZE,
+                        help=f'Number of recent events kept in memory, kill -USR1 prints them (default: {EVENT_LOG_SIZE})')
+    parser.add_argument('--url-cache-ttl', type=float, default=URL_CACHE_TTL,
+                        help=f'Seconds a browser URL is cached per window (default: {URL_CACHE_TTL})')
+    parser.add_argument('--record', metavar='FILE',
+                        help='Record the app activations and the serial traffic to FILE (default: off)')
+    parser.add_argument('--replay', metavar='FILE',
+                        help='Replay the app activations and keypad messages of a recording, then exit (default: off)')
+    parser.add_argument('--replay-speed', type=float, default=1.0,
+                        help='Speed of the replay, 0 replays as fast as possible (default: 1.0)')
+    parser.add_argument('--replay-report', metavar='FILE',
+                        help='Write the latencies of the replay as JSON to FILE (default: none)')
+    parser.add_argument('--state-interval', type=float, default=STATE_INTERVAL,
+                        help=f'Seconds between two plugin state updates to the keypads (default: {STATE_INTERVAL})')
     args = parser.parse_args()
+    # verbose only changes what is printed, the events are recorded anyway
+    log.configure(level=LEVELS[args.log_level], echo_level=DEBUG if args.verbose else INFO,
+                  path=args.log_file, capacity=args.log_size)
+    recording = None
+    if args.replay:
+        try:
+            recording = load_recording(args.replay)
+        except (OSError, ValueError) as e:
+            print(f"Error: Unable to read the recording {args.replay}: {e}")
+            return
 
-    try:
-        with create_serial_connection(args.port, args.speed) as ser:
-            print('\nKeypad watchdog {VERSION} is running...'.format(VERSION=VERSION))
-
-            plugins = load_plugins(verbose=args.verbose)
-            watchdog = WatchDog.alloc().initWithSerial_args_plugins_(ser, args, plugins)
-            notification_center = Cocoa.NSWorkspace.sharedWorkspace().notificationCenter()
-            notification_center.addObserver_selector_name_object_(
-                watchdog,
-                objc.selector(watchdog.applicationActivated_,
-                              signature=b'v@:@'),
-                Cocoa.NSWorkspaceDidActivateApplicationNotification,
-                None,
-            )
-            running = [True]
-            heartbeat_thread = threading.Thread(target=watchdog.send_heartbeat)
-            heartbeat_thread.start()
-
-            if args.rotate :
-                ser.write(f'Rotate: {args.rotate}\n'.encode('ascii', 'replace'))
+    devices = []
+    for value in args.port:
+        port, rotate = parse_port(value, args.rotate)
+        device = KeypadDevice(port, args.speed, rotate, args.protocol,
+                              args.heartbeat_interval, args.heartbeat_max_interval)
+        if not device.connect():
+            # keep it, it is opened once it is plugged in
+            print(f"Error: No serial connection on {port}.")
+        devices.append(device)
+    if not any(device.connected for device in devices):
+        print("Error: No serial connection.")
+        return
 
-            try:
-                run_loop(watchdog)
-            except KeyboardInterrupt:
-                pass  # User pressed CTRL-C to exit
-            except Exception as e:
-                print(f"An error occurred during the execution: {e}")
-            finally:
-                notification_center.removeObserver_(watchdog)
-                watchdog.running = False
-                heartbeat_thread.join() 
+    print('\nKeypad watchdog {VERSION} is running...'.format(VERSION=VERSION))
+
+    plugins = load_plugins(verbose=args.verbose, isolate=args.isolate_plugins,
+                           timeout=args.plugin_timeout, memory_limit=args.plugin_memory)
+    watchdog = WatchDog.alloc().initWithDevices_args_plugins_urlProvider_(
+        devices, args, plugins, AppleScriptUrlProvider(args.url_cache_ttl))
+    # the handler only sets a flag, a send from it could interrupt a send of the run loop
+    signal.signal(signal.SIGUSR1, lambda signum, frame: setattr(watchdog, 'dump_requested', True))
+    notification_center = Cocoa.NSWorkspace.sharedWorkspace().notificationCenter()
+    notification_center.addObserver_selector_name_object_(
+        watchdog,
+        objc.selector(watchdog.applicationActivated_,
+                      signature=b'v@:@'),
+        Cocoa.NSWorkspaceDidActivateApplicationNotification,
+        None,
+    )
+    reloader = None
+    if args.reload_plugins:
+        reloader = PluginReloader(plugins, verbose=args.verbose, isolate=args.isolate_plugins,
+                                  timeout=args.plugin_timeout, memory_limit=args.plugin_memory,
+                                  on_loaded=lambda plugin: plugin.set_state_listener(watchdog.plugin_state_changed))
+        reloader.start()
+
+    for device in devices:
+        if device.connected:
+            device.start(watchdog.replay_lines())
+    watchdog.launcher.prewarm()
+    replayer = None
+    if recording is not None:
+        replayer = TrafficReplayer(recording, watchdog.replay_event, args.replay_speed, on_done=watchdog.replay_finished)
+        replayer.start()
 
-    except TypeError:
-        print("Error: No serial connection.")
+    try:
+        run_loop(watchdog)
+    except KeyboardInterrupt:
+        pass  # User pressed CTRL-C to exit
+    except Exception as e:
+        log.error('watchdog', f"An error occurred during the execution: {e}")
+    finally:
+        notification_center.removeObserver_(watchdog)
+        watchdog.running = False
+        if replayer is not None:
+            replayer.stop()
+        if watchdog.recorder:
+            watchdog.recorder.close()
+        if reloader is not None:
+            reloader.stop()
+        watchdog.url_provider.stop()
+        watchdog.launcher.stop()
+        watchdog.action_runner.stop()
+        for plugin in plugins.values():
+            plugin.unload()
+        log.flush()
+        for device in devices:
+            device.close()
 
 
 # Entry point for the script
@@ -1,26 +1,666 @@
 # DIY Streamdeck code for a Pi Pico - CircuitPython
 # L. Hennigs and ChatGPT 4.0
-# last changed: 01-31-24
+# last changed: 10-19-26
 # https://github.com/LennartHennigs/DIYStreamDeck
 
 import time
+# the boot profile, a list of (stage, end of the stage in ns)
+BOOT_MARKS = [("start", time.monotonic_ns())]
+
+import gc
 import json
+import array
+import binascii
 import usb_hid
 import usb_cdc
 from rgbkeypad import RgbKeypad
+from adafruit_hid import find_device
 from adafruit_hid.keyboard import Keyboard
-from adafruit_hid.keyboard_layout_us import KeyboardLayoutUS
-from adafruit_hid.keycode import Keycode
-import board
+BOOT_MARKS.append(("imports", time.monotonic_ns()))
+
+
+# mark the end of a boot stage
+def boot_mark(stage):
+    BOOT_MARKS.append((stage, time.monotonic_ns()))
+
+
+# the keycodes of adafruit_hid.keycode.Keycode, precomputed instead of reflecting over the class at boot
+# https://docs.circuitpython.org/projects/hid/en/latest/_modules/adafruit_hid/keycode.html
+KEYCODES = {
+    "A": 0x04, "B": 0x05, "C": 0x06, "D": 0x07, "E": 0x08, "F": 0x09,
+    "G": 0x0A, "H": 0x0B, "I": 0x0C, "J": 0x0D, "K": 0x0E, "L": 0x0F,
+    "M": 0x10, "N": 0x11, "O": 0x12, "P": 0x13, "Q": 0x14, "R": 0x15,
+    "S": 0x16, "T": 0x17, "U": 0x18, "V": 0x19, "W": 0x1A, "X": 0x1B,
+    "Y": 0x1C, "Z": 0x1D, "ONE": 0x1E, "TWO": 0x1F, "THREE": 0x20, "FOUR": 0x21,
+    "FIVE": 0x22, "SIX": 0x23, "SEVEN": 0x24, "EIGHT": 0x25, "NINE": 0x26, "ZERO": 0x27,
+    "ENTER": 0x28, "RETURN": 0x28, "ESCAPE": 0x29, "BACKSPACE": 0x2A, "TAB": 0x2B, "SPACEBAR": 0x2C,
+    "SPACE": 0x2C, "MINUS": 0x2D, "EQUALS": 0x2E, "LEFT_BRACKET": 0x2F, "RIGHT_BRACKET": 0x30, "BACKSLASH": 0x31,
+    "POUND": 0x32, "SEMICOLON": 0x33, "QUOTE": 0x34, "GRAVE_ACCENT": 0x35, "COMMA": 0x36, "PERIOD": 0x37,
+    "FORWARD_SLASH": 0x38, "CAPS_LOCK": 0x39, "F1": 0x3A, "F2": 0x3B, "F3": 0x3C, "F4": 0x3D,
+    "F5": 0x3E, "F6": 0x3F, "F7": 0x40, "F8": 0x41, "F9": 0x42, "F10": 0x43,
+    "F11": 0x44, "F12": 0x45, "PRINT_SCREEN": 0x46, "SCROLL_LOCK": 0x47, "PAUSE": 0x48, "INSERT": 0x49,
+    "HOME": 0x4A, "PAGE_UP": 0x4B, "DELETE": 0x4C, "END": 0x4D, "PAGE_DOWN": 0x4E, "RIGHT_ARROW": 0x4F,
+    "LEFT_ARROW": 0x50, "DOWN_ARROW": 0x51, "UP_ARROW": 0x52, "KEYPAD_NUMLOCK": 0x53, "KEYPAD_FORWARD_SLASH": 0x54, "KEYPAD_ASTERISK": 0x55,
+    "KEYPAD_MINUS": 0x56, "KEYPAD_PLUS": 0x57, "KEYPAD_ENTER": 0x58, "KEYPAD_ONE": 0x59, "KEYPAD_TWO": 0x5A, "KEYPAD_THREE": 0x5B,
+    "KEYPAD_FOUR": 0x5C, "KEYPAD_FIVE": 0x5D, "KEYPAD_SIX": 0x5E, "KEYPAD_SEVEN": 0x5F, "KEYPAD_EIGHT": 0x60, "KEYPAD_NINE": 0x61,
+    "KEYPAD_ZERO": 0x62, "KEYPAD_PERIOD": 0x63, "KEYPAD_BACKSLASH": 0x64, "APPLICATION": 0x65, "POWER": 0x66, "KEYPAD_EQUALS": 0x67,
+    "F13": 0x68, "F14": 0x69, "F15": 0x6A, "F16": 0x6B, "F17": 0x6C, "F18": 0x6D,
+    "F19": 0x6E, "F20": 0x6F, "F21": 0x70, "F22": 0x71, "F23": 0x72, "F24": 0x73,
+    "LEFT_CONTROL": 0xE0, "CONTROL": 0xE0, "LEFT_SHIFT": 0xE1, "SHIFT": 0xE1, "LEFT_ALT": 0xE2, "ALT": 0xE2,
+    "OPTION": 0xE2, "LEFT_GUI": 0xE3, "GUI": 0xE3, "WINDOWS": 0xE3, "COMMAND": 0xE3, "RIGHT_CONTROL": 0xE4,
+    "RIGHT_SHIFT": 0xE5, "RIGHT_ALT": 0xE6, "RIGHT_GUI": 0xE7
+}
+
+# typed text in the US layout, the character at index i has the keycode 0x04 + i,
+# without shift in TEXT_KEYS and with shift in TEXT_SHIFT_KEYS ("\0": no character)
+TEXT_KEYS = "abcdefghijklmnopqrstuvwxyz1234567890\n\x1b\b\t -=[]\\\0;'`,./"
+TEXT_SHIFT_KEYS = "ABCDEFGHIJKLMNOPQRSTUVWXYZ!@#$%^&*()\0\0\0\0\0_+{}|\0:\"~<>?"
+boot_mark("keycodes")
+
+
+# matches browser URLs against the keys of the "urls" section
+# a key is a host ("github.com"), a subdomain wildcard ("*.github.com") or a
+# domain suffix (".github.com" = github.com and all its subdomains), optionally
+# followed by a path prefix ("github.com/LennartHennigs")
+# the hosts are stored in a trie of reversed labels, so a lookup only
+# walks the labels of the URL, no matter how many URL layouts exist
+# precedence: the most specific host wins (exact > wildcard > suffix for the
+# same domain, more labels before fewer), then the longest path prefix
+class UrlMatcher:
+    EXACT = 0
+    WILDCARD = 1
+    SUFFIX = 2
+
+    def __init__(self, url_configs):
+        # a node is [children, [exact, wildcard, suffix]] with lists of (path, config)
+        self.root = [{}, None]
+        for pattern, config in url_configs.items():
+            self.add(pattern, config)
+
+
+    # add a URL pattern to the trie
+    def add(self, pattern, config):
+        host, path = self.split_url(pattern)
+        kind = self.EXACT
+        if host.startswith("*."):
+            kind = self.WILDCARD
+            host = host[2:]
+        elif host.startswith("."):
+            kind = self.SUFFIX
+            host = host[1:]
+        node = self.root
+        for label in reversed(host.split(".")):
+            if label not in node[0]:
+                node[0][label] = [{}, None]
+            node = node[0][label]
+        if node[1] is None:
+            node[1] = ([], [], [])
+        entries = node[1][kind]
+        entries.append((path, config))
+        # keep the longest path prefix first
+        entries.sort(key=lambda entry: -len(entry[0]))
+
+
+    # return the config for the URL or None
+    def match(self, url):
+        if not url:
+            return None
+        host, path = self.split_url(url)
+        labels = host.split(".")
+        # walk down the trie and remember the visited nodes
+        visited = []
+        node = self.root
+        for i in range(len(labels) - 1, -1, -1):
+            node = node[0].get(labels[i])
+            if node is None:
+                break
+            if node[1] is not None:
+                visited.append((node[1], i))
+        # the deepest node with a matching entry wins
+        for entries, remaining in reversed(visited):
+            kinds = (self.EXACT, self.SUFFIX) if remaining == 0 else (self.WILDCARD, self.SUFFIX)
+            for kind in kinds:
+                config = self.match_path(entries[kind], path)
+                if config is not None:
+                    return config
+        return None
+
+
+    # return the config of the longest matching path prefix
+    def match_path(self, entries, path):
+        for prefix, config in entries:
+            if not prefix or path == prefix or path.startswith(prefix + "/"):
+                return config
+        return None
+
+
+    # split a URL or pattern into lower case host and path without trailing slash
+    def split_url(self, url):
+        host, slash, path = url.partition("/")
+        return host.lower(), (slash + path).rstrip("/")
+
+
+# framed serial protocol, see src/mac/framing.py for the other side
+#   ~ <type> <seq: 2 hex> <length: 4 hex> <payload> <crc32: 8 hex> \n
+# the Pico accepts frames and text lines and answers with frames once the
+# watchdog has sent "Proto: framed", "Proto: text" switches back
+# once framed, text lines are dropped like damaged frames
+class FramedLink:
+    PROTO_FRAMED = "Proto: framed"
+    PROTO_TEXT = "Proto: text"
+    DATA = "D"
+    SYNC = "S"
+    ACK = "A"
+    NAK = "N"
+    RESYNC = "R"
+    HEADER_LENGTH = 8
+    CRC_LENGTH = 8
+    MAX_PAYLOAD = 1024
+    MAX_FRAME_LENGTH = 1041
+    WINDOW = 16
+    RETRANSMIT_TIMEOUT = 500_000_000
+    MAX_RETRIES = 5
+
+    def __init__(self, write):
+        self.write = write
+        self.framed = False
+        self.buffer = b""
+        self.next_seq = time.monotonic_ns() % 256
+        self.waiting = []
+        self.stats = {'sent': 0, 'received': 0, 'retransmits': 0, 'crc_errors': 0, 'dropped': 0, 'discarded': 0}
+        self.reset_sequences()
+
+
+    # forget everything about the current sequences
+    def reset_sequences(self):
+        self.synced = False
+        # seq -> [frame, sent at, retries, payload]
+        self.unacked = {}
+        self.reset_receiver()
+
+
+    # expect a new sequence from the watchdog
+    def reset_receiver(self):
+        self.expected = None
+        self.sync_seq = None
+        self.out_of_order = {}
+
+
+    # build a single frame
+    def encode_frame(self, frame_type, seq, payload=b""):
+        header = f"{frame_type}{seq:02X}{len(payload):04X}".encode("ascii")
+        crc = binascii.crc32(header + payload)
+        return b"~" + header + payload + f"{crc:08X}\n".encode("ascii")
+
+
+    # send a message as text line or frame
+    def send(self, message):
+        if not self.framed:
+            self.write((message + "\n").encode("utf-8"))
+            self.stats['sent'] += 1
+            return
+        self.waiting.append(message.encode("utf-8"))
+        self.fill_window()
+
+
+    # feed the received bytes, returns the received messages in order
+    def receive(self, data):
+        messages = []
+        self.buffer += data
+        while self.buffer:
+            if self.buffer[0] == 0x7E:
+                if not self.read_frame(messages):
+                    break
+            else:
+                newline = self.buffer.find(b"\n")
+                if newline < 0:
+                    if self.framed and len(self.buffer) > self.MAX_FRAME_LENGTH:
+                        self.drop_corrupt(len(self.buffer))
+                    break
+                line = self.buffer[:newline]
+                try:
+                    line = line.decode("utf-8").strip()
+                except UnicodeError:
+                    line = None
+                if self.framed and line not in (self.PROTO_FRAMED, self.PROTO_TEXT):
+                    # the rest of a frame with a damaged start
+                    self.drop_corrupt(newline + 1)
+                    continue
+                self.buffer = self.buffer[newline + 1:]
+                if line:
+                    self.received_text(line, messages)
+        return messages
+
+
+    # send unacknowledged frames again after a timeout
+    def poll(self):
+        if not self.unacked:
+            return
+        now = time.monotonic_ns()
+        for seq in list(self.unacked):
+            entry = self.unacked[seq]
+            if now - entry[1] < self.RETRANSMIT_TIMEOUT:
+                continue
+            if entry[2] >= self.MAX_RETRIES:
+                del self.unacked[seq]
+                self.stats['dropped'] += 1
+                self.resync()
+                continue
+            self.retransmit(seq)
+        self.fill_window()
+
+
+    # the oldest unacknowledged frame
+    def oldest_unacked(self):
+        oldest = None
+        span = -1
+        for seq in self.unacked:
+            distance = (self.next_seq - seq) % 256
+            if distance > span:
+                oldest = seq
+                span = distance
+        return oldest, span
+
+
+    # send frames as long as the receiver window allows it
+    def fill_window(self):
+        while self.waiting and self.oldest_unacked()[1] < self.WINDOW:
+            payload = self.waiting.pop(0)
+            seq = self.next_seq
+            self.next_seq = (seq + 1) % 256
+            frame = self.encode_frame(self.DATA if self.synced else self.SYNC, seq, payload)
+            self.synced = True
+            self.unacked[seq] = [frame, time.monotonic_ns(), 0, payload]
+            self.write(frame)
+            self.stats['sent'] += 1
+
+
+    # send a frame again
+    def retransmit(self, seq):
+        entry = self.unacked[seq]
+        entry[1] = time.monotonic_ns()
+        entry[2] += 1
+        self.write(entry[0])
+        self.stats['retransmits'] += 1
+
+
+    # send the oldest unacknowledged frame again as the start of a new sequence
+    def resync(self):
+        oldest = self.oldest_unacked()[0]
+        if oldest is None:
+            self.synced = False
+            return
+        self.unacked[oldest][0] = self.encode_frame(self.SYNC, oldest, self.unacked[oldest][3])
+        self.retransmit(oldest)
+
+
+    # parse the frame at the start of the buffer, returns False if it is incomplete
+    def read_frame(self, messages):
+        # a payload never contains a line break, a frame ends at the first one
+        newline = self.buffer.find(b"\n", 1)
+        if len(self.buffer) < self.HEADER_LENGTH:
+            return self.skip_corrupt_frame(newline) if newline >= 0 else False
+        header = self.buffer[1:self.HEADER_LENGTH]
+        try:
+            seq = int(header[1:3].decode(), 16)
+            length = int(header[3:7].decode(), 16)
+        except (ValueError, UnicodeError):
+            length = self.MAX_PAYLOAD + 1
+        end = self.HEADER_LENGTH + length + self.CRC_LENGTH
+        if length > self.MAX_PAYLOAD or 0 <= newline < end:
+            return self.skip_corrupt_frame(newline)
+        if len(self.buffer) <= end:
+            return False
+        payload = self.buffer[self.HEADER_LENGTH:self.HEADER_LENGTH + length]
+        crc = self.buffer[self.HEADER_LENGTH + length:end]
+        if self.buffer[end] != 0x0A or crc != f"{binascii.crc32(header + payload):08X}".encode("ascii"):
+            return self.skip_corrupt_frame(newline)
+        self.buffer = self.buffer[end + 1:]
+        self.received_frame(chr(header[0]), seq, payload, messages)
+        return True
+
+
+    # drop a damaged frame up to its line break, returns False to wait for the rest of it
+    def skip_corrupt_frame(self, newline):
+        if newline < 0:
+            if len(self.buffer) <= self.MAX_FRAME_LENGTH:
+                return False
+            newline = len(self.buffer) - 1
+        self.drop_corrupt(newline + 1)
+        return True
+
+
+    # drop the start of the buffer and ask for the expected frame again
+    def drop_corrupt(self, length):
+        self.stats['crc_errors'] += 1
+        self.buffer = self.buffer[length:]
+        if self.expected is not None:
+            self.write(self.encode_frame(self.NAK, self.expected))
+
+
+    # process a valid frame
+    def received_frame(self, frame_type, seq, payload, messages):
+        if frame_type == self.ACK:
+            self.unacked.pop(seq, None)
+            self.fill_window()
+            return
+        if frame_type == self.NAK:
+            if seq in self.unacked:
+                self.retransmit(seq)
+            return
+        if frame_type == self.RESYNC:
+            self.resync()
+            return
+        if frame_type not in (self.DATA, self.SYNC):
+            return
+        if frame_type == self.DATA and self.expected is None:
+            self.write(self.encode_frame(self.RESYNC, seq))
+            return
+        self.write(self.encode_frame(self.ACK, seq))
+        if frame_type == self.SYNC:
+            self.received_sync(seq, messages)
+        distance = (seq - self.expected) % 256
+        if distance >= self.WINDOW:
+            # already delivered
+            return
+        if distance > 0:
+            self.out_of_order[seq] = payload
+            for missing in range(distance):
+                missing_seq = (self.expected + missing) % 256
+                if missing_seq not in self.out_of_order:
+                    self.write(self.encode_frame(self.NAK, missing_seq))
+            return
+        self.received_payload(payload, messages)
+        self.expected = (self.expected + 1) % 256
+        while self.expected in self.out_of_order:
+            self.received_payload(self.out_of_order.pop(self.expected), messages)
+            self.expected = (self.expected + 1) % 256
+
+
+    # the sender has started a new sequence
+    def received_sync(self, seq, messages):
+        if self.expected is None:
+            self.expected = seq
+        elif seq == self.sync_seq or 0 < (self.expected - seq) % 256 <= self.WINDOW:
+            # a retransmission of a frame that has already been delivered
+            return
+        else:
+            # deliver what has been received before the new start, keep the rest
+            distance = (seq - self.expected) % 256
+            for old_seq in sorted(self.out_of_order, key=lambda s: (s - self.expected) % 256):
+                if (old_seq - self.expected) % 256 < distance:
+                    self.received_payload(self.out_of_order.pop(old_seq), messages)
+            self.expected = seq
+        self.sync_seq = seq
+
+
+    # decode the payload of a data frame
+    def received_payload(self, payload, messages):
+        try:
+            self.received_text(payload.decode("utf-8"), messages)
+        except UnicodeError:
+            pass
+
+
+    # process a received text line or frame payload
+    def received_text(self, message, messages):
+        self.stats['received'] += 1
+        if message == self.PROTO_FRAMED:
+            # the watchdog has (re)started, answer and expect a new sequence
+            # unacknowledged frames are sent again as a new sequence once the watchdog asks for it
+            self.reset_receiver()
+            if not self.unacked:
+                self.synced = False
+            self.write((self.PROTO_FRAMED + "\n").encode("ascii"))
+            self.framed = True
+            return
+        if message == self.PROTO_TEXT:
+            # the watchdog has restarted with text lines, it won't acknowledge any frames
+            self.stats['discarded'] += len(self.unacked) + len(self.waiting)
+            self.framed = False
+            self.waiting = []
+            self.reset_sequences()
+            return
+        messages.append(message)
+
+
+# measures the latency of the hot paths in preallocated ring buffers (in µs)
+# - scan_to_hid: keypad scan until the first HID report of a key sequence
+# - app_to_keys: App: line received until the new layout is shown
+# - update_keys: setting the LEDs and handlers of a layout
+# callers check "enabled" first, so a disabled profiler costs one attribute lookup
+class LatencyProfiler:
+    STAGES = ("scan_to_hid", "app_to_keys", "update_keys")
+    SCAN_TO_HID = 0
+    APP_TO_KEYS = 1
+    UPDATE_KEYS = 2
+    SIZE = 64
+
+    def __init__(self):
+        self.enabled = False
+        self.samples = [array.array("L", [0] * self.SIZE) for _ in self.STAGES]
+        self.counts = [0] * len(self.STAGES)
+
+
+    # store the time since started_ns (until ended_ns or now) for a stage
+    def record(self, stage, started_ns, ended_ns=0):
+        count = self.counts[stage]
+        self.samples[stage][count % self.SIZE] = ((ended_ns or time.monotonic_ns()) - started_ns) // 1000
+        self.counts[stage] = count + 1
+
+
+    def reset(self):
+        for stage in range(len(self.counts)):
+            self.counts[stage] = 0
+
+
+    # min, avg, max and p95 of the last SIZE samples of each stage
+    def report(self):
+        report = {}
+        for stage, name in enumerate(self.STAGES):
+            count = min(self.counts[stage], self.SIZE)
+            if count == 0:
+                report[name] = {"n": 0}
+                continue
+            values = sorted(self.samples[stage][:count])
+            report[name] = {
+                "n": self.counts[stage],
+                "min": values[0],
+                "avg": sum(values) // count,
+                "max": values[-1],
+                "p95": values[min(count - 1, count * 95 // 100)]
+            }
+        return report
+
+
+# runs the garbage collector when it doesn't delay a key press
+# the automatic collection is turned off while a key is held (key sequences are
+# sent while their key is held), idle ticks collect once less than "threshold"
+# bytes are free, so the automatic collection rarely has to run at all
+class GcScheduler:
+    THRESHOLD = 32768
+
+    def __init__(self, threshold=THRESHOLD):
+        self.threshold = threshold
+        self.held = set()
+        # a collection that has been asked for while a key was held
+        self.pending = False
+        self.count = 0
+        self.total_us = 0
+        self.max_us = 0
+        self.last_us = 0
+
+
+    # collects first if memory is low, the press must not run out of memory with the GC off
+    def key_down(self, number):
+        if self.pending or gc.mem_free() < self.threshold:
+            self.collect()
+        self.held.add(number)
+        gc.disable()
+
+
+    def key_up(self, number):
+        self.held.discard(number)
+        if not self.held:
+            gc.enable()
+
+
+    # called when there is nothing else to do, returns True if it has collected
+    def idle(self):
+        if self.held or (not self.pending and gc.mem_free() >= self.threshold):
+            return False
+        self.collect()
+        return True
+
+
+    # collect now, or on the next idle tick if a key is held
+    def collect_when_idle(self):
+        if self.held:
+            self.pending = True
+        else:
+            self.collect()
+
+
+    def collect(self):
+        self.pending = False
+        started = time.monotonic_ns()
+        gc.collect()
+        self.last_us = (time.monotonic_ns() - started) // 1000
+        self.count += 1
+        self.total_us += self.last_us
+        self.max_us = max(self.max_us, self.last_us)
+
+
+    def report(self):
+        return {
+            "collections": self.count,
+            "avg_us": self.total_us // self.count if self.count else 0,
+            "max_us": self.max_us,
+            "last_us": self.last_us,
+            "mem_free": gc.mem_free(),
+            "threshold": self.threshold
+        }
+
+
+# watches the pings of the watchdog ("Ping: <seq> <ms until the next ping>")
+# the host counts as lost when nothing has been received for TIMEOUT_FACTOR
+# times the announced interval, hosts that never send a ping are never lost
+class HostMonitor:
+    TIMEOUT_FACTOR = 3
+
+    def __init__(self):
+        self.online = True
+        self.pings = 0
+        self.lost = 0
+        self.timeout_ns = 0
+        self.last_seen = time.monotonic_ns()
+        self.last_ping = 0
+
+
+    # called for every message of the host, returns True if the host has been lost before
+    def seen(self):
+        self.last_seen = time.monotonic_ns()
+        if self.online:
+            return False
+        self.online = True
+        return True
+
+
+    def ping(self, interval_ms):
+        self.pings += 1
+        self.last_ping = self.last_seen
+        self.timeout_ns = interval_ms * 1000000 * self.TIMEOUT_FACTOR
+
+
+    # returns True once when the host is lost
+    def check(self):
+        if not self.online or not self.timeout_ns or time.monotonic_ns() - self.last_seen < self.timeout_ns:
+            return False
+        self.online = False
+        self.lost += 1
+        return True
+
+
+    def report(self):
+        return {
+            "online": self.online,
+            "pings": self.pings,
+            "last_ping_ms": (time.monotonic_ns() - self.last_ping) // 1000000 if self.last_ping else None,
+            "timeout_ms": self.timeout_ns // 1000000,
+            "host_lost": self.lost
+        }
+
+
+# sends compiled macros, a list of 8 byte keyboard reports and delays (floats, in seconds)
+# the reports are sent at most "rate" per second (0: as fast as the host takes them),
+# the reached rate is measured without the delays
+class MacroPlayer:
+    RATE = 125
+    # the last keys of a macro stay pressed at least this long, whatever the rate
+    HOLD = 25000000
+
+    def __init__(self, device, rate=RATE):
+        self.device = device
+        self.rate = rate
+        self.macros = 0
+        self.reports = 0
+        self.active_ns = 0
+        self.send_ns = 0
+        self.max_send_us = 0
+
+
+    # returns the time of the first report in ns
+    def play(self, macro):
+        interval = 1000000000 // self.rate if self.rate else 0
+        started = time.monotonic_ns()
+        first = 0
+        delays = 0
+        next_report = 0
+        last = len(macro) - 1
+        for index, item in enumerate(macro):
+            if isinstance(item, float):
+                time.sleep(item)
+                delays += int(item * 1000000000)
+                next_report = 0
+                continue
+            if index == last and next_report and not any(item):
+                # apps that check which keys are held need some time to see them
+                hold = max(self.HOLD - interval, 0)
+                next_report += hold
+                delays += hold
+            now = time.monotonic_ns()
+            if now < next_report:
+                time.sleep((next_report - now) / 1000000000)
+                now = time.monotonic_ns()
+            self.device.send_report(item)
+            sent = time.monotonic_ns()
+            first = first or sent
+            self.send_ns += sent - now
+            self.max_send_us = max(self.max_send_us, (sent - now) // 1000)
+            self.reports += 1
+            next_report = now + interval
+        self.macros += 1
+        # the slot of the last report counts as well, the next macro can't start earlier
+        self.active_ns += max(time.monotonic_ns(), next_report) - started - delays
+        return first
+
+
+    def report(self):
+        return {
+            "macros": self.macros,
+            "reports": self.reports,
+            "target_rate": self.rate,
+            "rate": self.reports * 1000000000 // self.active_ns if self.active_ns else 0,
+            "avg_send_us": self.send_ns // self.reports // 1000 if self.reports else 0,
+            "max_send_us": self.max_send_us
+        }
 
 
 class KeyController:
     JSON_FILE = "key_def.json"
-    # https://docs.circuitpython.org/projects/hid/en/latest/_modules/adafruit_hid/keycode.html
 
     # mapping for the keycodes
-    KEYCODE_MAPPING = {name: getattr(Keycode, name) for name in dir(
-        Keycode) if not name.startswith("__")}
+    KEYCODE_MAPPING = KEYCODES
 
     # mapping for rotating the keys
     CW = [12, 8, 4, 0, 13, 9, 5, 1, 14, 10, 6, 2, 15, 11, 7, 3]
@@ -29,17 +669,35 @@ class KeyController:
 
     # initialize the key controller
     def __init__(self, verbose=False):
+        # only the default layout is loaded here, so the keys light up as early as possible
+        # the other applications, folders and urls are loaded by finish_setup()
         # initialize the keypad and keyboard
         self.keypad = RgbKeypad()
         self.keyboard = Keyboard(usb_hid.devices)
-        self.layout = KeyboardLayoutUS(self.keyboard)
         self.keys = self.keypad.keys
-        # load and process the json file
+        self.link = FramedLink(usb_cdc.console.write)
+        self.profiler = LatencyProfiler()
+        self.scan_started = 0
+        self.received_at = 0
+        self.gc = GcScheduler()
+        self.host = HostMonitor()
+        # the layout and folders to restore when the host is back
+        self.online_config = None
+        boot_mark("hardware")
+        # load the json file and the default layout
         self.json = self.parse_json(self.JSON_FILE)
+        boot_mark("json")
+        self.macros = MacroPlayer(find_device(usb_hid.devices, usage_page=0x1, usage=0x06),
+                                  self.json.get("settings", {}).get("hid_report_rate", MacroPlayer.RATE))
         self.global_config = self.process_global_section(self.json)
-        self.apps = self.process_app_section(self.json)
-        self.folders = self.process_folder_section(self.json)
-        self.urls = self.process_url_section(self.json)
+        self.apps = {}
+        if "_otherwise" in self.json["applications"]:
+            self.apps["_otherwise"] = self.load_single_app_config("_otherwise", self.json["applications"]["_otherwise"], self.json) or {}
+        self.folders = {}
+        self.urls = {}
+        self.url_matcher = None
+        self.setup_pending = True
+        self.pending_folder = None
         self.current_config = self.apps.get("_otherwise", {})
         # rotate the keys if needed
         self.rotate = self.json["settings"]["rotate"].upper() if "rotate" in self.json.get("settings", {}) else ''
@@ -48,12 +706,53 @@ class KeyController:
         self.verbose = verbose
         self.autoclose_current_folder = False
         self.folder_stack = [] 
+        # states published by the plugins, e.g. {"hue.toggle 'desk'": True}
+        self.plugin_states = {}
+        boot_mark("default_config")
         #  load the key layout
         self.update_keys()
+        boot_mark("first_update_keys")
+
+
+    # load the rest of the config, runs after the first key scan or before a message needs it
+    # only called from the main loop, never from a key handler
+    def finish_setup(self):
+        if not self.setup_pending:
+            return
+        self.setup_pending = False
+        self.apps = self.process_app_section(self.json)
+        self.folders = self.process_folder_section(self.json)
+        self.urls = self.process_url_section(self.json)
+        self.url_matcher = UrlMatcher(self.urls)
+        self.gc.threshold = self.json.get("settings", {}).get("gc_threshold", GcScheduler.THRESHOLD)
+        self.offline_layout = self.json.get("settings", {}).get("offline_layout", "_offline")
+        boot_mark("deferred_config")
+        # drop the garbage of parsing the config, but don't delay a held key
+        self.gc.collect_when_idle()
+        boot_mark("gc")
+        # let the watchdog know that it has to send the current app again
+        try:
+            self.link.send("Ready")
+        except Exception as e:
+            pass
+        # a folder key pressed during the first key scan
+        if self.pending_folder is not None:
+            folder, self.pending_folder = self.pending_folder, None
+            self.open_folder(folder)
+
+
+    # the duration of each boot stage in µs
+    def boot_report(self):
+        return [[stage, (end - BOOT_MARKS[i][1]) // 1000] for i, (stage, end) in enumerate(BOOT_MARKS[1:])] + \
+            [["total", (BOOT_MARKS[-1][1] - BOOT_MARKS[0][1]) // 1000]]
 
 
     # open a folder and display the key layout
     def open_folder(self, folder):
+        if self.setup_pending:
+            # the folders are loaded by the main loop right after this key scan
+            self.pending_folder = folder
+            return
         if folder in self.folders:
             self.folder_stack.append(self.current_config)
             self.current_config = self.folders[folder]
@@ -73,6 +772,7 @@ class KeyController:
 
     # handle the key press
     def key_press_action(self, key):
+        self.gc.key_down(key.number)
         if key.number not in self.current_config:
             return
         key_def = self.current_config[key.number]
@@ -80,7 +780,6 @@ class KeyController:
         folder = key_def.get('folder')
         app = key_def.get('application')
         keys = key_def.get('key_sequences')
-        pressedUntilReleased = key_def.get('pressedUntilReleased')
         pressedColor = key_def.get('pressedColor')
         # turn off the LED
         key.led_off()
@@ -91,10 +790,12 @@ class KeyController:
             someAction = False
         elif isinstance(action, tuple):
             self.send_plugin_command(*action)
+        elif isinstance(action, list):
+            self.send_plugin_commands(action)
         elif app:
             self.send_application_name(app)
         elif keys:
-            self.handle_key_sequences(keys, pressedUntilReleased)
+            self.handle_key_sequences(key_def['macro'])
             if pressedColor:
                 key.set_led(*pressedColor)
         # close the folder if needed
@@ -103,6 +804,7 @@ class KeyController:
 
     # handle the key release
     def key_release_action(self, key):
+        self.gc.key_up(key.number)
         if key.number not in self.current_config:
             return
         key_def = self.current_config[key.number]
@@ -121,23 +823,70 @@ class KeyController:
             key.set_led(*color) 
 
 
-    # handle the key sequences
-    def handle_key_sequences(self, key_sequences, pressedUntilReleased):
+    # send the compiled key sequences
+    def handle_key_sequences(self, macro):
+        first_report = self.macros.play(macro)
+        if self.profiler.enabled and self.scan_started and first_report:
+            self.profiler.record(LatencyProfiler.SCAN_TO_HID, self.scan_started, first_report)
+            self.scan_started = 0
+
+
+    # compile key sequences into keyboard reports (modifier bits, 0, up to six keycodes) and delays
+    # keys stay pressed until a delay or the end, like holding them down one after another,
+    # text is typed key by key with a release after each character (like adafruit's KeyboardLayout),
+    # a report that doesn't change anything is left out
+    def compile_macro(self, key_sequences, pressedUntilReleased):
+        macro = []
+        released = bytes(8)
+        last = [released]
+        modifiers = 0
+        keys = []
+
+        def add(report):
+            if report != last[0]:
+                macro.append(report)
+                last[0] = report
+
+        def report(modifiers, keys):
+            if len(keys) > 6:
+                raise ValueError(f"Error: More than six keys pressed at once in {key_sequences}")
+            return bytes([modifiers, 0] + keys + [0] * (6 - len(keys)))
+
+        # a key_sequence string is a single key combination
+        if key_sequences and all(isinstance(item, int) for item in key_sequences):
+            key_sequences = (key_sequences,)
         for item in key_sequences:
-            # is it a delay?
             if isinstance(item, float):
-                self.keyboard.release_all()
-                time.sleep(item)
-            # is it a key sequence?
-            elif isinstance(item, tuple):
-                self.keyboard.press(*item)
-            # is it a single key?
+                add(released)
+                macro.append(item)
+                modifiers, keys = 0, []
+            elif isinstance(item, dict):
+                for char in item.get('text', ''):
+                    shift, keycode = self.text_keycode(char)
+                    # hosts can miss repeated keys or apply a shift change to the wrong key otherwise
+                    add(released)
+                    add(report(shift, [keycode]))
+                add(released)
+                modifiers, keys = 0, []
             else:
-                self.keyboard.press(item)
-        # release all keys
+                for keycode in (item if isinstance(item, tuple) else (item,)):
+                    if 0xE0 <= keycode <= 0xE7:
+                        modifiers |= 1 << (keycode - 0xE0)
+                    elif keycode not in keys:
+                        keys.append(keycode)
+                add(report(modifiers, keys))
         if not pressedUntilReleased:
-            time.sleep(0.025);
-            self.keyboard.release_all()
+            add(released)
+        return macro
+
+
+    # the shift modifier bit and keycode of a character of typed text
+    def text_keycode(self, char):
+        if char != "\0" and char in TEXT_KEYS:
+            return 0, 0x04 + TEXT_KEYS.find(char)
+        if char != "\0" and char in TEXT_SHIFT_KEYS:
+            return 0x02, 0x04 + TEXT_SHIFT_KEYS.find(char)
+        raise ValueError(f"Error: Can't type '{char}' with the US keyboard layout.")
 
 
     # update the key layout
@@ -145,7 +894,7 @@ class KeyController:
         for key in self.keys:
             # is there a key definition for this key?
             if key.number in self.current_config:
-                color = self.current_config[key.number]['color']
+                color = self.key_color(self.current_config[key.number])
                 if color:
                     key.set_led(*color);
                 else:
@@ -156,25 +905,36 @@ class KeyController:
             # no key definition found
             else:            
                 key.led_off()
+                # the release of this key won't be reported anymore
+                self.gc.key_up(key.number)
                 self.keypad.on_press(key, lambda _, key=key: None)
                 self.keypad.on_release(key, lambda _, key=key: None)
 
 
-    # read a line from the serial console
-    def read_serial_line(self):
+    # the color of a key, keys with a plugin action show their toggleColor while its state is on
+    def key_color(self, key_def):
+        action = key_def.get('action')
+        if isinstance(action, tuple) and key_def.get('toggleColor') and self.plugin_states.get(self.state_binding(action)):
+            return key_def['toggleColor']
+        return key_def['color']
+
+
+    # the state name of a plugin action, case insensitive, e.g. "hue.toggle 'desk'"
+    def state_binding(self, action):
+        return f"{action[0]}.{action[1]}".lower()
+
+
+    # read the received lines and frames from the serial console
+    def read_serial_messages(self):
         if usb_cdc.console.in_waiting > 0:
-            raw_data = usb_cdc.console.readline()
-            try:
-                return raw_data.decode("utf-8").strip()
-            except UnicodeDecodeError:
-                pass
+            return self.link.receive(usb_cdc.console.read(usb_cdc.console.in_waiting))
         return None
 
 
     # send the application name via serial
     def send_application_name(self, app_name):
         try:
-            usb_cdc.console.write(f"Launch: {app_name}\n".encode('utf-8'))
+            self.link.send(f"Launch: {app_name}")
         except Exception as e:
             pass
 
@@ -182,7 +942,15 @@ class KeyController:
     # send the plugin command via serial
     def send_plugin_command(self, plugin, command):
         try:
-            usb_cdc.console.write(f"Run: {plugin}.{command}\n".encode('utf-8'))
+            self.link.send(f"Run: {plugin}.{command}")
+        except Exception as e:
+            pass
+
+
+    # send the commands of an action list in a single line, the watchdog runs them
+    def send_plugin_commands(self, commands):
+        try:
+            self.link.send("Run: " + json.dumps(commands))
         except Exception as e:
             pass
 
@@ -218,8 +986,12 @@ class KeyController:
             return False
 
 
-    # convert the action string to a tuple
+    # convert the action string to a tuple, an action list stays a list of plugin commands
     def convert_action_string(self, action):
+        if isinstance(action, list):
+            commands = [command for command in action if isinstance(command, str) and '.' in command]
+            # a list without a valid command is no action at all
+            return commands if commands else ''
         if action and '.' in action:
             return tuple(action.split('.',1))
         else:
@@ -258,7 +1030,9 @@ class KeyController:
             'pressedColor': self.color_string_to_tuple(config.get('pressedColor', '')),
 
             'description': config.get('description', ''),
-            'pressedUntilReleased': config.get('pressedUntilReleased', '')
+            'pressedUntilReleased': config.get('pressedUntilReleased', ''),
+            # the HID reports of the key sequences, compiled once
+            'macro': self.compile_macro(key_sequences, config.get('pressedUntilReleased', ''))
         }
 
     
@@ -385,52 +1159,193 @@ class KeyController:
             self.apps[app_name] = self.load_single_app_config(app_name, self.json["applications"][app_name], self.json)
 
 
+    # process the state serial command, only the LEDs of the affected keys are updated
+    def process_state(self, serial_str):
+        try:
+            states = json.loads(serial_str[7:])
+        except ValueError:
+            return
+        if not isinstance(states, dict):
+            return
+        states = {binding.lower(): state for binding, state in states.items()}
+        self.plugin_states.update(states)
+        for key in self.keys:
+            key_def = self.current_config.get(key.number)
+            if key_def is None:
+                continue
+            action = key_def.get('action')
+            if isinstance(action, tuple) and self.state_binding(action) in states and key_def['color']:
+                key.set_led(*self.key_color(key_def))
+
+
     #  process the app serial command
     def process_app(self, serial_str):
         app_name, url = self.parse_app_name_and_url(serial_str[5:])
-        if url in self.urls:
-            self.current_config = self.urls[url]
+        url_config = self.url_matcher.match(url)
+        if url_config is not None:
+            self.current_config = url_config
         else:
             self.current_config = self.apps.get(app_name, self.apps.get("_otherwise", {}))
         self.current_config = self.rotate_keys_if_needed()
-        self.update_keys()
+        if self.profiler.enabled:
+            started = time.monotonic_ns()
+            self.update_keys()
+            self.profiler.record(LatencyProfiler.UPDATE_KEYS, started)
+            if self.received_at:
+                self.profiler.record(LatencyProfiler.APP_TO_KEYS, self.received_at)
+        else:
+            self.update_keys()
 
 
     # parse the app name and url
     def parse_app_name_and_url(self, serial_str):
         split_app_name = serial_str.split(" (", 1)
         app_name = split_app_name[0]
-        url = split_app_name[1].rstrip(')') if len(split_app_name) > 1 else None
+        url = split_app_name[1][:-1] if len(split_app_name) > 1 and split_app_name[1].endswith(')') else None
         return app_name, url
 
 
-    # process the ping serial command
-    def process_ping(self):
-        return
+    # process the profile serial command: on, off, reset or query
+    def process_profile(self, serial_str):
+        command = serial_str[9:]
+        if command == "on":
+            self.profiler.enabled = True
+        elif command == "off":
+            self.profiler.enabled = False
+        elif command == "reset":
+            self.profiler.reset()
+        elif command == "query":
+            try:
+                self.link.send("Profile: " + json.dumps(self.profiler.report()))
+            except Exception as e:
+                pass
+
+
+    # process the gc serial command: collect or query
+    def process_gc(self, serial_str):
+        command = serial_str[4:]
+        if command == "collect":
+            self.gc.collect()
+        elif command == "query":
+            try:
+                self.link.send("Gc: " + json.dumps(self.gc.report()))
+            except Exception as e:
+                pass
+
+
+    # process the ping serial command, answers with the sequence number and the uptime in ms
+    def process_ping(self, serial_str):
+        parts = serial_str[6:].split(" ")
+        try:
+            self.host.ping(int(parts[1]) if len(parts) > 1 else 0)
+            self.link.send(f"Pong: {parts[0]} {time.monotonic_ns() // 1000000}")
+        except Exception as e:
+            pass
+
+
+    # process the hid serial command, reports the number and rate of the sent keyboard reports
+    def process_hid(self, serial_str):
+        if serial_str[5:] == "query":
+            try:
+                self.link.send("Hid: " + json.dumps(self.macros.report()))
+            except Exception as e:
+                pass
+
+
+    # process the link serial command, reports the pings seen by the keypad
+    def process_link(self, serial_str):
+        if serial_str[6:] == "query":
+            try:
+                self.link.send("Link: " + json.dumps(self.host.report()))
+            except Exception as e:
+                pass
+
+
+    # the host has stopped sending, switch to the offline layout if there is one
+    def host_lost(self):
+        if self.offline_layout not in self.apps:
+            return
+        self.online_config = (self.current_config, self.folder_stack)
+        self.folder_stack = []
+        self.current_config = self.apps[self.offline_layout]
+        self.current_config = self.rotate_keys_if_needed()
+        self.update_keys()
+
+
+    # the host is back, restore the layout and let the watchdog send its current state
+    def host_returned(self):
+        if self.online_config is None:
+            return
+        self.current_config, self.folder_stack = self.online_config
+        self.online_config = None
+        self.update_keys()
+        try:
+            self.link.send("Ready")
+        except Exception as e:
+            pass
+
+
+    # process the boot serial command, reports the boot profile
+    def process_boot(self, serial_str):
+        if serial_str[6:] == "query":
+            try:
+                self.link.send("Boot: " + json.dumps(self.boot_report()))
+            except Exception as e:
+                pass
 
 
     # process the serial string
     def process_serial_str(self, serial_str):
-            # process the ping command
-        if serial_str is ".":
-            self.process_ping();
-        if serial_str.startswith("Rotate: "):
+        # the layouts are needed for every message
+        self.finish_setup()
+        if self.host.seen():
+            self.host_returned()
+        # the heartbeat of older watchdogs
+        if serial_str == ".":
+            return
+        if serial_str.startswith("Ping: "):
+            self.process_ping(serial_str)
+        elif serial_str.startswith("Rotate: "):
             self.process_rotate(serial_str)
         elif serial_str.startswith("Terminated: "):
             self.process_terminated(serial_str)
         elif serial_str.startswith("App: "):
             self.process_app(serial_str)
+        elif serial_str.startswith("State: "):
+            self.process_state(serial_str)
+        elif serial_str.startswith("Profile: "):
+            self.process_profile(serial_str)
+        elif serial_str.startswith("Gc: "):
+            self.process_gc(serial_str)
+        elif serial_str.startswith("Boot: "):
+            self.process_boot(serial_str)
+        elif serial_str.startswith("Link: "):
+            self.process_link(serial_str)
+        elif serial_str.startswith("Hid: "):
+            self.process_hid(serial_str)
 
 
     # main loop
     def run(self):
         while True:
-            serial_str = self.read_serial_line()
-            if serial_str is not None:
-                self.process_serial_str(serial_str)
+            messages = self.read_serial_messages()
+            if messages:
+                if self.profiler.enabled:
+                    self.received_at = time.monotonic_ns()
+                for serial_str in messages:
+                    self.process_serial_str(serial_str)
             else:
                 time.sleep(0.1)
+                if self.profiler.enabled:
+                    self.scan_started = time.monotonic_ns()
                 self.keypad.update()
+                if self.setup_pending:
+                    self.finish_setup()
+                else:
+                    if self.host.check():
+                        self.host_lost()
+                    self.gc.idle()
+            self.link.poll()
 
 
 # main program